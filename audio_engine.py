@@ -0,0 +1,274 @@
+import re
+import subprocess
+import threading
+import numpy as np
+
+# Định dạng PCM dùng chung khi trộn: float32 xen kẽ, 44.1kHz stereo
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+# Codec cho từng loại file đầu ra: audio trung gian lưu lossless, audio cuối mã hóa AAC một lần
+CODECS = {
+    ".flac": ['-c:a', 'flac'],
+    ".wav": ['-c:a', 'pcm_s16le'],
+    ".m4a": ['-c:a', 'aac', '-aac_coder', 'fast', '-b:a', '192k'],
+    ".mp3": ['-c:a', 'libmp3lame', '-b:a', '192k'],
+}
+
+
+class AudioResult:
+    """Kết quả của bước audio, dùng trực tiếp cho các bước sau (không cần đọc lại file)
+
+    path là audio cuối cùng (đã trộn nhạc nền), narration_path là giọng đọc gốc
+    dùng cho Whisper. samples có thể là None khi audio lấy từ cache; pcm() sẽ
+    giải mã khi thật sự cần.
+    """
+
+    def __init__(self, path, narration_path, duration, sample_rate=SAMPLE_RATE, samples=None):
+        self.path = path
+        self.narration_path = narration_path
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.samples = samples
+
+    def pcm(self):
+        """Mảng float32 (số mẫu, channels) của audio cuối cùng"""
+        if self.samples is None:
+            self.samples = decode_audio(self.path, self.sample_rate)
+        return self.samples
+
+    def __repr__(self):
+        return f"AudioResult(path={self.path!r}, duration={self.duration:.2f}s)"
+
+
+def decode_audio(path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """Giải mã một file audio thành mảng float32 (số mẫu, channels) qua pipe ffmpeg"""
+    cmd = [
+        'ffmpeg', '-loglevel', 'error',
+        '-i', path,
+        '-f', 'f32le', '-acodec', 'pcm_f32le',
+        '-ac', str(channels), '-ar', str(sample_rate),
+        '-',
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise Exception(
+            f"ffmpeg không giải mã được {path}: {result.stderr.decode('utf-8', errors='replace').strip()}"
+        )
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels)
+
+
+def probe_duration(path):
+    """Thời lượng file audio (giây) đọc từ header qua ffmpeg -i, None nếu không đọc được"""
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-i', path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    match = re.search(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _encode_command(output_path, sample_rate, channels):
+    extension = output_path[output_path.rfind("."):].lower()
+    if extension not in CODECS:
+        raise Exception(f"Định dạng audio không hỗ trợ: {output_path}")
+    return [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels),
+        '-i', '-',
+        *CODECS[extension],
+        output_path,
+    ]
+
+
+def encode_audio(samples, output_path, sample_rate=SAMPLE_RATE):
+    """Mã hóa mảng float32 (số mẫu, channels) ra file, codec chọn theo đuôi file
+
+    Hàm chỉ trả về sau khi tiến trình ffmpeg đã thoát với mã 0, tức file đã ghi xong.
+    """
+    samples = np.ascontiguousarray(samples, dtype=np.float32)
+    cmd = _encode_command(output_path, sample_rate, samples.shape[1])
+    result = subprocess.run(cmd, input=memoryview(samples).cast("B"), stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise Exception(
+            f"ffmpeg không ghi được {output_path}: {result.stderr.decode('utf-8', errors='replace').strip()}"
+        )
+    return output_path
+
+
+def loop_to_length(samples, length):
+    """Lặp (np.tile) rồi cắt mảng audio cho đúng length mẫu"""
+    if len(samples) == 0:
+        return np.zeros((length, samples.shape[1]), dtype=np.float32)
+    repeats = -(-length // len(samples))
+    if repeats > 1:
+        samples = np.tile(samples, (repeats, 1))
+    return samples[:length]
+
+
+def mix(narration, music, narration_gain=1.0, music_gain=1.0, master_gain=1.0, out=None):
+    """Trộn giọng đọc với nhạc nền (đã lặp đủ dài) bằng phép nhân/cộng vector, cắt về [-1, 1]"""
+    out = np.multiply(narration, np.float32(narration_gain * master_gain), out=out)
+    if music is not None:
+        out += loop_to_length(music, len(out)) * np.float32(music_gain * master_gain)
+    np.clip(out, -1.0, 1.0, out=out)
+    return out
+
+
+class PCMReader:
+    """Đọc PCM float32 từ một hoặc nhiều file nối tiếp qua pipe ffmpeg, theo từng khối
+
+    Chỉ một tiến trình ffmpeg chạy tại một thời điểm và dữ liệu được đọc thẳng
+    vào bộ đệm của khối, nên bộ nhớ không phụ thuộc độ dài audio. Với loop=True
+    danh sách file được đọc lại từ đầu khi hết (dùng cho nhạc nền).
+    on_file_end(path, số mẫu, lỗi) được gọi khi đọc xong mỗi file.
+    """
+
+    def __init__(self, paths, loop=False, sample_rate=SAMPLE_RATE, channels=CHANNELS,
+                 on_file_end=None):
+        self.paths = list(paths)
+        self.loop = loop
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.on_file_end = on_file_end
+        self.process = None
+        self.frames_read = 0
+        self._index = 0
+        self._path = None
+        self._file_frames = 0
+        self._cycle_frames = 0
+
+    def _open_next(self):
+        if self._index >= len(self.paths):
+            if not self.loop or not self.paths:
+                return False
+            if self._cycle_frames == 0:
+                raise Exception("Không đọc được mẫu nào từ audio lặp lại")
+            self._index = 0
+            self._cycle_frames = 0
+        self._path = self.paths[self._index]
+        self._index += 1
+        self._file_frames = 0
+        self.process = subprocess.Popen(
+            [
+                'ffmpeg', '-loglevel', 'error',
+                '-i', self._path,
+                '-f', 'f32le', '-acodec', 'pcm_f32le',
+                '-ac', str(self.channels), '-ar', str(self.sample_rate),
+                '-',
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        return True
+
+    def _finish_file(self):
+        process, self.process = self.process, None
+        process.stdout.close()
+        stderr = process.stderr.read().decode("utf-8", errors="replace").strip()
+        process.stderr.close()
+        error = None
+        if process.wait() != 0:
+            error = stderr or f"ffmpeg thoát với mã {process.returncode}"
+        if self.on_file_end:
+            self.on_file_end(self._path, self._file_frames, error)
+        elif error:
+            raise Exception(f"ffmpeg không giải mã được {self._path}: {error}")
+
+    def read(self, frames):
+        """Đọc tối đa frames mẫu; trả về ít hơn chỉ khi đã hết dữ liệu"""
+        block = np.empty((frames, self.channels), dtype=np.float32)
+        buffer = memoryview(block).cast("B")
+        frame_bytes = 4 * self.channels
+        filled = 0
+        while filled < len(buffer):
+            if self.process is None and not self._open_next():
+                break
+            n = self.process.stdout.readinto(buffer[filled:])
+            if n:
+                filled += n
+                self._file_frames += n // frame_bytes
+                self._cycle_frames += n // frame_bytes
+            else:
+                self._finish_file()
+        count = filled // frame_bytes
+        self.frames_read += count
+        return block[:count]
+
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process.stderr.close()
+            self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AudioStreamWriter:
+    """Mã hóa audio tăng dần: nhận từng khối PCM float32 qua stdin của một tiến trình ffmpeg"""
+
+    def __init__(self, output_path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.output_path = output_path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames_written = 0
+        self.process = None
+        self._stderr = []
+        self._stderr_thread = None
+
+    def open(self):
+        self.process = subprocess.Popen(
+            _encode_command(self.output_path, self.sample_rate, self.channels),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        # Đọc stderr ở thread riêng để ffmpeg không bị chặn
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+        return self
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self._stderr.append(line.decode("utf-8", errors="replace"))
+
+    def write(self, block):
+        if len(block) == 0:
+            return
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        self.process.stdin.write(memoryview(block).cast("B"))
+        self.frames_written += len(block)
+
+    def close(self):
+        """Đóng stdin và đợi ffmpeg thoát; file chỉ hợp lệ khi mã thoát bằng 0"""
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        process.stdin.close()
+        returncode = process.wait()
+        self._stderr_thread.join()
+        if returncode != 0:
+            raise Exception(f"ffmpeg không ghi được {self.output_path}: {''.join(self._stderr).strip()}")
+
+    def abort(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
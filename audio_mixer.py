@@ -0,0 +1,182 @@
+import numpy as np
+from scipy.ndimage import maximum_filter1d, minimum_filter1d, uniform_filter1d
+from audio_engine import SAMPLE_RATE, CHANNELS
+
+
+def db_to_gain(db):
+    return np.power(10.0, np.asarray(db) / 20.0)
+
+
+def gain_to_db(gain):
+    return 20.0 * np.log10(np.maximum(gain, 1e-12))
+
+
+class LoudnessMeter:
+    """Đo độ lớn trung bình (dBFS RMS) có cổng lọc im lặng, nhận dữ liệu theo từng khối
+
+    Năng lượng được tính theo khung 400ms; bỏ các khung dưới -70 dBFS rồi bỏ
+    tiếp các khung thấp hơn trung bình 10 dB (giống cách gate của EBU R128),
+    nên khoảng lặng giữa các câu không kéo mức đo xuống.
+    """
+
+    FRAME_SECONDS = 0.4
+    ABSOLUTE_GATE_DB = -70.0
+    RELATIVE_GATE_DB = -10.0
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.frame = int(sample_rate * self.FRAME_SECONDS)
+        self._powers = []
+        self._remainder = np.zeros(0, dtype=np.float32)
+
+    def add(self, block):
+        mono = np.concatenate([self._remainder, block.mean(axis=1)])
+        frames = len(mono) // self.frame
+        if frames:
+            self._powers.append(
+                np.mean(np.square(mono[:frames * self.frame].reshape(frames, self.frame)), axis=1)
+            )
+        self._remainder = mono[frames * self.frame:]
+
+    def loudness_db(self):
+        """Độ lớn đã gate (dBFS), None nếu toàn bộ là im lặng"""
+        powers = np.concatenate(self._powers) if self._powers else np.zeros(0)
+        if len(self._remainder):
+            powers = np.append(powers, np.mean(np.square(self._remainder)))
+        powers = powers[gain_to_db(np.sqrt(powers)) > self.ABSOLUTE_GATE_DB]
+        if len(powers) == 0:
+            return None
+        gate = np.mean(powers) * 10.0 ** (self.RELATIVE_GATE_DB / 10.0)
+        gated = powers[powers >= gate]
+        return float(10.0 * np.log10(np.mean(gated)))
+
+    @classmethod
+    def measure(cls, samples, sample_rate=SAMPLE_RATE):
+        meter = cls(sample_rate)
+        meter.add(samples)
+        return meter.loudness_db()
+
+
+class DuckingMixer:
+    """Trộn giọng đọc và nhạc nền với chuẩn hóa độ lớn, ducking và limiter nhìn trước
+
+    - Giọng đọc được đưa về target_db, nhạc nền về music_db (đo bằng LoudnessMeter).
+    - Đường bao RMS của giọng đọc (cửa sổ 400ms) điều khiển mức giảm nhạc nền
+      (tối đa duck_db), bắt đầu giảm trước khi có tiếng nói và nhả dần sau đó.
+    - Limiter nhìn trước giữ đỉnh dưới ceiling_db mà không cắt méo.
+
+    process() xử lý cả mảng; process_block()/flush() cho kết quả giống hệt khi
+    dữ liệu đến theo từng khối với kích thước bất kỳ, trễ context mẫu (~0.66 s).
+    """
+
+    WINDOW_SECONDS = 0.4
+    HOLD_SECONDS = 0.2
+    RELEASE_SECONDS = 0.5
+    LOOKAHEAD_SECONDS = 0.005
+    # Ngưỡng coi là có tiếng nói, tính từ target_db; ducking tăng dần trong 6 dB
+    SPEECH_THRESHOLD_DB = -20.0
+    SPEECH_RAMP_DB = 6.0
+
+    def __init__(self, narration_loudness, music_loudness=None, target_db=-16.0, music_db=-30.0,
+                 duck_db=10.0, ceiling_db=-1.0, sample_rate=SAMPLE_RATE):
+        self.narration_gain = float(db_to_gain(target_db - narration_loudness)) if narration_loudness is not None else 1.0
+        self.music_gain = float(db_to_gain(music_db - music_loudness)) if music_loudness is not None else 0.0
+        self.duck_db = duck_db
+        self.ceiling = float(db_to_gain(ceiling_db))
+        self.speech_threshold_db = target_db + self.SPEECH_THRESHOLD_DB
+
+        def odd(seconds):
+            return 2 * int(seconds * sample_rate / 2) + 1
+
+        self.window_size = odd(self.WINDOW_SECONDS)
+        self.hold_size = odd(2 * self.HOLD_SECONDS)
+        self.release_size = odd(self.RELEASE_SECONDS)
+        self.lookahead_size = odd(2 * self.LOOKAHEAD_SECONDS)
+        # Số mẫu lân cận cần có ở mỗi phía để lọc một đoạn cho kết quả như lọc cả mảng
+        self.context = (self.window_size + self.hold_size + self.release_size) // 2 + self.lookahead_size
+        self._tail = None
+        self._pending = None
+
+    @classmethod
+    def from_settings(cls, settings, narration_loudness, music_loudness=None):
+        return cls(
+            narration_loudness, music_loudness,
+            target_db=settings.mix_target_db,
+            music_db=settings.mix_music_db,
+            duck_db=settings.mix_duck_db,
+            ceiling_db=settings.mix_ceiling_db,
+        )
+
+    def _render(self, narration, music, start, stop):
+        out = narration * np.float32(self.narration_gain)
+        if music is not None and self.music_gain > 0:
+            # Đường bao RMS của giọng đọc -> mức hoạt động 0..1 -> hệ số duck
+            power = np.mean(np.square(out), axis=1)
+            # Tổng trượt có thể hơi âm do sai số làm tròn ở đoạn im lặng
+            mean_power = np.maximum(uniform_filter1d(power, self.window_size, mode="nearest"), 0.0)
+            rms_db = gain_to_db(np.sqrt(mean_power))
+            activity = np.clip((rms_db - self.speech_threshold_db) / self.SPEECH_RAMP_DB, 0.0, 1.0)
+            activity = maximum_filter1d(activity, self.hold_size, mode="nearest")
+            activity = uniform_filter1d(activity, self.release_size, mode="nearest")
+            music_gain = (self.music_gain * db_to_gain(-self.duck_db * activity)).astype(np.float32)
+            out += music * music_gain[:, None]
+
+        # Limiter nhìn trước: min-filter rồi làm trơn cùng độ rộng nên hệ số luôn
+        # không lớn hơn mức cần thiết tại mỗi đỉnh
+        peak = np.max(np.abs(out), axis=1)
+        gain = np.minimum(1.0, self.ceiling / np.maximum(peak, 1e-9))
+        gain = minimum_filter1d(gain, self.lookahead_size, mode="nearest")
+        gain = uniform_filter1d(gain, self.lookahead_size, mode="nearest")
+        out = out[start:stop]
+        out *= gain[start:stop, None].astype(np.float32)
+        np.clip(out, -self.ceiling, self.ceiling, out=out)
+        return out
+
+    def process(self, narration, music=None):
+        """Trộn toàn bộ mảng (music đã lặp đủ dài hoặc None)"""
+        return self._render(narration, music, 0, len(narration))
+
+    def process_block(self, narration, music=None):
+        """Nhận một khối, trả về phần đã trộn xong (có thể rỗng)
+
+        Mẫu chỉ được trộn khi đã có đủ context mẫu phía sau nó để nhìn trước, nên
+        kết quả giống hệt process() với mọi kích thước khối; khối nhỏ hơn context
+        được giữ lại chờ khối sau.
+        """
+        if music is None:
+            music = np.zeros_like(narration) if self.music_gain > 0 else None
+        if self._pending is None:
+            self._pending = ([], [], 0)
+            self._tail = 0
+        parts_n, parts_m, size = self._pending
+        parts_n.append(narration)
+        parts_m.append(music)
+        self._pending = (parts_n, parts_m, size + len(narration))
+        # Phần đầu bộ đệm (self._tail mẫu) là dữ liệu phía trước đã trộn, giữ lại làm context
+        ready = self._pending[2] - self._tail - self.context
+        if ready <= 0:
+            return np.zeros((0, narration.shape[1]), dtype=np.float32)
+        return self._render_pending(ready)
+
+    def flush(self):
+        """Trả về phần còn lại sau khối cuối cùng"""
+        if self._pending is None:
+            return np.zeros((0, CHANNELS), dtype=np.float32)
+        out = self._render_pending(self._pending[2] - self._tail)
+        self._pending = None
+        self._tail = None
+        return out
+
+    def _render_pending(self, count):
+        parts_n, parts_m, size = self._pending
+        ext_n = np.concatenate(parts_n) if len(parts_n) > 1 else parts_n[0]
+        ext_m = None if parts_m[0] is None else (np.concatenate(parts_m) if len(parts_m) > 1 else parts_m[0])
+        start = self._tail
+        out = self._render(ext_n, ext_m, start, start + count)
+
+        # Giữ context mẫu cuối đã trộn làm dữ liệu phía trước, cùng phần chưa trộn
+        keep_from = max(0, start + count - self.context)
+        self._tail = start + count - keep_from
+        rest_n = ext_n[keep_from:].copy()
+        rest_m = None if ext_m is None else ext_m[keep_from:].copy()
+        self._pending = ([rest_n], [rest_m], len(rest_n))
+        return out
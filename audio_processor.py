@@ -1,11 +1,16 @@
 import os
 import numpy as np
-from moviepy.editor import AudioFileClip, concatenate_audioclips, CompositeAudioClip
 import json
-import time
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
+from render_cache import RenderCache, hash_file, make_key
+from render_settings import RenderSettings
+from audio_engine import (
+    SAMPLE_RATE, CHANNELS, AudioResult, AudioStreamWriter, PCMReader,
+    decode_audio, encode_audio, loop_to_length, mix, probe_duration,
+)
+from audio_mixer import DuckingMixer, LoudnessMeter
 
 class ProgressManager:
     def __init__(self):
@@ -24,17 +29,26 @@ class ProgressManager:
         self.console.print(Panel(Text(message, style="bold yellow"), border_style="yellow"))
 
 class AudioProcessor:
-    def __init__(self, config):
+    # Hệ số âm lượng khi trộn: giọng đọc 200%, nhạc nền 20% x background_music_volume, tổng 150%
+    NARRATION_GAIN = 2.0
+    MUSIC_GAIN = 0.2
+    MASTER_GAIN = 1.5
+
+    def __init__(self, config, cache=None, settings=None):
         self.config = config
-        self.audio_dir = config["video"].get("audio_dir", "audios")
-        self.background_music = config["video"].get("background_music", "")
-        self.background_music_volume = config["video"].getfloat("background_music_volume", 0.3)
+        self.settings = settings if settings is not None else RenderSettings.from_config(config)
+        self.audio_dir = self.settings.audio_dir
+        self.background_music = self.settings.background_music
+        self.background_music_volume = self.settings.background_music_volume
         self.progress = ProgressManager()
+        self.cache = cache if cache is not None else RenderCache.from_config(config)
 
     def process_audio(self, output_dir):
-        """Xử lý toàn bộ audio và trả về đường dẫn file audio cuối cùng"""
+        """Xử lý toàn bộ audio và trả về AudioResult (PCM, thời lượng, đường dẫn file)"""
         temp_audio_path = None
         temp_final_audio_path = None
+        final_audio = None
+        duration = None
         
         try:
             # Tạo thư mục temp với đường dẫn tuyệt đối
@@ -44,169 +58,136 @@ class AudioProcessor:
             
             # Bước 1: Ghép các file audio gốc
             self.progress.print_message("\nBước 1: Ghép các file audio gốc...")
-            audio_clips = []
             
             # Lấy danh sách file audio với đường dẫn tuyệt đối
-            audio_dir = os.path.abspath(self.audio_dir)
-            if not os.path.exists(audio_dir):
-                raise FileNotFoundError(f"Thư mục audio không tồn tại: {audio_dir}")
-                
-            audio_files = sorted(
-                [f for f in os.listdir(audio_dir)
-                 if f.lower().endswith((".mp3", ".wav"))]
+            audio_dir, audio_files = self.list_audio_files()
+            self.progress.print_message(f"Tìm thấy {len(audio_files)} file audio")
+            
+            # Giọng đọc đã ghép được cache (FLAC, không mất chất lượng) theo nội dung các file đầu vào
+            narration = None
+            audio_key = make_key(
+                "audio", [(f, hash_file(os.path.join(audio_dir, f))) for f in audio_files]
             )
             
-            if not audio_files:
-                raise FileNotFoundError(f"Không tìm thấy file audio nào trong thư mục: {audio_dir}")
-                
-            self.progress.print_message(f"Tìm thấy {len(audio_files)} file audio")
+            # Audio rất dài được xử lý theo từng khối để bộ nhớ không tăng theo thời lượng
+            if self.choose_audio_mode([os.path.join(audio_dir, f) for f in audio_files]) == "stream":
+                return self.process_audio_streaming(audio_dir, audio_files, temp_dir, audio_key)
             
-            # Tải từng file audio
-            for audio_file in audio_files:
-                try:
-                    audio_path = os.path.join(audio_dir, audio_file)
-                    self.progress.print_message(f"Đang xử lý file: {audio_file}")
+            cached_audio_path = self.cache.get(audio_key, ".flac")
+            if cached_audio_path:
+                temp_audio_path = cached_audio_path
+                self.progress.print_message(f"Dùng lại audio gốc từ cache: {temp_audio_path}")
+            else:
+                # Giải mã từng file một lần thành PCM float32
+                parts = []
+                for audio_file in audio_files:
+                    try:
+                        audio_path = os.path.join(audio_dir, audio_file)
+                        self.progress.print_message(f"Đang xử lý file: {audio_file}")
                     
-                    # Kiểm tra file tồn tại và có kích thước
-                    if not os.path.exists(audio_path):
-                        self.progress.print_warning(f"File không tồn tại: {audio_path}")
-                        continue
+                        # Kiểm tra file tồn tại và có kích thước
+                        if not os.path.exists(audio_path):
+                            self.progress.print_warning(f"File không tồn tại: {audio_path}")
+                            continue
                         
-                    if os.path.getsize(audio_path) == 0:
-                        self.progress.print_warning(f"File rỗng: {audio_path}")
-                        continue
+                        if os.path.getsize(audio_path) == 0:
+                            self.progress.print_warning(f"File rỗng: {audio_path}")
+                            continue
                         
-                    # Tải audio clip
-                    clip = AudioFileClip(audio_path)
-                    if clip is not None and clip.duration > 0:
-                        audio_clips.append(clip)
-                        self.progress.print_message(f"Đã tải thành công: {audio_file} (duration: {clip.duration:.2f}s)")
-                    else:
-                        self.progress.print_warning(f"Không thể tải file audio: {audio_file}")
-                        if clip:
-                            clip.close()
+                        samples = decode_audio(audio_path)
+                        if len(samples) > 0:
+                            parts.append(samples)
+                            self.progress.print_message(f"Đã tải thành công: {audio_file} (duration: {len(samples) / SAMPLE_RATE:.2f}s)")
+                        else:
+                            self.progress.print_warning(f"Không thể tải file audio: {audio_file}")
                             
-                except Exception as e:
-                    self.progress.print_warning(f"Lỗi khi xử lý file audio {audio_file}: {str(e)}")
-                    continue
-            
-            if not audio_clips:
-                raise Exception("Không thể tải bất kỳ file audio nào.")
-                
-            # Ghép các audio clip
-            self.progress.print_message(f"Đang ghép {len(audio_clips)} audio clips...")
-            final_audio = concatenate_audioclips(audio_clips)
+                    except Exception as e:
+                        self.progress.print_warning(f"Lỗi khi xử lý file audio {audio_file}: {str(e)}")
+                        continue
             
-            if final_audio is None or final_audio.duration <= 0:
-                raise Exception("Không thể ghép các audio clip.")
+                if not parts:
+                    raise Exception("Không thể tải bất kỳ file audio nào.")
                 
-            self.progress.print_message(f"Đã ghép thành công audio (tổng duration: {final_audio.duration:.2f}s)")
-            
-            # Lưu audio gốc với đường dẫn tuyệt đối
-            temp_audio_path = os.path.join(temp_dir, "temp_audio.mp3")
-            self.progress.print_message(f"Đang ghi file audio tạm: {temp_audio_path}")
+                # Ghép bằng một lần nối mảng
+                self.progress.print_message(f"Đang ghép {len(parts)} file audio...")
+                narration = np.concatenate(parts) if len(parts) > 1 else parts[0]
+                parts = None
+                self.progress.print_message(f"Đã ghép thành công audio (tổng duration: {len(narration) / SAMPLE_RATE:.2f}s)")
             
-            # Đảm bảo thư mục tồn tại
-            os.makedirs(os.path.dirname(temp_audio_path), exist_ok=True)
-            
-            # Ghi file audio
-            final_audio.write_audiofile(
-                temp_audio_path,
-                fps=44100,
-                nbytes=2,
-                codec='mp3',
-                verbose=False,
-                logger=None,
-                ffmpeg_params=['-loglevel', 'error']
-            )
-            
-            # Đóng audio clip gốc
-            final_audio.close()
-            final_audio = None
-            
-            # Đợi file được ghi xong
-            time.sleep(2)
-            
-            # Kiểm tra file đã được tạo
-            if not os.path.exists(temp_audio_path):
-                raise Exception(f"Không thể tạo file audio tạm tại: {temp_audio_path}")
+                # Lưu giọng đọc (dùng cho Whisper) dạng FLAC
+                temp_audio_path = os.path.join(temp_dir, "temp_audio.flac")
+                self.progress.print_message(f"Đang ghi file audio tạm: {temp_audio_path}")
+                encode_audio(narration, temp_audio_path)
                 
-            if os.path.getsize(temp_audio_path) == 0:
-                raise Exception("File audio tạm rỗng")
+                if os.path.getsize(temp_audio_path) == 0:
+                    raise Exception("File audio tạm rỗng")
                 
-            self.progress.print_message(f"Đã ghi file audio tạm thành công: {temp_audio_path}")
+                self.progress.print_message(f"Đã ghi file audio tạm thành công: {temp_audio_path}")
+                temp_audio_path = self.cache.put(audio_key, temp_audio_path, ".flac")
             
-            # Bước 2: Thêm nhạc nền
-            if self.background_music and os.path.exists(self.background_music):
+            # Bước 2: Trộn nhạc nền và mã hóa audio cuối cùng (AAC) đúng một lần
+            has_music = bool(self.background_music) and os.path.exists(self.background_music)
+            if has_music:
                 self.progress.print_message("\nBước 2: Thêm nhạc nền...")
-                try:
-                    # Tải audio gốc và nhạc nền với đường dẫn tuyệt đối
-                    original_audio = AudioFileClip(temp_audio_path)
-                    bg_music = AudioFileClip(os.path.abspath(self.background_music))
-                    
-                    if original_audio is None or bg_music is None:
-                        raise Exception("Không thể tải audio để xử lý nhạc nền")
-                        
-                    # Điều chỉnh âm lượng
-                    original_audio = original_audio.volumex(2.0)  # Tăng âm lượng audio gốc lên 200%
-                    bg_music = bg_music.volumex(self.background_music_volume * 0.2)  # Giảm nhạc nền xuống 20%
-                    
-                    # Lặp nhạc nền nếu cần
-                    if bg_music.duration < original_audio.duration:
-                        n_repeats = int(np.ceil(original_audio.duration / bg_music.duration))
-                        bg_music = concatenate_audioclips([bg_music] * n_repeats)
-                    
-                    # Cắt nhạc nền cho vừa với audio chính
-                    bg_music = bg_music.subclip(0, original_audio.duration)
+            try:
+                final_key = self.final_audio_key(audio_key, has_music)
+                cached_final_path = self.cache.get(final_key, ".m4a")
+                cached_info = self.cache.get_json(final_key) if cached_final_path else None
+                if cached_final_path:
+                    temp_final_audio_path = cached_final_path
+                    if cached_info:
+                        duration = cached_info["duration"]
+                    self.progress.print_message(f"Dùng lại audio cuối cùng từ cache: {temp_final_audio_path}")
+                else:
+                    if narration is None:
+                        narration = decode_audio(temp_audio_path)
                     
-                    # Trộn âm thanh
-                    final_audio = CompositeAudioClip([original_audio, bg_music])
-                    final_audio = final_audio.volumex(1.5)  # Tăng tổng âm lượng lên 150%
+                    if self.settings.mix_mode == "ducking":
+                        # Chuẩn hóa độ lớn và ducking theo giọng đọc, tính một lần trên toàn bộ mảng
+                        bg_music = decode_audio(os.path.abspath(self.background_music)) if has_music else None
+                        mixer = DuckingMixer.from_settings(
+                            self.settings,
+                            LoudnessMeter.measure(narration),
+                            LoudnessMeter.measure(bg_music) if has_music else None,
+                        )
+                        final_audio = mixer.process(
+                            narration, loop_to_length(bg_music, len(narration)) if has_music else None
+                        )
+                        bg_music = None
+                    elif has_music:
+                        # Nhạc nền được lặp bằng np.tile và trộn với hệ số âm lượng cố định
+                        bg_music = decode_audio(os.path.abspath(self.background_music))
+                        final_audio = mix(
+                            narration, bg_music,
+                            narration_gain=self.NARRATION_GAIN,
+                            music_gain=self.background_music_volume * self.MUSIC_GAIN,
+                            master_gain=self.MASTER_GAIN,
+                        )
+                        bg_music = None
+                    else:
+                        # Không có nhạc nền: giữ nguyên giọng đọc
+                        final_audio = narration
                     
-                    # Lưu audio cuối cùng với đường dẫn tuyệt đối
-                    temp_final_audio_path = os.path.join(temp_dir, "temp_final_audio.mp3")
+                    temp_final_audio_path = os.path.join(temp_dir, "temp_final_audio.m4a")
                     self.progress.print_message(f"Đang ghi file audio cuối cùng: {temp_final_audio_path}")
+                    encode_audio(final_audio, temp_final_audio_path)
+                    duration = len(final_audio) / SAMPLE_RATE
                     
-                    # Đảm bảo thư mục tồn tại
-                    os.makedirs(os.path.dirname(temp_final_audio_path), exist_ok=True)
-                    
-                    # Ghi file audio
-                    final_audio.write_audiofile(
-                        temp_final_audio_path,
-                        fps=44100,
-                        nbytes=2,
-                        codec='mp3',
-                        verbose=False,
-                        logger=None,
-                        ffmpeg_params=['-loglevel', 'error']
-                    )
-                    
-                    # Đóng các audio clip
-                    original_audio.close()
-                    bg_music.close()
-                    final_audio.close()
-                    final_audio = None
-                    
-                    # Đợi file được ghi xong
-                    time.sleep(2)
-                    
-                    # Kiểm tra file đã được tạo
-                    if not os.path.exists(temp_final_audio_path):
-                        raise Exception(f"Không thể tạo file audio cuối cùng tại: {temp_final_audio_path}")
-                        
                     if os.path.getsize(temp_final_audio_path) == 0:
                         raise Exception("File audio cuối cùng rỗng")
-                        
-                    self.progress.print_message(f"Đã ghi file audio cuối cùng thành công: {temp_final_audio_path}")
                     
-                except Exception as e:
-                    self.progress.print_warning(f"Lỗi khi xử lý nhạc nền: {str(e)}")
-                    # Nếu có lỗi, sử dụng audio gốc
-                    temp_final_audio_path = temp_audio_path
+                    self.progress.print_message(f"Đã ghi file audio cuối cùng thành công: {temp_final_audio_path}")
+                    temp_final_audio_path = self.cache.put(final_key, temp_final_audio_path, ".m4a")
+                    self.cache.put_json(final_key, {"duration": duration})
                     
-            else:
-                # Nếu không có nhạc nền, sử dụng audio gốc
+            except Exception as e:
+                if not has_music:
+                    raise
+                self.progress.print_warning(f"Lỗi khi xử lý nhạc nền: {str(e)}")
+                # Nếu có lỗi, sử dụng audio gốc
                 temp_final_audio_path = temp_audio_path
+                final_audio = narration
+                duration = None
                 
             # Kiểm tra lần cuối trước khi trả về
             if not os.path.exists(temp_final_audio_path):
@@ -215,83 +196,189 @@ class AudioProcessor:
             if os.path.getsize(temp_final_audio_path) == 0:
                 raise Exception("File audio cuối cùng rỗng")
                 
-            self.progress.print_message(f"Đã xác nhận file audio cuối cùng: {temp_final_audio_path}")
-            return temp_audio_path, temp_final_audio_path
+            result = AudioResult(temp_final_audio_path, temp_audio_path, duration, SAMPLE_RATE, final_audio)
+            if result.duration is None:
+                # Audio cũ trong cache chưa có thông tin thời lượng: giải mã một lần để đo
+                result.duration = len(result.pcm()) / SAMPLE_RATE
+            
+            self.progress.print_message(f"Đã xác nhận file audio cuối cùng: {temp_final_audio_path} ({result.duration:.2f}s)")
+            return result
             
         except Exception as e:
             self.progress.print_error(f"Lỗi trong quá trình xử lý audio: {str(e)}")
-            raise 
+            raise
 
-        """Tạo subtitle tự động từ audio sử dụng Whisper"""
-        self.progress.print_message("Đang tạo subtitle từ audio...")
-        subtitles = []
-
-        def log_error(step, error):
-            import traceback
-            error_msg = f"Lỗi ở bước {step}: {str(error)}\n"
-            error_msg += f"Chi tiết lỗi:\n{traceback.format_exc()}"
-            self.progress.print_error(error_msg)
-
-        try:
-            # Bước 1: Kiểm tra file audio
-            if not os.path.exists(audio_path):
-                raise FileNotFoundError(f"Không tìm thấy file audio: {audio_path}")
+    def list_audio_files(self):
+        """Thư mục audio (đường dẫn tuyệt đối) và danh sách file audio theo thứ tự ghép"""
+        audio_dir = os.path.abspath(self.audio_dir)
+        if not os.path.exists(audio_dir):
+            raise FileNotFoundError(f"Thư mục audio không tồn tại: {audio_dir}")
             
-            self.progress.print_message(f"File audio: {audio_path}")
-            self.progress.print_message(f"Kích thước file: {os.path.getsize(audio_path)} bytes")
+        audio_files = sorted(
+            [f for f in os.listdir(audio_dir)
+             if f.lower().endswith((".mp3", ".wav"))]
+        )
+        
+        if not audio_files:
+            raise FileNotFoundError(f"Không tìm thấy file audio nào trong thư mục: {audio_dir}")
+        return audio_dir, audio_files
 
-            # Bước 2: Kiểm tra model
-            if self.whisper_model is None:
-                raise ValueError("Model Whisper chưa được khởi tạo")
-            
-            self.progress.print_message(f"Model Whisper: {type(self.whisper_model).__name__}")
-            self.progress.print_message(f"Language: {self.whisper_language}")
+    def estimate_duration(self):
+        """Tổng thời lượng audio đọc từ header các file gốc (không giải mã), None nếu không đọc được
 
-            # Bước 3: Transcribe audio
-            try:
-                self.progress.print_message("Bắt đầu transcribe audio...")
-                model = whisper.load_model(self.whisper_model)
-                result = self.whisper_model.transcribe(
-                    audio_path,
-                    language=self.whisper_language,
-                    task="transcribe",
-                    fp16=True,
-                    verbose=True
-                )
-                self.progress.print_message("Transcribe hoàn thành")
-            except Exception as e:
-                log_error("transcribe", e)
-                return subtitles
+        Dùng để bắt đầu render hình trước khi bước audio xong.
+        """
+        audio_dir, audio_files = self.list_audio_files()
+        total = 0.0
+        for audio_file in audio_files:
+            audio_path = os.path.join(audio_dir, audio_file)
+            if os.path.getsize(audio_path) == 0:
+                continue
+            duration = probe_duration(audio_path)
+            if duration is None:
+                return None
+            total += duration
+        return total if total > 0 else None
 
-            # Bước 4: Xử lý kết quả
-            try:
-                if "segments" not in result:
-                    raise ValueError("Kết quả transcribe không có segments")
-                
-                segments = result["segments"]
-                self.progress.print_message(f"Số segments nhận được: {len(segments)}")
+    def final_audio_key(self, audio_key, has_music):
+        """Khóa cache audio cuối cùng: giọng đọc + nhạc nền + âm lượng + cách trộn"""
+        return make_key(
+            "final_audio", audio_key,
+            hash_file(os.path.abspath(self.background_music)) if has_music else None,
+            self.background_music_volume if has_music else None,
+            self.NARRATION_GAIN, self.MUSIC_GAIN, self.MASTER_GAIN,
+            self.settings.values(
+                "mix_mode", "mix_target_db", "mix_music_db", "mix_duck_db", "mix_ceiling_db"
+            ),
+        )
 
-                for i, segment in enumerate(segments, 1):
-                    try:
-                        text = segment["text"].strip()
-                        if text:
-                            subtitles.append({
-                                "text": text,
-                                "start": segment["start"],
-                                "end": segment["end"]
-                            })
-                    except Exception as e:
-                        self.progress.print_warning(f"Lỗi xử lý segment {i}: {str(e)}")
-                        continue
+    def measure_loudness(self, paths):
+        """Đo độ lớn của các file nối tiếp theo từng khối (lượt đọc trước khi trộn ducking)"""
+        meter = LoudnessMeter()
+        block_frames = max(1, int(self.settings.audio_block_seconds * SAMPLE_RATE))
+        with PCMReader(paths, on_file_end=lambda path, frames, error: None) as reader:
+            while True:
+                block = reader.read(block_frames)
+                if len(block) == 0:
+                    break
+                meter.add(block)
+        return meter.loudness_db()
 
-                self.progress.print_message(f"Đã tạo được {len(subtitles)} subtitle")
-                
-            except Exception as e:
-                log_error("xử lý segments", e)
-                return subtitles
+    def choose_audio_mode(self, audio_paths):
+        """Chọn xử lý audio trong bộ nhớ hay theo từng khối (audio_mode = auto|memory|stream)"""
+        mode = self.settings.audio_mode
+        if mode in ("memory", "stream"):
+            return mode
+        total = sum(probe_duration(path) or 0 for path in audio_paths)
+        if total >= self.settings.audio_stream_threshold:
+            self.progress.print_message(
+                f"Audio dài {total / 60:.1f} phút: xử lý theo từng khối {self.settings.audio_block_seconds:g}s"
+            )
+            return "stream"
+        return "memory"
 
-            return subtitles
+    def process_audio_streaming(self, audio_dir, audio_files, temp_dir, audio_key):
+        """Ghép, trộn nhạc nền và mã hóa theo từng khối cố định qua pipe ffmpeg
 
-        except Exception as e:
-            log_error("khởi tạo", e)
-            return subtitles 
\ No newline at end of file
+        Giọng đọc, nhạc nền (lặp lại) và hai bộ mã hóa đều chạy song song theo
+        luồng dữ liệu, nên bộ nhớ chỉ phụ thuộc kích thước khối.
+        """
+        has_music = bool(self.background_music) and os.path.exists(self.background_music)
+        final_key = self.final_audio_key(audio_key, has_music)
+        
+        temp_audio_path = self.cache.get(audio_key, ".flac")
+        temp_final_audio_path = self.cache.get(final_key, ".m4a")
+        cached_info = self.cache.get_json(final_key) if temp_final_audio_path else None
+        if temp_audio_path and temp_final_audio_path and cached_info:
+            self.progress.print_message(f"Dùng lại audio cuối cùng từ cache: {temp_final_audio_path}")
+            return AudioResult(temp_final_audio_path, temp_audio_path, cached_info["duration"])
+        
+        write_narration = temp_audio_path is None
+        if write_narration:
+            sources = []
+            for audio_file in audio_files:
+                audio_path = os.path.join(audio_dir, audio_file)
+                if os.path.getsize(audio_path) == 0:
+                    self.progress.print_warning(f"File rỗng: {audio_path}")
+                    continue
+                sources.append(audio_path)
+            temp_audio_path = os.path.join(temp_dir, "temp_audio.flac")
+        else:
+            self.progress.print_message(f"Dùng lại audio gốc từ cache: {temp_audio_path}")
+            sources = [temp_audio_path]
+        temp_final_audio_path = os.path.join(temp_dir, "temp_final_audio.m4a")
+        
+        def on_file_end(path, frames, error):
+            if error:
+                self.progress.print_warning(f"Lỗi khi xử lý file audio {os.path.basename(path)}: {error}")
+            elif write_narration:
+                self.progress.print_message(
+                    f"Đã tải thành công: {os.path.basename(path)} (duration: {frames / SAMPLE_RATE:.2f}s)"
+                )
+        
+        block_frames = max(1, int(self.settings.audio_block_seconds * SAMPLE_RATE))
+        reader = PCMReader(sources, on_file_end=on_file_end)
+        music = PCMReader([os.path.abspath(self.background_music)], loop=True) if has_music else None
+        narration_writer = AudioStreamWriter(temp_audio_path) if write_narration else None
+        final_writer = AudioStreamWriter(temp_final_audio_path)
+        if has_music:
+            self.progress.print_message("\nBước 2: Thêm nhạc nền...")
+        self.progress.print_message(f"Đang ghi file audio cuối cùng: {temp_final_audio_path}")
+        
+        mixer = None
+        if self.settings.mix_mode == "ducking":
+            self.progress.print_message("Đang đo độ lớn giọng đọc và nhạc nền...")
+            mixer = DuckingMixer.from_settings(
+                self.settings,
+                self.measure_loudness(sources),
+                self.measure_loudness([os.path.abspath(self.background_music)]) if has_music else None,
+            )
+        
+        mixed = np.empty((block_frames, CHANNELS), dtype=np.float32)
+        try:
+            if narration_writer:
+                narration_writer.open()
+            final_writer.open()
+            while True:
+                block = reader.read(block_frames)
+                if len(block) == 0:
+                    break
+                if narration_writer:
+                    narration_writer.write(block)
+                if mixer:
+                    # Kết quả trễ một khối để limiter và ducking có dữ liệu nhìn trước
+                    block = mixer.process_block(block, music.read(len(block)) if music else None)
+                elif music:
+                    block = mix(
+                        block, music.read(len(block)),
+                        narration_gain=self.NARRATION_GAIN,
+                        music_gain=self.background_music_volume * self.MUSIC_GAIN,
+                        master_gain=self.MASTER_GAIN,
+                        out=mixed[:len(block)],
+                    )
+                final_writer.write(block)
+            if mixer:
+                final_writer.write(mixer.flush())
+            if narration_writer:
+                narration_writer.close()
+            final_writer.close()
+        except Exception:
+            if narration_writer:
+                narration_writer.abort()
+            final_writer.abort()
+            raise
+        finally:
+            reader.close()
+            if music:
+                music.close()
+        
+        if reader.frames_read == 0:
+            raise Exception("Không thể tải bất kỳ file audio nào.")
+        duration = reader.frames_read / SAMPLE_RATE
+        self.progress.print_message(f"Đã ghi file audio cuối cùng thành công: {temp_final_audio_path} ({duration:.2f}s)")
+        
+        if write_narration:
+            temp_audio_path = self.cache.put(audio_key, temp_audio_path, ".flac")
+        temp_final_audio_path = self.cache.put(final_key, temp_final_audio_path, ".m4a")
+        self.cache.put_json(final_key, {"duration": duration})
+        return AudioResult(temp_final_audio_path, temp_audio_path, duration)
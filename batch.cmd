@@ -0,0 +1,4 @@
+@echo off
+call .\venv\Scripts\activate.bat
+python batch_runner.py %*
+pause
\ No newline at end of file
@@ -0,0 +1,310 @@
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+import traceback
+import configparser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from main import VideoCreator, ProgressManager
+from render_cache import RenderCache
+from pipeline import ResourceLimits
+from image_ingest import IMAGE_EXTENSIONS
+
+# Các trường của một job trong manifest và khóa tương ứng trong config.ini
+JOB_FIELDS = {
+    "audio_dir": ("video", "audio_dir"),
+    "image_dir": ("video", "image_dir"),
+    "output_file": ("video", "output_file"),
+    "subtitle_file": ("video", "subtitle_file"),
+    "background_music": ("video", "background_music"),
+    "query": ("image_search", "query_string"),
+    "limit": ("image_search", "limit"),
+}
+
+
+def load_manifest(path):
+    """Đọc danh sách job từ file .jsonl (mỗi dòng một object) hoặc .csv (dòng đầu là tên cột)
+
+    Ngoài các trường trong JOB_FIELDS, một job có thể ghi đè bất kỳ thông số nào
+    của config.ini bằng khóa "section.key" hoặc object "overrides": {section: {key: value}}.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Không tìm thấy file manifest: {path}")
+
+    jobs = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                # Ô trống trong CSV nghĩa là dùng giá trị của config.ini
+                jobs.append({key.strip(): value for key, value in row.items() if key and value not in (None, "")})
+        else:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    job = json.loads(line)
+                except ValueError as e:
+                    raise Exception(f"Dòng {line_number} của {path} không phải JSON hợp lệ: {str(e)}")
+                if not isinstance(job, dict):
+                    raise Exception(f"Dòng {line_number} của {path} không phải một object JSON")
+                jobs.append(job)
+
+    seen = set()
+    for i, job in enumerate(jobs, 1):
+        job["id"] = str(job.get("id") or f"job_{i:04d}")
+        if job["id"] in seen:
+            raise Exception(f"Trùng id job trong manifest: {job['id']}")
+        seen.add(job["id"])
+    return jobs
+
+
+def job_overrides(job):
+    """Danh sách (section, key, value) mà job ghi đè lên config.ini"""
+    overrides = []
+    for name, value in job.items():
+        if name == "id":
+            continue
+        if name == "overrides":
+            for section, values in value.items():
+                for key, item in values.items():
+                    overrides.append((section, key, item))
+        elif name in JOB_FIELDS:
+            overrides.append((*JOB_FIELDS[name], value))
+        elif "." in name:
+            section, key = name.split(".", 1)
+            overrides.append((section, key, value))
+        else:
+            raise Exception(f"Trường không hợp lệ trong job {job['id']}: {name}")
+    return overrides
+
+
+def has_images(image_dir):
+    return os.path.isdir(image_dir) and any(
+        f.lower().endswith(IMAGE_EXTENSIONS) for f in os.listdir(image_dir)
+    )
+
+
+class BatchRunner:
+    """Render nhiều video từ một manifest, mỗi job chạy trên một luồng của pool
+
+    Các job chạy trong cùng một process nên dùng chung tài nguyên đã nạp:
+    model Whisper (transcriber), font (load_font), logo/watermark (branding)
+    và một RenderCache duy nhất (mỗi job một phiên cache riêng). Job lỗi chỉ được ghi vào file trạng thái,
+    các job còn lại vẫn tiếp tục.
+    """
+
+    # Số job được chạy cùng một loại bước tại một thời điểm. Render clip và
+    # transcribe đã tự dùng hết nhân CPU, nên các job chỉ xen kẽ các bước khác
+    # loại: job sau xử lý audio trong khi job trước render hoặc ghép video.
+    STAGE_LIMITS = {"audio": 1, "transcribe": 1, "ingest": 1, "render": 1, "encode": 1}
+
+    def __init__(self, config_file="config.ini", workers=None, output_dir=None, status_file=None):
+        if not os.path.exists(config_file):
+            raise FileNotFoundError(f"Không tìm thấy file cấu hình: {config_file}")
+        self.base_config = configparser.ConfigParser()
+        self.base_config.read(config_file, encoding="utf-8")
+
+        batch = self.base_config["batch"] if self.base_config.has_section("batch") else {}
+        self.workers = max(1, workers or (batch.getint("workers", 2) if batch else 2))
+        self.output_dir = output_dir or (batch.get("output_dir", "outputs") if batch else "outputs")
+        self.status_file = status_file or (batch.get("status_file", "").strip() if batch else "")
+        self.skip_done = batch.getboolean("skip_done", True) if batch else True
+
+        self.progress = ProgressManager()
+        # Cache dùng chung cho mọi job (cấu hình [cache] theo config.ini gốc)
+        self.cache = RenderCache.from_config(self.base_config)
+        self.limits = ResourceLimits(**self.STAGE_LIMITS)
+        self._status_lock = threading.Lock()
+        # Chỉ mở một trình duyệt tìm ảnh tại một thời điểm
+        self._search_lock = threading.Lock()
+
+    def job_config(self, job):
+        """Config của một job: config.ini gốc + các giá trị ghi đè của job"""
+        config = configparser.ConfigParser()
+        config.read_dict({
+            section: dict(self.base_config.items(section, raw=True))
+            for section in self.base_config.sections()
+        })
+        for section, key, value in job_overrides(job):
+            if not config.has_section(section):
+                config.add_section(section)
+            config.set(section, key, str(value))
+
+        # Mỗi job có thư mục output riêng để file tạm (output/temp) không ghi đè lẫn nhau
+        if "output_file" not in job and not any(key == "video.output_file" for key in job):
+            output_name = os.path.basename(config.get("video", "output_file", fallback="output_video.mp4"))
+            config.set("video", "output_file", os.path.join(self.output_dir, job["id"], output_name))
+        # Ảnh tìm được cho job được tải thẳng vào image_dir của job
+        if not config.has_section("image_search"):
+            config.add_section("image_search")
+        config.set("image_search", "output_dir", config.get("video", "image_dir", fallback="images"))
+        return config
+
+    def status_path(self, manifest_path):
+        return self.status_file or f"{os.path.splitext(manifest_path)[0]}.status.jsonl"
+
+    def load_done(self, status_path):
+        """id các job đã render thành công ở lần chạy trước (file output vẫn còn)"""
+        done = {}
+        if not os.path.exists(status_path):
+            return done
+        with open(status_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("status") == "ok" and os.path.exists(record.get("output") or ""):
+                    done[record["id"]] = record
+                else:
+                    done.pop(record.get("id"), None)
+        return done
+
+    def write_status(self, status_path, record):
+        """Ghi thêm một dòng trạng thái (ghi ngay để không mất khi batch bị dừng giữa chừng)"""
+        with self._status_lock:
+            directory = os.path.dirname(os.path.abspath(status_path))
+            os.makedirs(directory, exist_ok=True)
+            with open(status_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def prepare_images(self, job, config, timings):
+        """Tìm và tải ảnh theo query nếu job có query mà image_dir chưa có ảnh"""
+        # Chỉ dùng query của chính job, không dùng query_string mặc định của config.ini
+        queries = [value for section, key, value in job_overrides(job)
+                   if (section, key) == JOB_FIELDS["query"]]
+        query = str(queries[-1]).strip() if queries else ""
+        image_dir = config.get("video", "image_dir", fallback="images")
+        if not query or has_images(image_dir):
+            return
+        # selenium chỉ cần khi có job tìm ảnh
+        from selenium_image_search import search_images, search_images_offline, dedupe_threshold_from_config
+        from image_downloader import ImageDownloader
+
+        limit = config.getint("image_search", "limit", fallback=10)
+        mode = config.get("image_search", "mode", fallback="fast").strip().lower()
+        html_file = config.get("image_search", "html_file", fallback="").strip()
+        dedupe_threshold = dedupe_threshold_from_config(config)
+        started = time.perf_counter()
+        with self._search_lock, ImageDownloader.from_config(config) as downloader:
+            # Giống selenium_image_search.main(): có html_file thì lấy ảnh từ trang đã lưu
+            if html_file:
+                count = search_images_offline(html_file, limit, image_dir, downloader=downloader,
+                                              dedupe_threshold=dedupe_threshold)
+            else:
+                count = search_images(query, limit, image_dir, downloader=downloader, mode=mode,
+                                      dedupe_threshold=dedupe_threshold)
+        timings["images"] = time.perf_counter() - started
+        if count == 0:
+            raise Exception(f"Không tải được ảnh nào cho query: {query}")
+
+    def run_job(self, job, config):
+        """Render một job, trả về bản ghi trạng thái (không ném lỗi ra ngoài)"""
+        record = {
+            "id": job["id"],
+            "status": "running",
+            "output": os.path.abspath(config.get("video", "output_file")),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        timings = {}
+        started = time.perf_counter()
+        try:
+            self.progress.print_message(f"[{job['id']}] Bắt đầu render: {record['output']}")
+            self.prepare_images(job, config, timings)
+            # Phiên cache riêng: các mục job này dùng chỉ được giữ tới khi job xong
+            cache = self.cache.session()
+            try:
+                creator = VideoCreator(config=config, cache=cache, limits=self.limits)
+                try:
+                    creator.create_video()
+                finally:
+                    timings.update(creator.timings)
+            finally:
+                cache.end_session()
+            record["status"] = "ok"
+        except Exception as e:
+            record["status"] = "failed"
+            record["error"] = str(e)
+            record["traceback"] = traceback.format_exc()
+            self.progress.print_error(f"[{job['id']}] Lỗi: {str(e)}")
+        record["finished_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+        record["elapsed"] = round(time.perf_counter() - started, 3)
+        record["timings"] = {name: round(value, 3) for name, value in timings.items()}
+        return record
+
+    def run(self, manifest_path):
+        """Chạy toàn bộ manifest, trả về danh sách bản ghi trạng thái của lần chạy này"""
+        jobs = load_manifest(manifest_path)
+        status_path = self.status_path(manifest_path)
+        done = self.load_done(status_path) if self.skip_done else {}
+        self.progress.print_message(
+            f"Batch: {len(jobs)} job, {self.workers} job song song, trạng thái ghi vào {status_path}"
+        )
+
+        records = []
+        pending = []
+        output_dirs = {}
+        for job in jobs:
+            if job["id"] in done:
+                self.progress.print_message(f"[{job['id']}] Đã render trước đó, bỏ qua")
+                records.append(dict(done[job["id"]], status="skipped"))
+                continue
+            try:
+                config = self.job_config(job)
+                output_dir = os.path.dirname(os.path.abspath(config.get("video", "output_file")))
+                if output_dir in output_dirs:
+                    raise Exception(f"Trùng thư mục output với job {output_dirs[output_dir]}: {output_dir}")
+                output_dirs[output_dir] = job["id"]
+            except Exception as e:
+                record = {"id": job["id"], "status": "failed", "error": str(e)}
+                self.progress.print_error(f"[{job['id']}] Lỗi cấu hình: {str(e)}")
+                self.write_status(status_path, record)
+                records.append(record)
+                continue
+            pending.append((job, config))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.run_job, job, config) for job, config in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                self.write_status(status_path, record)
+                records.append(record)
+
+        if self.cache.enabled:
+            self.cache.save()
+        counts = {}
+        for record in records:
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        if counts.get("failed"):
+            self.progress.print_warning(f"Batch xong: {summary}")
+        else:
+            self.progress.print_message(f"Batch xong: {summary}")
+        return records
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render nhiều video từ một manifest (.jsonl hoặc .csv)")
+    parser.add_argument("manifest", nargs="?", help="File manifest (mặc định: [batch] manifest trong config)")
+    parser.add_argument("--config", default="config.ini", help="File cấu hình gốc")
+    parser.add_argument("--workers", type=int, help="Số job chạy song song")
+    parser.add_argument("--output-dir", help="Thư mục chứa video của các job không ghi rõ output_file")
+    parser.add_argument("--status", help="File trạng thái .jsonl")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        runner = BatchRunner(args.config, args.workers, args.output_dir, args.status)
+        manifest = args.manifest or runner.base_config.get("batch", "manifest", fallback="jobs.jsonl")
+        records = runner.run(manifest)
+        sys.exit(1 if any(record["status"] == "failed" for record in records) else 0)
+    except Exception as e:
+        print(f"Lỗi: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,115 @@
+import os
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+from render_cache import hash_file
+
+
+@lru_cache(maxsize=32)
+def _load_layer_arrays(path, mtime, width, height):
+    """Đọc, resize và premultiply một ảnh RGBA (dùng chung giữa các processor)"""
+    img = Image.open(path)
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    img = img.resize((width, height), Image.Resampling.LANCZOS)
+    rgba = np.asarray(img, dtype=np.float32)
+    alpha = rgba[:, :, 3:4] / 255.0
+    premultiplied = rgba[:, :, :3] * alpha
+    inverse_alpha = 1.0 - alpha
+    premultiplied.setflags(write=False)
+    inverse_alpha.setflags(write=False)
+    return premultiplied, inverse_alpha
+
+
+def blend_premultiplied(frame, premultiplied, inverse_alpha, x, y):
+    """Trộn một lớp đã premultiply vào frame (uint8 HxWx3) tại (x, y), phần tràn bị cắt bỏ"""
+    height, width = inverse_alpha.shape[:2]
+    frame_height, frame_width = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1 = min(x + width, frame_width)
+    y1 = min(y + height, frame_height)
+    if x0 >= x1 or y0 >= y1:
+        return frame
+    src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+    region = frame[y0:y1, x0:x1]
+    blended = region * inverse_alpha[src]
+    blended += premultiplied[src]
+    blended += 0.5
+    region[...] = blended.astype(np.uint8)
+    return frame
+
+
+class BrandingLayer:
+    """Một lớp logo/watermark đã được resize và premultiply alpha sẵn"""
+
+    def __init__(self, path, x, y, width, height):
+        self.path = os.path.abspath(path)
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.premultiplied, self.inverse_alpha = _load_layer_arrays(
+            self.path, os.path.getmtime(self.path), width, height
+        )
+
+    def composite(self, frame):
+        """Trộn lớp vào frame (uint8 HxWx3) tại chỗ, phần tràn ra ngoài bị cắt bỏ"""
+        return blend_premultiplied(frame, self.premultiplied, self.inverse_alpha, self.x, self.y)
+
+
+class BrandingOverlay:
+    """Các lớp branding (logo + watermark) của một VideoProcessor, chỉ nạp một lần"""
+
+    def __init__(self, layers=None):
+        self.layers = list(layers or [])
+
+    @classmethod
+    def from_config(cls, config, progress=None):
+        """Tạo overlay từ mục [image]: logo_* và danh sách watermarks"""
+        image_config = config["image"]
+        specs = []
+        logo_path = image_config.get("logo_path", "")
+        if logo_path:
+            specs.append((
+                logo_path,
+                image_config.getint("logo_margin_left", 50),
+                image_config.getint("logo_margin_top", 50),
+                image_config.getint("logo_width", 250),
+                image_config.getint("logo_height", 250),
+            ))
+
+        # Mỗi dòng watermark: đường_dẫn, x, y, rộng, cao
+        for line in image_config.get("watermarks", "").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                path, x, y, width, height = [part.strip() for part in line.split(",")]
+                specs.append((path, int(x), int(y), int(width), int(height)))
+            except ValueError:
+                if progress:
+                    progress.print_warning(f"Dòng watermark không hợp lệ: {line}")
+
+        layers = []
+        for path, x, y, width, height in specs:
+            if not os.path.exists(path):
+                continue
+            try:
+                layers.append(BrandingLayer(path, x, y, width, height))
+            except Exception as e:
+                if progress:
+                    progress.print_warning(f"Lỗi khi nạp logo/watermark {path}: {str(e)}")
+        return cls(layers)
+
+    def composite(self, frame):
+        """Trộn tất cả các lớp vào frame tại chỗ"""
+        for layer in self.layers:
+            layer.composite(frame)
+        return frame
+
+    def signature(self):
+        """Mô tả các lớp (nội dung file, vị trí, kích thước) để làm khóa cache"""
+        return tuple(
+            (hash_file(layer.path), layer.x, layer.y, layer.width, layer.height)
+            for layer in self.layers
+        )
@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+from PIL import Image, ImageFilter
+from render_cache import make_key
+
+
+class BackgroundCompositor:
+    """Tạo ảnh nền mờ và ảnh chính cho một khung hình, dùng chung cho mọi nơi cần
+
+    Ảnh nền được cắt/resize thẳng từ ảnh gốc xuống độ phân giải thấp, làm mờ ở
+    đó rồi phóng lại kích thước khung hình: với bán kính lớn, cách này rẻ hơn
+    nhiều so với làm mờ ở độ phân giải đầy đủ mà nhìn gần như không khác. Lớp
+    phủ trắng được trộn bằng một bảng tra (LUT) áp dụng tại chỗ.
+    """
+
+    # Hệ số thu nhỏ tối đa trước khi làm mờ
+    MAX_DOWNSCALE = 8
+
+    def __init__(self, width, height, blur_radius, cache=None, memo_size=16):
+        self.width = width
+        self.height = height
+        self.blur_radius = blur_radius
+        self.cache = cache
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def downscale_factor(self):
+        """Hệ số thu nhỏ: làm mờ với bán kính còn khoảng 3px ở ảnh nhỏ"""
+        return int(max(1, min(self.MAX_DOWNSCALE, self.blur_radius // 3)))
+
+    def cover_box(self, size):
+        """Vùng cắt của ảnh gốc (theo tọa độ ảnh gốc) để phủ kín khung hình"""
+        src_width, src_height = size
+        ratio = max(self.width / src_width, self.height / src_height)
+        crop_width = self.width / ratio
+        crop_height = self.height / ratio
+        left = (src_width - crop_width) / 2
+        top = (src_height - crop_height) / 2
+        return (left, top, left + crop_width, top + crop_height)
+
+    def background(self, img, image_key=None, blend=0.5):
+        """Ảnh nền đã làm mờ và phủ trắng (uint8 HxWx3, chỉ đọc)
+
+        image_key là khóa nội dung ảnh (ví dụ hash file); khi có khóa, kết quả
+        được nhớ trong bộ nhớ và trong cache trên đĩa.
+        """
+        key = None
+        if image_key is not None:
+            key = make_key(
+                "background", image_key, self.width, self.height, self.blur_radius, blend
+            )
+            with self._lock:
+                cached = self._memo.get(key)
+                if cached is not None:
+                    self._memo.move_to_end(key)
+                    return cached
+            if self.cache is not None:
+                cached = self.cache.get_array(key)
+                if cached is not None and cached.shape == (self.height, self.width, 3):
+                    return self._remember(key, cached)
+
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # Cắt + resize thẳng xuống độ phân giải thấp, làm mờ ở đó
+        factor = self.downscale_factor()
+        small_size = (max(1, self.width // factor), max(1, self.height // factor))
+        background = img.resize(
+            small_size, Image.Resampling.LANCZOS, box=self.cover_box(img.size), reducing_gap=3.0
+        )
+        if self.blur_radius > 0:
+            background = background.filter(ImageFilter.GaussianBlur(radius=self.blur_radius / factor))
+        if factor > 1:
+            background = background.resize((self.width, self.height), Image.Resampling.BILINEAR)
+        array = np.array(background)
+
+        # Trộn lớp phủ trắng: out = nền * (1 - blend) + 255 * blend, tại chỗ
+        lut = np.round(np.arange(256) * (1.0 - blend) + 255.0 * blend).clip(0, 255).astype(np.uint8)
+        cv2.LUT(array, lut, dst=array)
+
+        if key is not None:
+            if self.cache is not None:
+                self.cache.put_array(key, array)
+            array = self._remember(key, array)
+        return array
+
+    def _remember(self, key, array):
+        array.setflags(write=False)
+        with self._lock:
+            self._memo[key] = array
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return array
+
+    def fit_main(self, img, fit_ratio=0.9):
+        """Resize ảnh chính giữ tỷ lệ, vừa trong fit_ratio kích thước khung hình"""
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        max_width = int(self.width * fit_ratio)
+        max_height = int(self.height * fit_ratio)
+        scale = min(max_width / img.size[0], max_height / img.size[1])
+        new_size = (int(img.size[0] * scale), int(img.size[1] * scale))
+        return img.resize(new_size, Image.Resampling.LANCZOS)
+
+    def compose(self, img, image_key=None, blend=0.5, fit_ratio=0.9):
+        """Trả về (ảnh nền mờ, ảnh chính đã resize) cho một ảnh gốc"""
+        return self.background(img, image_key, blend), self.fit_main(img, fit_ratio)
@@ -0,0 +1,250 @@
+import os
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from image_ingest import SNIFF_BYTES, sniff_image_type
+
+# Một số trang chặn User-Agent mặc định của requests
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+
+
+class IncompleteDownload(Exception):
+    """Kết nối bị đứt khi đang đọc nội dung ảnh"""
+
+
+class DownloadResult:
+    """Kết quả tải một URL: path là file đã lưu, None nếu lỗi (error là lý do)
+
+    extension là đuôi file đúng theo nội dung ảnh (.jpg, .png, .webp...).
+    """
+
+    def __init__(self, url, path=None, error=None, size=0, elapsed=0.0, extension=None):
+        self.url = url
+        self.path = path
+        self.error = error
+        self.size = size
+        self.elapsed = elapsed
+        self.extension = extension
+
+    @property
+    def ok(self):
+        return self.path is not None
+
+    def __repr__(self):
+        state = self.path if self.ok else f"lỗi: {self.error}"
+        return f"DownloadResult({self.url!r}, {state})"
+
+
+class ImageDownloader:
+    """Tải nhiều ảnh song song qua một requests.Session dùng chung (giữ kết nối)
+
+    - Giới hạn số kết nối đồng thời tới mỗi host (per_host) để không bị chặn.
+    - Timeout (kết nối, đọc) cho mọi request; lỗi mạng và mã 429/5xx được thử
+      lại với thời gian chờ tăng dần (backoff).
+    - Nội dung được ghi theo khối chunk_size vào file .part rồi mới đổi tên,
+      nên không để lại file dở khi lỗi.
+    - Các byte đầu tiên được nhận dạng ngay khi nhận: nội dung không phải ảnh
+      (trang HTML, thông báo lỗi...) bị ngắt tải ngay, không thử lại.
+    """
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, workers=8, per_host=2, timeout=20.0, connect_timeout=5.0,
+                 retries=3, backoff=0.5, chunk_size=64 * 1024, session=None):
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.timeout = (connect_timeout, timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.session = session or self.create_session()
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Tạo downloader từ mục [image_search] trong config.ini"""
+        section = config["image_search"] if config.has_section("image_search") else {}
+        if not section:
+            return cls()
+        return cls(
+            workers=section.getint("download_workers", 8),
+            per_host=section.getint("download_per_host", 2),
+            timeout=section.getfloat("download_timeout", 20),
+            retries=section.getint("download_retries", 3),
+        )
+
+    def create_session(self):
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        # Pool đủ chỗ cho mọi luồng để kết nối được giữ lại giữa các ảnh
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["User-Agent"] = USER_AGENT
+        return session
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_limits[host]
+
+    def download(self, url, path):
+        """Tải một URL vào path, trả về DownloadResult (không ném lỗi)"""
+        started = time.perf_counter()
+        part_path = f"{path}.part"
+        error = None
+        # Retry của urllib3 lo lỗi kết nối và mã lỗi; ở đây chỉ thử lại khi đứt giữa chừng lúc đọc nội dung
+        for attempt in range(self.retries + 1):
+            try:
+                with self._host_limit(url):
+                    size, extension = self._fetch(url, part_path)
+                os.replace(part_path, path)
+                return DownloadResult(
+                    url, path, size=size, elapsed=time.perf_counter() - started, extension=extension
+                )
+            except IncompleteDownload as e:
+                error = str(e)
+                if attempt < self.retries:
+                    time.sleep(self.backoff * (2 ** attempt))
+            except Exception as e:
+                error = str(e)
+                break
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return DownloadResult(url, error=error, elapsed=time.perf_counter() - started)
+
+    def _fetch(self, url, part_path):
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise Exception(f"HTTP {response.status_code}")
+            content_type = response.headers.get("Content-Type", "không rõ")
+            size = 0
+            head = b""
+            extension = None
+            with open(part_path, "wb") as f:
+                try:
+                    for chunk in response.iter_content(self.chunk_size):
+                        if extension is None and len(head) < SNIFF_BYTES:
+                            head += chunk[:SNIFF_BYTES]
+                            if len(head) >= SNIFF_BYTES:
+                                extension = self._sniff(head, content_type)
+                        f.write(chunk)
+                        size += len(chunk)
+                except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout) as e:
+                    raise IncompleteDownload(f"Mất kết nối sau {size} byte: {str(e)}")
+        if size == 0:
+            raise Exception("Nội dung rỗng")
+        if extension is None:
+            extension = self._sniff(head, content_type)
+        return size, extension
+
+    @staticmethod
+    def _sniff(head, content_type):
+        extension = sniff_image_type(head)
+        if extension is None:
+            raise Exception(f"Không phải file ảnh (Content-Type: {content_type})")
+        return extension
+
+    def download_all(self, urls, output_dir, limit=None, filename="image_{}.jpg", start=1,
+                     accept=None, on_result=None):
+        """Tải song song các URL ứng viên cho tới khi đủ limit ảnh thành công
+
+        Chỉ limit URL đầu tiên được tải ngay; mỗi URL lỗi thì lấy thêm một URL
+        dự phòng tiếp theo. Ảnh thành công được đặt tên filename.format(start..)
+        theo thứ tự URL trong danh sách (không theo thứ tự tải xong), đuôi file
+        được thay bằng đuôi đúng theo nội dung ảnh.
+        accept(DownloadResult) chạy ngay trên luồng tải: trả về lý do (chuỗi) để
+        loại file vừa tải (ví dụ ảnh trùng), None để nhận; ảnh bị loại cũng được
+        thay bằng URL dự phòng.
+        on_result(DownloadResult) được gọi khi mỗi URL tải xong hoặc lỗi.
+        Trả về danh sách DownloadResult của các URL đã thử, theo thứ tự URL.
+        """
+        urls = list(dict.fromkeys(url for url in urls if url))
+        limit = len(urls) if limit is None else limit
+        os.makedirs(output_dir, exist_ok=True)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            next_index = 0
+            succeeded = 0
+
+            def fetch(url, path):
+                result = self.download(url, path)
+                if result.ok and accept:
+                    try:
+                        reason = accept(result)
+                    except Exception as e:
+                        reason = str(e)
+                    if reason:
+                        os.remove(result.path)
+                        result.path = None
+                        result.error = reason
+                return result
+
+            def submit():
+                nonlocal next_index
+                index = next_index
+                next_index += 1
+                path = os.path.join(output_dir, f".download_{index}")
+                futures[executor.submit(fetch, urls[index], path)] = index
+
+            while next_index < min(limit, len(urls)):
+                submit()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures.pop(future)
+                    result = future.result()
+                    results[index] = result
+                    if result.ok:
+                        succeeded += 1
+                    elif succeeded + len(futures) < limit and next_index < len(urls):
+                        submit()
+                    if on_result:
+                        on_result(result)
+
+        # Đặt tên theo thứ tự URL
+        ordered = [results[index] for index in sorted(results)]
+        number = start - 1
+        for result in ordered:
+            if not result.ok:
+                continue
+            number += 1
+            name = filename.format(number)
+            if result.extension:
+                name = os.path.splitext(name)[0] + result.extension
+            path = os.path.join(output_dir, name)
+            os.replace(result.path, path)
+            result.path = path
+        return ordered
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
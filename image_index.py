@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import threading
+import numpy as np
+from PIL import Image
+from image_ingest import IMAGE_EXTENSIONS
+
+# Ảnh được thu về lưới 8x8 (aHash) và 9x8 (dHash): mỗi hash 64 bit
+HASH_SIZE = 8
+
+
+def _pack(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def compute_hashes(img):
+    """(aHash, dHash) 64 bit của một ảnh PIL, tính trên ảnh xám đã thu nhỏ
+
+    aHash: mỗi ô sáng hơn trung bình hay không. dHash: mỗi ô sáng hơn ô bên
+    phải hay không (bền với thay đổi độ sáng/tương phản). Ảnh JPEG được giải mã
+    thẳng ở độ phân giải thấp bằng draft() nên không tốn chi phí giải mã đầy đủ.
+    """
+    img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+    gray = img.convert("L")
+    small = np.asarray(gray.resize((HASH_SIZE, HASH_SIZE), Image.Resampling.BOX), dtype=np.float32)
+    wide = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX), dtype=np.float32)
+    return _pack(small > small.mean()), _pack(wide[:, 1:] > wide[:, :-1])
+
+
+def hash_image_file(path):
+    with Image.open(path) as img:
+        return compute_hashes(img)
+
+
+def popcount(values):
+    """Số bit 1 của từng phần tử mảng uint64"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class PerceptualIndex:
+    """Chỉ mục hash cảm quan của các ảnh trong một thư mục, lưu cùng thư mục ảnh
+
+    Hash được giữ trong hai mảng uint64 nên một lần tra là một phép XOR và đếm
+    bit trên toàn bộ mảng (hàng nghìn ảnh vẫn dưới 1 ms). Hai ảnh bị coi là
+    trùng khi cả aHash và dHash khác nhau không quá threshold bit (trên 64).
+    """
+
+    INDEX_FILE = "phash_index.json"
+
+    def __init__(self, directory, threshold=6):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, self.INDEX_FILE)
+        self.threshold = threshold
+        self.names = []
+        self.stats = []
+        self._ahash = np.zeros(0, dtype=np.uint64)
+        self._dhash = np.zeros(0, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.names)
+
+    def load(self):
+        """Đọc index đã lưu (bỏ qua nếu file hỏng)"""
+        entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                entries = {}
+        self._set_entries(entries)
+
+    def _set_entries(self, entries):
+        self.names = list(entries)
+        self.stats = [entries[name].get("stat") for name in self.names]
+        self._ahash = np.array([int(entries[name]["ahash"], 16) for name in self.names], dtype=np.uint64)
+        self._dhash = np.array([int(entries[name]["dhash"], 16) for name in self.names], dtype=np.uint64)
+
+    def entries(self):
+        return {
+            name: {"ahash": f"{int(a):016x}", "dhash": f"{int(d):016x}", "stat": stat}
+            for name, a, d, stat in zip(self.names, self._ahash, self._dhash, self.stats)
+        }
+
+    def save(self):
+        """Ghi index xuống thư mục ảnh (ghi file tạm rồi đổi tên)"""
+        with self._lock:
+            entries = self.entries()
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _file_stat(path):
+        stat = os.stat(path)
+        return [stat.st_size, int(stat.st_mtime)]
+
+    def refresh(self):
+        """Đồng bộ với thư mục: bỏ ảnh đã xóa, tính hash cho ảnh mới hoặc đã thay đổi"""
+        with self._lock:
+            current = dict(zip(self.names, zip(self._ahash, self._dhash, self.stats)))
+        entries = {}
+        files = sorted(f for f in os.listdir(self.directory) if f.lower().endswith(IMAGE_EXTENSIONS)) \
+            if os.path.isdir(self.directory) else []
+        for name in files:
+            path = os.path.join(self.directory, name)
+            stat = self._file_stat(path)
+            if name in current and current[name][2] == stat:
+                ahash, dhash, _ = current[name]
+            else:
+                try:
+                    ahash, dhash = hash_image_file(path)
+                except Exception:
+                    continue
+            entries[name] = {"ahash": f"{int(ahash):016x}", "dhash": f"{int(dhash):016x}", "stat": stat}
+        with self._lock:
+            self._set_entries(entries)
+        return self
+
+    def _distances(self, hashes):
+        ahash, dhash = (np.uint64(value) for value in hashes)
+        return np.maximum(popcount(self._ahash ^ ahash), popcount(self._dhash ^ dhash))
+
+    def _match(self, hashes, threshold):
+        if not self.names:
+            return None
+        distances = self._distances(hashes)
+        best = int(np.argmin(distances))
+        if distances[best] <= threshold:
+            return self.names[best], int(distances[best])
+        return None
+
+    def find(self, hashes, threshold=None):
+        """Ảnh gần nhất trong index nếu trùng: (tên, số bit khác) hoặc None"""
+        with self._lock:
+            return self._match(hashes, self.threshold if threshold is None else threshold)
+
+    def add(self, name, hashes, stat=None):
+        with self._lock:
+            self._add(name, hashes, stat)
+
+    def _add(self, name, hashes, stat):
+        if name in self.names:
+            index = self.names.index(name)
+            self._ahash[index], self._dhash[index] = hashes
+            self.stats[index] = stat
+            return
+        self.names.append(name)
+        self.stats.append(stat)
+        self._ahash = np.append(self._ahash, np.uint64(hashes[0]))
+        self._dhash = np.append(self._dhash, np.uint64(hashes[1]))
+
+    def add_if_new(self, name, hashes, stat=None):
+        """Thêm ảnh nếu chưa có ảnh trùng; trả về ảnh trùng (tên, số bit khác) hoặc None
+
+        Kiểm tra và thêm trong cùng một lần khóa, nên hai luồng tải cùng một ảnh
+        thì chỉ một luồng được nhận.
+        """
+        with self._lock:
+            match = self._match(hashes, self.threshold)
+            if match is None:
+                self._add(name, hashes, stat)
+            return match
+
+    def rename(self, old_name, new_name, stat=None):
+        with self._lock:
+            index = self.names.index(old_name)
+            self.names[index] = new_name
+            if stat is not None:
+                self.stats[index] = stat
+
+    def remove(self, name):
+        with self._lock:
+            if name not in self.names:
+                return
+            index = self.names.index(name)
+            del self.names[index]
+            del self.stats[index]
+            self._ahash = np.delete(self._ahash, index)
+            self._dhash = np.delete(self._dhash, index)
+
+    def duplicates(self):
+        """Các cặp (ảnh, ảnh trùng với nó xuất hiện trước, số bit khác) trong index"""
+        pairs = []
+        with self._lock:
+            for i in range(1, len(self.names)):
+                distances = np.maximum(
+                    popcount(self._ahash[:i] ^ self._ahash[i]), popcount(self._dhash[:i] ^ self._dhash[i])
+                )
+                best = int(np.argmin(distances))
+                if distances[best] <= self.threshold:
+                    pairs.append((self.names[i], self.names[best], int(distances[best])))
+        return pairs
+
+
+if __name__ == "__main__":
+    # Cập nhật index của một thư mục ảnh và liệt kê các ảnh trùng
+    index = PerceptualIndex(sys.argv[1] if len(sys.argv) > 1 else "images").refresh()
+    index.save()
+    print(f"{len(index)} ảnh trong {index.path}")
+    for name, original, distance in index.duplicates():
+        print(f"{name} trùng với {original} (khác {distance}/64 bit)")
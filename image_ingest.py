@@ -0,0 +1,188 @@
+import os
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from render_cache import hash_file, make_key
+
+# Đuôi file ảnh được dùng để render
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp")
+
+# Chữ ký đầu file (magic bytes) của các định dạng ảnh -> đuôi file đúng
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+)
+# Số byte đầu file cần để nhận dạng
+SNIFF_BYTES = 16
+
+# Định dạng PIL được chấp nhận khi giải mã
+IMAGE_FORMATS = ("JPEG", "PNG", "WEBP", "GIF", "BMP", "MPO")
+
+
+class InvalidImage(Exception):
+    """File không phải ảnh hoặc ảnh bị hỏng"""
+
+
+def sniff_image_type(head):
+    """Đuôi file đúng theo các byte đầu file (.jpg, .png...), None nếu không phải ảnh"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def fit_size(size, box):
+    """Kích thước ảnh thu nhỏ giữ tỷ lệ để vừa trong box (không phóng to)"""
+    scale = min(box[0] / size[0], box[1] / size[1])
+    if scale >= 1:
+        return size
+    return (max(1, math.ceil(size[0] * scale)), max(1, math.ceil(size[1] * scale)))
+
+
+def open_image(path, box=None):
+    """Mở và giải mã ảnh thành RGB; nếu ảnh lớn hơn box thì thu nhỏ ngay lúc giải mã
+
+    Chỉ JPEG được giải mã thẳng ở độ phân giải 1/2, 1/4 hoặc 1/8 bằng draft(),
+    nên JPEG 8K không bao giờ nằm trong bộ nhớ ở kích thước đầy đủ. PNG, WebP và
+    các định dạng khác không hỗ trợ giải mã thu nhỏ: chúng được giải mã đầy đủ
+    rồi mới thu nhỏ nguyên lần bằng reduce(). Ảnh trả về có thể vẫn lớn hơn box
+    (tối đa 2 lần).
+    """
+    try:
+        img = Image.open(path)
+    except Exception as e:
+        raise InvalidImage(f"Không đọc được ảnh {os.path.basename(path)}: {str(e)}")
+    try:
+        if img.format not in IMAGE_FORMATS:
+            raise InvalidImage(f"Định dạng ảnh không hỗ trợ: {img.format}")
+        target = fit_size(img.size, box) if box else img.size
+        if target != img.size:
+            img.draft("RGB", target)
+        img.load()
+        factor = min(img.size[0] // target[0], img.size[1] // target[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return img
+    except InvalidImage:
+        img.close()
+        raise
+    except Exception as e:
+        img.close()
+        raise InvalidImage(f"Ảnh hỏng {os.path.basename(path)}: {str(e)}")
+
+
+class ImageIngest:
+    """Kiểm tra và chuẩn hóa ảnh trước khi render
+
+    Mỗi ảnh được giải mã một lần ở độ phân giải gần với mức lớn nhất mà render
+    cần (khung hình x zoom lớn nhất) và lưu thành bản RGB đúng kích thước, nên
+    các luồng render không phải giải mã ảnh quá lớn và không gặp ảnh hỏng. Ảnh
+    đã là JPEG/PNG RGB vừa kích thước thì dùng thẳng file gốc. Kết quả được
+    nhớ trong RenderCache theo hash nội dung ảnh.
+    """
+
+    JPEG_QUALITY = 95
+
+    def __init__(self, width, height, max_zoom=1.0, cache=None, workers=4, progress=None):
+        self.box = (math.ceil(width * max(1.0, max_zoom)), math.ceil(height * max(1.0, max_zoom)))
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._memo = {}
+
+    def ingest(self, path, temp_dir):
+        """Đường dẫn bản ảnh dùng để render (bản chuẩn hóa hoặc chính file gốc)
+
+        Ném InvalidImage nếu file không phải ảnh hoặc bị hỏng.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        memo_key = (path, stat.st_size, stat.st_mtime)
+        with self._lock:
+            if memo_key in self._memo:
+                return self._memo[memo_key]
+
+        key = make_key("ingest", hash_file(path), self.box, self.JPEG_QUALITY)
+        result = self._cached(key, path, temp_dir)
+        if result is None:
+            result = self._normalize(key, path, temp_dir)
+        with self._lock:
+            self._memo[memo_key] = result
+        return result
+
+    def _cached(self, key, path, temp_dir):
+        if self.cache is not None and self.cache.enabled:
+            info = self.cache.get_json(key)
+            if info is None:
+                return None
+            if not info.get("suffix"):
+                return path
+            return self.cache.get(key, info["suffix"])
+        for suffix in (".jpg", ".png"):
+            normalized_path = os.path.join(temp_dir, f"{key}{suffix}")
+            if os.path.exists(normalized_path):
+                return normalized_path
+        return None
+
+    def _normalize(self, key, path, temp_dir):
+        with open(path, "rb") as f:
+            if sniff_image_type(f.read(SNIFF_BYTES)) is None:
+                raise InvalidImage(f"Không phải file ảnh: {os.path.basename(path)}")
+        try:
+            with Image.open(path) as original:
+                source_format, source_mode, source_size = original.format, original.mode, original.size
+        except Exception as e:
+            raise InvalidImage(f"Không đọc được ảnh {os.path.basename(path)}: {str(e)}")
+        img = open_image(path, self.box)
+        try:
+            target = fit_size(source_size, self.box)
+            if target == source_size and source_format in ("JPEG", "PNG") and source_mode == "RGB":
+                # Ảnh đã hợp lệ và vừa kích thước: không cần bản sao
+                if self.cache is not None and self.cache.enabled:
+                    self.cache.put_json(key, {"suffix": None})
+                return path
+            if img.size != target:
+                img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+            suffix = ".jpg" if source_format in ("JPEG", "MPO") else ".png"
+            os.makedirs(temp_dir, exist_ok=True)
+            normalized_path = os.path.join(temp_dir, f"{key}{suffix}")
+            tmp_path = f"{normalized_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if suffix == ".jpg":
+                img.save(tmp_path, "JPEG", quality=self.JPEG_QUALITY)
+            else:
+                img.save(tmp_path, "PNG", compress_level=1)
+            os.replace(tmp_path, normalized_path)
+        finally:
+            img.close()
+
+        if self.cache is not None and self.cache.enabled:
+            normalized_path = self.cache.put(key, normalized_path, suffix)
+            self.cache.put_json(key, {"suffix": suffix})
+        return normalized_path
+
+    def ingest_all(self, paths, temp_dir):
+        """Chuẩn hóa song song nhiều ảnh, trả về {đường dẫn gốc: ảnh dùng để render}
+
+        Ảnh lỗi được bỏ qua (có cảnh báo), không có trong kết quả.
+        """
+        def ingest(path):
+            try:
+                return path, self.ingest(path, temp_dir)
+            except Exception as e:
+                if self.progress is not None:
+                    self.progress.print_warning(f"Bỏ qua ảnh {os.path.basename(path)}: {str(e)}")
+                return path, None
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, max(1, len(paths)))) as executor:
+            results = list(executor.map(ingest, paths))
+        return {path: result for path, result in results if result is not None}
@@ -1,13 +1,14 @@
 import os
 import configparser
-import whisper
 from audio_processor import AudioProcessor
 from video_processor import VideoProcessor
+from render_cache import RenderCache
+from render_settings import RenderSettings
+from transcriber import Transcriber, load_subtitle_file
+from pipeline import StageGraph
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
-import moviepy.config as moviepy_config
-moviepy_config.IMAGEMAGICK_BINARY = 'magick'
 
 class ProgressManager:
     def __init__(self):
@@ -26,11 +27,22 @@ class ProgressManager:
         self.console.print(Panel(Text(message, style="bold yellow"), border_style="yellow"))
 
 class VideoCreator:
-    def __init__(self, config_file="config.ini"):
-        self.config = self.load_config(config_file)
+    def __init__(self, config_file="config.ini", config=None, cache=None, limits=None):
+        # config/cache có thể truyền sẵn (chạy batch: cấu hình riêng từng job, cache dùng chung)
+        # limits (ResourceLimits) giới hạn số bước cùng loại chạy đồng thời giữa các job
+        if config is not None:
+            self.config = config
+            self.settings = RenderSettings.from_config(config)
+        else:
+            self.config = self.load_config(config_file)
         self.progress = ProgressManager()
-        self.audio_processor = AudioProcessor(self.config)
-        self.video_processor = VideoProcessor(self.config)
+        self.cache = cache if cache is not None else RenderCache.from_config(self.config)
+        self.limits = limits
+        # Thời gian chạy từng bước (giây) của lần create_video gần nhất
+        self.timings = {}
+        self.audio_processor = AudioProcessor(self.config, self.cache, self.settings)
+        self.video_processor = VideoProcessor(self.config, self.cache, self.settings)
+        self.transcriber = Transcriber(self.settings, self.cache, self.progress)
 
     def load_config(self, config_file):
         """Đọc file cấu hình"""
@@ -39,30 +51,109 @@ class VideoCreator:
 
         config = configparser.ConfigParser()
         config.read(config_file, encoding="utf-8")
+        # Chuyển kiểu toàn bộ thông số một lần, dùng chung cho audio và video
+        self.settings = RenderSettings.from_config(config)
         return config
    
+    def create_subtitles(self, audio_path):
+        """Đọc subtitle có sẵn hoặc tạo từ audio giọng đọc (chưa trộn nhạc nền)"""
+        if self.settings.subtitle_file:
+            if not os.path.exists(self.settings.subtitle_file):
+                raise FileNotFoundError(f"Không tìm thấy file subtitle: {self.settings.subtitle_file}")
+            subtitles = load_subtitle_file(self.settings.subtitle_file)
+            self.progress.print_message(f"Đã đọc {len(subtitles)} subtitle từ: {self.settings.subtitle_file}")
+            return subtitles
+        
+        if not self.settings.subtitle_enabled:
+            self.progress.print_message("Bỏ qua subtitle (enabled = 0)")
+            return []
+        
+        return self.transcriber.transcribe(audio_path)
+
+    def process_audio(self, output_dir):
+        """Bước 1: xử lý audio"""
+        self.progress.print_message("\nBước 1: Xử lý audio...")
+        audio = self.audio_processor.process_audio(output_dir)
+        
+        if not os.path.exists(audio.path) or not os.path.exists(audio.narration_path):
+            raise FileNotFoundError(f"Không tìm thấy file audio: {audio.path} hoặc {audio.narration_path}")
+        return audio
+
+    def process_subtitles(self, audio):
+        """Bước 2: tạo subtitle từ giọng đọc"""
+        self.progress.print_message("\nBước 2: Tạo subtitle...")
+        return self.create_subtitles(audio.narration_path)
+
+    def render_images(self, graph, output_dir, duration):
+        """Render hình theo thời lượng ước tính từ file gốc, trả về (video hình, thời lượng hình)"""
+        if duration is None:
+            # Không đọc được thời lượng từ header: đợi bước audio
+            duration = graph.result("audio").duration
+        self.progress.print_message(f"\nBước 3: Tạo video từ ảnh (audio ~{duration:.2f}s)...")
+        temp_video_path = self.video_processor.render_image_track(output_dir, duration)
+        return temp_video_path, self.video_processor.track_duration(duration)
+
+    def build_stages(self, output_dir):
+        """Đồ thị các bước của một video
+
+        Ở chế độ clips, hình chỉ phụ thuộc thời lượng audio nên được render ngay
+        từ đầu, song song với xử lý audio và transcribe; bước cuối chỉ còn ghép
+        (mux) hoặc mã hóa lại hình đã render (reencode). Chế độ stream chạy lần
+        lượt audio -> subtitle -> video.
+        """
+        graph = StageGraph(self.limits)
+        graph.add("audio", lambda: self.process_audio(output_dir), resource="audio")
+        graph.add("subtitle", lambda audio: self.process_subtitles(audio), deps=("audio",), resource="transcribe")
+        # Kiểm tra và chuẩn hóa ảnh ngay từ đầu, song song với audio; bước render dùng lại kết quả
+        graph.add("ingest", lambda: self.video_processor.ingest_images(output_dir), resource="ingest")
+        
+        if self.video_processor.can_render_early():
+            graph.add("duration", self.audio_processor.estimate_duration)
+            graph.add(
+                "images", lambda duration, ingest: self.render_images(graph, output_dir, duration),
+                deps=("duration", "ingest"), resource="render",
+            )
+            graph.add(
+                "video",
+                lambda audio, subtitle, images: self.video_processor.finalize_track(
+                    output_dir, audio, subtitle, *images
+                ),
+                deps=("audio", "subtitle", "images"), resource="encode",
+            )
+        else:
+            def create_video(audio, subtitle, ingest):
+                self.progress.print_message("\nBước 3: Tạo video...")
+                self.video_processor.create_video(output_dir, audio, subtitle)
+            
+            graph.add("video", create_video, deps=("audio", "subtitle", "ingest"), resource="render")
+        return graph
+
     def create_video(self):
         """Tạo video hoàn chỉnh"""
         try:
+            self.timings = {}
             # Tạo thư mục output nếu chưa tồn tại
-            output_dir = os.path.dirname(os.path.abspath(self.config["video"].get("output_file", "output_video.mp4")))
+            output_dir = os.path.dirname(os.path.abspath(self.settings.output_file))
             if not output_dir:
                 output_dir = os.getcwd()
-                self.config["video"]["output_file"] = os.path.join(output_dir, "output_video.mp4")
             
             os.makedirs(output_dir, exist_ok=True)
             self.progress.print_message(f"Đã tạo thư mục output: {output_dir}")
 
-            # Bước 1: Xử lý audio
-            self.progress.print_message("\nBước 1: Xử lý audio...")
-            temp_audio_path, temp_final_audio_path = self.audio_processor.process_audio(output_dir)
-            
-            if not os.path.exists(temp_final_audio_path) or not os.path.exists(temp_audio_path):
-                raise FileNotFoundError(f"Không tìm thấy file audio: {temp_final_audio_path} hoặc {temp_audio_path}")
+            graph = self.build_stages(output_dir)
+            try:
+                graph.run()
+            finally:
+                self.timings = dict(graph.timings)
             
-            # Bước 3: Tạo video
-            self.progress.print_message("\nBước 3: Tạo video...")
-            self.video_processor.create_video(output_dir, temp_audio_path, temp_final_audio_path)
+            # Thống kê cache
+            if self.cache.enabled:
+                self.cache.save()
+                stats = self.cache.stats()
+                self.progress.print_message(
+                    f"Cache: {stats['hits']} hit / {stats['misses']} miss, "
+                    f"{stats['entries']} mục, {stats['size_mb']:.1f} MB"
+                )
             
             self.progress.print_message("\nHoàn thành!")
             
@@ -0,0 +1,101 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StageSkipped(Exception):
+    """Bước không chạy vì một bước nó phụ thuộc đã lỗi"""
+
+
+class ResourceLimits:
+    """Giới hạn số bước cùng loại chạy đồng thời, dùng chung giữa nhiều StageGraph
+
+    Ví dụ khi chạy batch: ResourceLimits(render=1) để chỉ một job render clip
+    tại một thời điểm, trong khi job khác xử lý audio hoặc ghép video.
+    Loại tài nguyên không khai báo thì không giới hạn.
+    """
+
+    def __init__(self, **limits):
+        self._semaphores = {
+            name: threading.BoundedSemaphore(max(1, limit)) for name, limit in limits.items()
+        }
+
+    def acquire(self, resource):
+        semaphore = self._semaphores.get(resource)
+        if semaphore is not None:
+            semaphore.acquire()
+        return semaphore
+
+
+class StageGraph:
+    """Chạy các bước theo đồ thị phụ thuộc: mỗi bước bắt đầu ngay khi các bước
+    nó cần đã xong, các bước độc lập chạy song song trên các luồng riêng
+
+    fn của mỗi bước nhận kết quả các bước phụ thuộc dưới dạng tham số theo tên.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits
+        self.stages = {}
+        self.timings = {}
+        self._futures = {}
+
+    def add(self, name, fn, deps=(), resource=None):
+        for dep in deps:
+            if dep not in self.stages:
+                raise Exception(f"Bước {name} phụ thuộc bước chưa khai báo: {dep}")
+        self.stages[name] = (fn, tuple(deps), resource)
+        return self
+
+    def result(self, name):
+        """Chờ và lấy kết quả một bước (dùng bên trong fn của bước khác)"""
+        return self._futures[name].result()
+
+    def _run_stage(self, name):
+        fn, deps, resource = self.stages[name]
+        kwargs = {}
+        for dep in deps:
+            try:
+                kwargs[dep] = self.result(dep)
+            except Exception:
+                raise StageSkipped(f"Bỏ qua bước {name} vì bước {dep} bị lỗi")
+        semaphore = self.limits.acquire(resource) if self.limits and resource else None
+        try:
+            started = time.perf_counter()
+            try:
+                return fn(**kwargs)
+            finally:
+                self.timings[name] = time.perf_counter() - started
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def run(self):
+        """Chạy toàn bộ đồ thị, trả về {tên bước: kết quả}
+
+        Nếu có bước lỗi, ném lại lỗi của bước lỗi đầu tiên (theo thứ tự khai báo)
+        sau khi các bước đang chạy đã kết thúc.
+        """
+        self.timings = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stages))) as executor:
+            # Đăng ký đủ future trước khi bước nào bắt đầu chờ bước khác
+            start = threading.Event()
+
+            def run_stage(name):
+                start.wait()
+                return self._run_stage(name)
+
+            self._futures = {name: executor.submit(run_stage, name) for name in self.stages}
+            start.set()
+
+        results = {}
+        error = None
+        for name, future in self._futures.items():
+            exception = future.exception()
+            if exception is None:
+                results[name] = future.result()
+            elif error is None and not isinstance(exception, StageSkipped):
+                error = exception
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,228 @@
+import os
+import copy
+import json
+import time
+import shutil
+import hashlib
+import threading
+import numpy as np
+
+
+def hash_file(path):
+    """Tính SHA-1 nội dung file"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    """Tạo khóa cache từ các thành phần (hash nội dung, thông số cấu hình...)"""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:24]
+
+
+class RenderCache:
+    """Bộ nhớ đệm trên đĩa cho kết quả trung gian, giới hạn dung lượng theo LRU
+
+    Mỗi mục là một file `<khóa><đuôi>` trong thư mục cache. File index.json lưu
+    kích thước và thời điểm truy cập cuối của từng mục để xóa mục ít dùng nhất
+    khi vượt quá dung lượng. Các mục đã được dùng trong phiên hiện tại không bị
+    xóa để tránh mất clip đang chờ ghép.
+
+    Khi nhiều video dùng chung một cache (batch), mỗi video dùng một phiên riêng
+    tạo bằng session() và kết thúc bằng end_session(): mục chỉ được giữ khi còn
+    phiên nào đang dùng nó, nên giới hạn dung lượng vẫn có hiệu lực cả batch.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir="cache", max_size_mb=5120, enabled=True):
+        self.enabled = enabled
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Mục phiên này đã dùng, và số phiên đang dùng mỗi mục (dùng chung giữa các phiên)
+        self._session = set()
+        self._pins = {}
+        self._entries = {}
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._entries = self._load_index()
+
+    @classmethod
+    def from_config(cls, config):
+        """Tạo cache từ mục [cache] trong config.ini"""
+        if not config.has_section("cache"):
+            return cls(enabled=False)
+        section = config["cache"]
+        return cls(
+            cache_dir=section.get("cache_dir", "cache"),
+            max_size_mb=section.getfloat("max_size_mb", 5120),
+            enabled=section.getboolean("enabled", True),
+        )
+
+    def _load_index(self):
+        """Đọc index, bỏ qua các mục mà file đã bị xóa"""
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        entries = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                entries = {}
+        return {
+            name: entry for name, entry in entries.items()
+            if os.path.exists(os.path.join(self.cache_dir, name))
+        }
+
+    def _save_index(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, index_path)
+
+    def path_for(self, key, suffix):
+        """Đường dẫn file của một mục trong cache"""
+        return os.path.join(self.cache_dir, f"{key}{suffix}")
+
+    def get(self, key, suffix):
+        """Trả về đường dẫn file đã cache hoặc None nếu chưa có"""
+        if not self.enabled:
+            return None
+        name = f"{key}{suffix}"
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if name in self._entries and os.path.exists(path):
+                self._entries[name]["last_access"] = time.time()
+                self._use(name)
+                self.hits += 1
+                return path
+            self._entries.pop(name, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, src_path, suffix, move=True):
+        """Đưa file vào cache và trả về đường dẫn nên dùng tiếp theo"""
+        if not self.enabled:
+            return src_path
+        name = f"{key}{suffix}"
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if move:
+            shutil.move(src_path, tmp_path)
+        else:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._entries[name] = {"size": os.path.getsize(path), "last_access": time.time()}
+            self._use(name)
+            self._evict()
+            self._save_index()
+        return path
+
+    def get_array(self, key):
+        """Đọc mảng NumPy đã cache (ví dụ ảnh nền đã làm mờ)"""
+        path = self.get(key, ".npy")
+        if path is None:
+            return None
+        try:
+            return np.load(path)
+        except (OSError, ValueError):
+            return None
+
+    def put_array(self, key, array):
+        """Lưu mảng NumPy vào cache"""
+        if not self.enabled:
+            return
+        tmp_path = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.{threading.get_ident()}.npy")
+        np.save(tmp_path, array)
+        self.put(key, tmp_path, ".npy")
+
+    def get_json(self, key):
+        """Đọc dữ liệu JSON đã cache (ví dụ transcript Whisper)"""
+        path = self.get(key, ".json")
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_json(self, key, data):
+        """Lưu dữ liệu JSON vào cache"""
+        if not self.enabled:
+            return
+        tmp_path = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.{threading.get_ident()}.json")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        self.put(key, tmp_path, ".json")
+
+    def session(self):
+        """Phiên dùng cache mới (cùng thư mục, index và giới hạn dung lượng)"""
+        view = copy.copy(self)
+        view.hits = 0
+        view.misses = 0
+        view._session = set()
+        return view
+
+    def end_session(self):
+        """Bỏ giữ các mục phiên này đã dùng, rồi xóa bớt nếu cache vượt dung lượng"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for name in self._session:
+                count = self._pins.get(name, 0) - 1
+                if count > 0:
+                    self._pins[name] = count
+                else:
+                    self._pins.pop(name, None)
+            self._session = set()
+            self._evict()
+            self._save_index()
+
+    def _use(self, name):
+        """Đánh dấu mục được phiên này dùng (gọi khi đang giữ _lock)"""
+        if name not in self._session:
+            self._session.add(name)
+            self._pins[name] = self._pins.get(name, 0) + 1
+
+    def _evict(self):
+        """Xóa các mục ít được dùng nhất cho đến khi dưới giới hạn dung lượng"""
+        total = sum(entry["size"] for entry in self._entries.values())
+        if total <= self.max_size:
+            return
+        candidates = sorted(
+            (name for name in self._entries if name not in self._pins),
+            key=lambda name: self._entries[name]["last_access"],
+        )
+        for name in candidates:
+            if total <= self.max_size:
+                break
+            total -= self._entries.pop(name)["size"]
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def save(self):
+        """Ghi lại index (thời điểm truy cập) xuống đĩa"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._save_index()
+
+    def stats(self):
+        """Thống kê hit/miss và dung lượng hiện tại"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "size_mb": sum(entry["size"] for entry in self._entries.values()) / (1024 * 1024),
+            }
@@ -0,0 +1,184 @@
+import os
+from render_cache import make_key
+
+
+def parse_rgb(value, default=(0, 0, 0)):
+    """Chuyển 'rgb(R,G,B)', 'rgba(R,G,B,A)' hoặc '#RRGGBB' thành tuple (R, G, B)"""
+    value = (value or "").strip()
+    try:
+        if value.startswith(("rgb(", "rgba(")):
+            parts = value[value.index("(") + 1:value.rindex(")")].split(",")
+            return tuple(int(float(part)) for part in parts[:3])
+        if value.startswith("#") and len(value) >= 7:
+            return tuple(int(value[i:i + 2], 16) for i in (1, 3, 5))
+    except ValueError:
+        pass
+    return default
+
+
+def ass_color(value, opacity=1.0, default=(0, 0, 0)):
+    """Chuyển màu cấu hình thành mã màu ASS &HAABBGGRR (AA = 00 là đục hoàn toàn)"""
+    red, green, blue = parse_rgb(value, default)
+    alpha = int(round((1.0 - max(0.0, min(1.0, opacity))) * 255))
+    return f"&H{alpha:02X}{blue:02X}{green:02X}{red:02X}"
+
+
+# Số nhân CPU cho mỗi process transcribe mặc định: mỗi process giữ một bản
+# model Whisper trong RAM nên không chạy một process cho mỗi nhân
+CPUS_PER_WHISPER_WORKER = 4
+
+
+def default_whisper_workers():
+    """Số process transcribe khi không cấu hình: một process cho mỗi 4 nhân CPU"""
+    return max(1, (os.cpu_count() or 1) // CPUS_PER_WHISPER_WORKER)
+
+
+def _rebuild(values):
+    return RenderSettings(**values)
+
+
+class RenderSettings:
+    """Thông số render đọc một lần từ config.ini, bất biến và hash được
+
+    Dùng thay cho việc gọi configparser trong các vòng lặp nóng (mỗi khung hình,
+    mỗi dòng subtitle) và làm một phần của khóa cache.
+    """
+
+    __slots__ = (
+        # [video]
+        "audio_dir", "image_dir", "output_file", "subtitle_file",
+        "width", "height", "image_duration", "fps", "bitrate",
+        "max_threads", "render_backend", "render_workers", "output_mode", "finalize_mode",
+        "zoom_start", "zoom_end",
+        "background_music", "background_music_volume",
+        "audio_mode", "audio_stream_threshold", "audio_block_seconds",
+        "mix_mode", "mix_target_db", "mix_music_db", "mix_duck_db", "mix_ceiling_db",
+        # [image]
+        "blur_radius", "overlay_opacity", "image_scale",
+        # [subtitle]
+        "subtitle_font", "subtitle_font_size", "subtitle_color",
+        "subtitle_stroke_color", "subtitle_stroke_width",
+        "subtitle_background_color", "subtitle_background_opacity",
+        "subtitle_background_padding", "subtitle_background_radius",
+        "subtitle_position", "subtitle_margin_bottom",
+        "subtitle_x_position", "subtitle_y_position",
+        "subtitle_enabled", "subtitle_burn_mode", "whisper_language", "whisper_model",
+        "whisper_workers", "whisper_chunk_seconds", "whisper_long_audio",
+    )
+
+    def __init__(self, **values):
+        missing = set(self.__slots__) - set(values)
+        if missing:
+            raise TypeError(f"Thiếu thông số: {', '.join(sorted(missing))}")
+        unknown = set(values) - set(self.__slots__)
+        if unknown:
+            raise TypeError(f"Thông số không hợp lệ: {', '.join(sorted(unknown))}")
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    @classmethod
+    def from_config(cls, config):
+        """Đọc và chuyển kiểu toàn bộ thông số từ config"""
+        video = config["video"]
+        image = config["image"] if config.has_section("image") else {}
+        subtitle = config["subtitle"] if config.has_section("subtitle") else {}
+
+        def get(section, key, default):
+            return section.get(key, default) if section else default
+
+        def get_int(section, key, default):
+            return section.getint(key, default) if section else default
+
+        def get_float(section, key, default):
+            return section.getfloat(key, default) if section else default
+
+        return cls(
+            audio_dir=video.get("audio_dir", "audios"),
+            image_dir=video.get("image_dir", "images"),
+            output_file=video.get("output_file", "output_video.mp4"),
+            subtitle_file=video.get("subtitle_file", "").strip(),
+            width=video.getint("width", 1920),
+            height=video.getint("height", 1080),
+            image_duration=video.getfloat("image_duration", 6),
+            fps=video.getint("fps", 30),
+            bitrate=video.get("bitrate", "8000k"),
+            max_threads=video.getint("max_threads", 10),
+            render_backend=video.get("render_backend", "thread").strip().lower(),
+            render_workers=video.getint("render_workers", 0) or os.cpu_count() or 1,
+            output_mode=video.get("output_mode", "clips").strip().lower(),
+            finalize_mode=video.get("finalize_mode", "reencode").strip().lower(),
+            zoom_start=video.getfloat("zoom_start", 0.9),
+            zoom_end=video.getfloat("zoom_end", 1.4),
+            background_music=video.get("background_music", ""),
+            background_music_volume=video.getfloat("background_music_volume", 0.3),
+            audio_mode=video.get("audio_mode", "auto").strip().lower(),
+            audio_stream_threshold=video.getfloat("audio_stream_threshold", 1800),
+            audio_block_seconds=video.getfloat("audio_block_seconds", 10),
+            mix_mode=video.get("mix_mode", "fixed").strip().lower(),
+            mix_target_db=video.getfloat("mix_target_db", -16),
+            mix_music_db=video.getfloat("mix_music_db", -30),
+            mix_duck_db=video.getfloat("mix_duck_db", 10),
+            mix_ceiling_db=video.getfloat("mix_ceiling_db", -1),
+            blur_radius=get_int(image, "blur_radius", 10),
+            overlay_opacity=get_int(image, "overlay_opacity", 166),
+            image_scale=get_float(image, "scale", 0.9),
+            subtitle_font=get(subtitle, "font", "Arial"),
+            subtitle_font_size=get_int(subtitle, "font_size", 70),
+            subtitle_color=get(subtitle, "color", "#FFFFFF"),
+            subtitle_stroke_color=get(subtitle, "stroke_color", "#000000"),
+            subtitle_stroke_width=get_int(subtitle, "stroke_width", 2),
+            subtitle_background_color=get(subtitle, "background_color", "rgb(255,236,67)"),
+            subtitle_background_opacity=get_float(subtitle, "background_opacity", 0.7),
+            subtitle_background_padding=get_int(subtitle, "background_padding", 15),
+            subtitle_background_radius=get_int(subtitle, "background_radius", 10),
+            subtitle_position=get(subtitle, "position", "bottom").strip().lower(),
+            subtitle_margin_bottom=get_int(subtitle, "margin_bottom", 50),
+            subtitle_x_position=get_int(subtitle, "x_position", 0),
+            subtitle_y_position=get_int(subtitle, "y_position", 0),
+            subtitle_enabled=subtitle.getboolean("enabled", False) if subtitle else False,
+            subtitle_burn_mode=get(subtitle, "burn_mode", "ass").strip().lower(),
+            whisper_language=get(subtitle, "language", "vi"),
+            whisper_model=get(subtitle, "model", "base"),
+            whisper_workers=get_int(subtitle, "workers", 0) or default_whisper_workers(),
+            whisper_chunk_seconds=get_float(subtitle, "chunk_seconds", 120),
+            whisper_long_audio=get_float(subtitle, "long_audio_seconds", 600),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RenderSettings là bất biến, dùng replace() để tạo bản sao")
+
+    def __delattr__(self, name):
+        raise AttributeError("RenderSettings là bất biến")
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def values(self, *names):
+        """Tuple giá trị của các thông số được chọn"""
+        return tuple(getattr(self, name) for name in names)
+
+    def replace(self, **changes):
+        """Tạo bản sao với một số thông số thay đổi"""
+        values = self.as_dict()
+        values.update(changes)
+        return RenderSettings(**values)
+
+    def key(self, *names):
+        """Khóa cache từ các thông số được chọn (hoặc toàn bộ nếu không chỉ định)"""
+        return make_key("settings", self.values(*(names or self.__slots__)))
+
+    def __eq__(self, other):
+        if not isinstance(other, RenderSettings):
+            return NotImplemented
+        return self.values(*self.__slots__) == other.values(*other.__slots__)
+
+    def __hash__(self):
+        return hash(self.values(*self.__slots__))
+
+    def __reduce__(self):
+        # Cần cho pickle (process pool) vì __setattr__ bị chặn
+        return (_rebuild, (self.as_dict(),))
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"RenderSettings({fields})"
@@ -0,0 +1,72 @@
+import threading
+
+
+class OrderedCompletionQueue:
+    """Bảng slot theo chỉ số: việc xong không theo thứ tự nhưng được lấy ra đúng thứ tự"""
+
+    def __init__(self, start=0):
+        self._slots = {}
+        self._next = start
+        self._cond = threading.Condition()
+
+    def put(self, index, value):
+        """Đặt kết quả của việc thứ index vào slot"""
+        with self._cond:
+            self._slots[index] = value
+            if index == self._next:
+                self._cond.notify_all()
+
+    def _pop_ready(self):
+        ready = []
+        while self._next in self._slots:
+            ready.append((self._next, self._slots.pop(self._next)))
+            self._next += 1
+        return ready
+
+    def pop_prefix(self):
+        """Lấy ngay (không chờ) dãy kết quả liên tiếp đã xong tính từ chỉ số tiếp theo"""
+        with self._cond:
+            return self._pop_ready()
+
+    def wait_prefix(self, timeout=None):
+        """Chờ kết quả tiếp theo rồi trả về toàn bộ dãy liên tiếp đã xong"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._next in self._slots, timeout)
+            return self._pop_ready()
+
+
+def ordered_futures(executor, fn, items, window=None):
+    """Chạy fn(item) song song trên executor, trả về (item, future) đúng thứ tự items
+
+    window giới hạn số việc đang chạy hoặc đã xong nhưng chưa được tiêu thụ,
+    để bộ nhớ không tăng theo độ dài danh sách.
+    """
+    items = list(items)
+    if not items:
+        return
+    window = max(1, window or len(items))
+    queue = OrderedCompletionQueue()
+    submitted = 0
+
+    def submit(index):
+        future = executor.submit(fn, items[index])
+        future.add_done_callback(lambda f: queue.put(index, f))
+
+    while submitted < min(window, len(items)):
+        submit(submitted)
+        submitted += 1
+
+    consumed = 0
+    while consumed < len(items):
+        for index, future in queue.wait_prefix():
+            consumed += 1
+            if submitted < len(items):
+                submit(submitted)
+                submitted += 1
+            yield items[index], future
+
+
+def ordered_map(executor, fn, items, window=None):
+    """Như ordered_futures nhưng trả về (item, kết quả); lỗi của fn được ném lại"""
+    for item, future in ordered_futures(executor, fn, items, window):
+        yield item, future.result()
@@ -3,19 +3,33 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 import configparser
 import urllib.parse
 import os
+import re
+import sys
 import time
-import requests
 from urllib.parse import parse_qs, urlparse
 from tqdm import tqdm
+from bs4 import BeautifulSoup, SoupStrainer
 from colorama import init, Fore, Style
 import datetime
+from image_downloader import ImageDownloader
+from image_index import PerceptualIndex, hash_image_file
 
 # Initialize colorama
 init()
 
+# Collect this many candidate URLs per requested image to replace failed downloads
+CANDIDATE_FACTOR = 2
+# Max time to wait for a hovered thumbnail to get its imgres link (seconds)
+HOVER_TIMEOUT = 2
+# Images whose aHash and dHash both differ by at most this many bits (of 64) are duplicates
+DEDUPE_THRESHOLD = 6
+# Downloaded images are named image_1.jpg, image_2.jpg, ...
+IMAGE_NAME = re.compile(r"image_(\d+)\.\w+$")
+
 def print_status(message, status="info"):
     timestamp = datetime.datetime.now().strftime("%H:%M:%S")
     if status == "success":
@@ -36,18 +50,270 @@ def decode_image_url(imgres_url):
         return urllib.parse.unquote(params['imgurl'][0])
     return None
 
-def download_image(url, output_dir, filename):
+def imgres_href(link):
+    """The anchor's href if it is already an imgres link, otherwise False"""
+    href = link.get_attribute('href') or ''
+    return href if 'imgres' in href else False
+
+def collect_image_urls(driver, max_urls):
+    """Collect up to max_urls full-size image URLs from the loaded results page.
+
+    Google fills in the imgres link of a thumbnail when it is hovered, so each
+    anchor is hovered and its href polled briefly instead of sleeping a fixed time.
+    """
+    image_elements = driver.find_elements(By.CSS_SELECTOR, "#search img")
+    print_status(f"Found {len(image_elements)} images on the page", "info")
+    
+    image_urls = []
+    for img in image_elements:
+        if len(image_urls) >= max_urls:
+            break
+        try:
+            # Find the parent anchor tag
+            parent_link = img.find_element(By.XPATH, "./ancestor::a")
+            href = imgres_href(parent_link)
+            if not href:
+                # Hover over the image to trigger the preview link
+                ActionChains(driver).move_to_element(img).perform()
+                try:
+                    href = WebDriverWait(driver, HOVER_TIMEOUT, poll_frequency=0.05).until(
+                        lambda d: imgres_href(parent_link)
+                    )
+                except TimeoutException:
+                    continue
+            image_url = decode_image_url(href)
+            if image_url and image_url not in image_urls:
+                image_urls.append(image_url)
+        except Exception as e:
+            print_status(f"Error processing image: {e}", "error")
+            continue
+    return image_urls
+
+def create_driver(headless=True, light=True):
+    """Start Chrome; light mode blocks images and stylesheets (only the DOM is needed)"""
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1920,1080")
+    if light:
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.stylesheets": 2,
+        })
+        options.add_argument("--blink-settings=imagesEnabled=false")
+    driver = webdriver.Chrome(options=options)
+    if not headless:
+        driver.maximize_window()
+    return driver
+
+def extract_image_urls(hrefs, max_urls=None):
+    """Decode the imgurl of every imgres link in bulk, keeping page order and dropping duplicates"""
+    image_urls = {}
+    for href in hrefs:
+        if href and 'imgurl=' in href:
+            image_url = decode_image_url(href)
+            if image_url:
+                image_urls[image_url] = None
+                if max_urls and len(image_urls) >= max_urls:
+                    break
+    return list(image_urls)
+
+def collect_image_urls_fast(driver, max_urls):
+    """Read every anchor href of the results in a single WebDriver round-trip"""
+    hrefs = driver.execute_script(
+        "return Array.from(document.querySelectorAll('#search a[href]'), a => a.href);"
+    )
+    print_status(f"Found {len(hrefs)} links on the page", "info")
+    return extract_image_urls(hrefs, max_urls)
+
+def parse_result_html(html, max_urls=None, strainer=True):
+    """Extract image URLs from a saved results page without a browser.
+
+    With strainer=True only <a href> tags are built into the tree, which is
+    much faster than parsing the whole page.
+    """
+    if strainer:
+        soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("a", href=True))
+        anchors = soup.find_all("a")
+    else:
+        soup = BeautifulSoup(html, "html.parser")
+        anchors = soup.select("#search a[href]") or soup.find_all("a", href=True)
+    return extract_image_urls((a.get("href") for a in anchors), max_urls)
+
+def search_images(query_string, limit, output_dir, driver=None, downloader=None, mode="fast",
+                  dedupe_threshold=DEDUPE_THRESHOLD):
+    """Search Google Images and download up to `limit` images into output_dir.
+
+    mode "fast" runs Chrome headless without images/CSS and reads all links in
+    one call; mode "hover" uses a visible browser and hovers each thumbnail
+    (slower, but works when the links are only filled in on hover). Fast mode
+    falls back to hovering on the same page if it finds no links.
+
+    All candidate URLs are collected from the page first, then downloaded
+    concurrently by an ImageDownloader (pooled session, per-host limits,
+    timeouts and retries). A driver and a downloader can be passed in to be
+    reused for several searches; otherwise they are created and closed here.
+    Returns the number of downloaded images.
+    """
+    own_driver = driver is None
+    if own_driver:
+        print_status(f"Initializing Chrome WebDriver ({mode} mode)...", "info")
+        driver = create_driver(headless=mode == "fast", light=mode == "fast")
+    
+    try:
+        # Navigate to Google Images
+        search_url = f"https://www.google.com/search?q={urllib.parse.quote(query_string)}&tbm=isch"
+        print_status(f"Navigating to: {search_url}", "info")
+        driver.get(search_url)
+        
+        # Wait for the search div to load
+        print_status("Waiting for images to load...", "info")
+        WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.ID, "search"))
+        )
+        
+        # Collect extra candidates so failed downloads can be replaced
+        max_urls = limit * CANDIDATE_FACTOR
+        image_urls = collect_image_urls_fast(driver, max_urls) if mode == "fast" else []
+        if not image_urls:
+            if mode == "fast":
+                print_status("No image links in the page, falling back to hovering thumbnails", "warning")
+            image_urls = collect_image_urls(driver, max_urls)
+        print_status(f"Collected {len(image_urls)} image URLs", "info")
+    finally:
+        if own_driver:
+            print_status("Closing browser...", "info")
+            driver.quit()
+    
+    return download_images(image_urls, limit, output_dir, downloader, dedupe_threshold)
+
+def search_images_offline(html_path, limit, output_dir, downloader=None, dedupe_threshold=DEDUPE_THRESHOLD):
+    """Download images listed in a saved results page (no browser needed)"""
+    with open(html_path, "r", encoding="utf-8", errors="replace") as f:
+        image_urls = parse_result_html(f.read(), limit * CANDIDATE_FACTOR)
+    print_status(f"Collected {len(image_urls)} image URLs from {html_path}", "info")
+    return download_images(image_urls, limit, output_dir, downloader, dedupe_threshold)
+
+def next_image_number(output_dir):
+    """First free N for image_N.* so new downloads never overwrite existing images"""
+    numbers = [int(match.group(1)) for match in map(IMAGE_NAME.match, os.listdir(output_dir)) if match]
+    return max(numbers, default=0) + 1
+
+def download_images(image_urls, limit, output_dir, downloader=None, dedupe_threshold=DEDUPE_THRESHOLD):
+    """Download up to `limit` of the collected URLs, returns the number of downloaded images
+
+    With dedupe_threshold set (None disables it), every finished download is
+    checked against the perceptual-hash index kept in output_dir. Duplicates
+    and near-duplicates of images already there, or of another image from this
+    batch, are deleted right away and replaced by the next candidate URL.
+    """
+    # Create output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+        print_status(f"Created output directory: {output_dir}", "success")
+    
+    own_downloader = downloader is None
+    if own_downloader:
+        downloader = ImageDownloader()
+    
+    index = None
+    if dedupe_threshold is not None:
+        index = PerceptualIndex(output_dir, dedupe_threshold).refresh()
+        print_status(f"Duplicate check against {len(index)} existing images", "info")
+    duplicates = []
+    # Images of this batch are indexed under their temporary name until download_all renames them
+    sources = {}
+    
+    def accept(result):
+        name = os.path.basename(result.path)
+        match = index.add_if_new(name, hash_image_file(result.path))
+        if match:
+            duplicates.append(result.url)
+            return f"Duplicate of {sources.get(match[0], match[0])} ({match[1]}/64 bits differ)"
+        sources[name] = result.url
+        return None
+    
+    # Create progress bar
+    pbar = tqdm(total=min(limit, len(image_urls)), 
+               desc="Downloading images",
+               unit="image",
+               bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]')
+    
+    def on_result(result):
+        if result.ok:
+            pbar.update(1)
+        elif result.url in duplicates:
+            print_status(f"Skipped {result.url}: {result.error}", "warning")
+        else:
+            print_status(f"Error downloading image {result.url}: {result.error}", "error")
+    
     try:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            file_path = os.path.join(output_dir, filename)
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
-            return True
-    except Exception as e:
-        print_status(f"Error downloading image: {e}", "error")
-    return False
+        results = downloader.download_all(
+            image_urls, output_dir, limit=limit, start=next_image_number(output_dir),
+            accept=accept if index is not None else None, on_result=on_result,
+        )
+    finally:
+        pbar.close()
+        if own_downloader:
+            downloader.close()
+    
+    if index is not None:
+        # Pick up the final image_N names of the accepted downloads
+        index.refresh()
+        index.save()
+    
+    downloaded_count = sum(1 for result in results if result.ok)
+    failed_count = len(results) - downloaded_count - len(duplicates)
+    print_status("=" * 50, "info")
+    print_status(f"Download completed!", "success")
+    print_status(f"Successfully downloaded: {downloaded_count} images", "success")
+    if duplicates:
+        print_status(f"Skipped duplicates: {len(duplicates)} images", "warning")
+    if failed_count > 0:
+        print_status(f"Failed to download: {failed_count} images", "warning")
+    print_status(f"Total images processed: {len(results)}", "info")
+    print_status("=" * 50, "info")
+    return downloaded_count
+
+def dedupe_threshold_from_config(config):
+    """dedupe_threshold from [image_search], None when dedupe is turned off"""
+    if not config.has_section('image_search'):
+        return DEDUPE_THRESHOLD
+    section = config['image_search']
+    if not section.getboolean('dedupe', True):
+        return None
+    return section.getint('dedupe_threshold', DEDUPE_THRESHOLD)
+
+def make_fixture_page(results=100, filler=20):
+    """Synthetic results page: `results` imgres anchors among scripts and nested markup"""
+    blocks = []
+    for i in range(results):
+        image_url = urllib.parse.quote(f"https://example{i % 7}.com/photos/{i}/image-{i}.jpg?size=large&id={i}", safe="")
+        page_url = urllib.parse.quote(f"https://example{i % 7}.com/article/{i}", safe="")
+        blocks.append(
+            f'<div class="isv-r" data-id="{i}"><div class="bRMDJf">'
+            f'<a class="wXeWr islib nfEiy" href="/imgres?imgurl={image_url}&amp;imgrefurl={page_url}'
+            f'&amp;tbnid=t{i}&amp;docid=d{i}&amp;w=1600&amp;h=900">'
+            f'<div class="bRMDJf islir"><img class="rg_i Q4LuWd" alt="result {i}" '
+            f'data-src="https://encrypted-tbn0.gstatic.com/images?q=tbn:{i}"></div></a>'
+            f'<a class="VFACy kGQAp" href="https://example{i % 7}.com/article/{i}">Article {i}</a>'
+            f'</div></div>'
+        )
+        blocks.append("<script>" + "var x=" + "[1,2,3]," * filler + "0;</script>")
+    return f'<html><head><style>{"a{color:red}" * 200}</style></head><body><div id="search">{"".join(blocks)}</div></body></html>'
+
+def benchmark_parsers(html_pages, repeat=5):
+    """Pages/s and URLs found for the full-tree and <a>-only BeautifulSoup parsers"""
+    rows = []
+    for name, strainer in (("BeautifulSoup full tree", False), ("BeautifulSoup <a> only", True)):
+        found = [len(parse_result_html(html, strainer=strainer)) for html in html_pages]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for html in html_pages:
+                parse_result_html(html, strainer=strainer)
+        rate = repeat * len(html_pages) / (time.perf_counter() - start)
+        rows.append((name, rate, found))
+    return rows
 
 def main():
     print_status("Starting Google Images Downloader", "info")
@@ -60,88 +326,38 @@ def main():
     query_string = config['image_search']['query_string']
     limit = int(config['image_search']['limit'])
     output_dir = config['image_search']['output_dir']
+    mode = config['image_search'].get('mode', 'fast').strip().lower()
+    html_file = config['image_search'].get('html_file', '').strip()
+    dedupe_threshold = dedupe_threshold_from_config(config)
     
     print_status(f"Search Query: {query_string}", "info")
     print_status(f"Download Limit: {limit} images", "info")
     print_status(f"Output Directory: {output_dir}", "info")
     print_status("=" * 50, "info")
     
-    # Create output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        print_status(f"Created output directory: {output_dir}", "success")
-    
-    print_status("Initializing Chrome WebDriver...", "info")
-    driver = webdriver.Chrome()
-    driver.maximize_window()
-    
-    try:
-        # Navigate to Google Images
-        search_url = f"https://www.google.com/search?q={urllib.parse.quote(query_string)}&tbm=isch"
-        print_status(f"Navigating to: {search_url}", "info")
-        driver.get(search_url)
-        
-        # Wait for the search div to load
-        print_status("Waiting for images to load...", "info")
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "search"))
-        )
-        
-        # Find all image elements within the search div
-        image_elements = driver.find_elements(By.CSS_SELECTOR, "#search img")
-        total_images = len(image_elements)
-        print_status(f"Found {total_images} images on the page", "info")
-        
-        # Create progress bar
-        pbar = tqdm(total=min(limit, total_images), 
-                   desc="Downloading images",
-                   unit="image",
-                   bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]')
-        
-        downloaded_count = 0
-        failed_count = 0
-        
-        for img in image_elements:
-            if downloaded_count >= limit:
-                break
-                
-            try:
-                # Find the parent anchor tag
-                parent_link = img.find_element(By.XPATH, "./ancestor::a")
-                
-                # Hover over the image to trigger the preview
-                ActionChains(driver).move_to_element(img).perform()
-                time.sleep(1)  # Wait for hover effect
-                
-                # Get the href attribute
-                href = parent_link.get_attribute('href')
-                if href and 'imgres' in href:
-                    image_url = decode_image_url(href)
-                    if image_url:
-                        # Generate filename
-                        filename = f"image_{downloaded_count + 1}.jpg"
-                        if download_image(image_url, output_dir, filename):
-                            pbar.update(1)
-                            downloaded_count += 1
-                        else:
-                            failed_count += 1
-            except Exception as e:
-                print_status(f"Error processing image: {e}", "error")
-                failed_count += 1
-                continue
-        
-        pbar.close()
-        print_status("=" * 50, "info")
-        print_status(f"Download completed!", "success")
-        print_status(f"Successfully downloaded: {downloaded_count} images", "success")
-        if failed_count > 0:
-            print_status(f"Failed to download: {failed_count} images", "warning")
-        print_status(f"Total images processed: {downloaded_count + failed_count}", "info")
-        print_status("=" * 50, "info")
-                
-    finally:
-        print_status("Closing browser...", "info")
-        driver.quit()
+    with ImageDownloader.from_config(config) as downloader:
+        if html_file:
+            search_images_offline(html_file, limit, output_dir, downloader=downloader,
+                                  dedupe_threshold=dedupe_threshold)
+        else:
+            search_images(query_string, limit, output_dir, downloader=downloader, mode=mode,
+                          dedupe_threshold=dedupe_threshold)
+
+def run_benchmark(paths):
+    """Benchmark the offline parser on saved pages (or a synthetic page when none are given)"""
+    if paths:
+        pages = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                pages.append(f.read())
+    else:
+        pages = [make_fixture_page()]
+    print_status(f"Benchmarking parsers on {len(pages)} page(s), {sum(map(len, pages)) / 1024:.0f} KB", "info")
+    for name, rate, found in benchmark_parsers(pages):
+        print_status(f"{name:26s} {rate:8.1f} pages/s, URLs found: {found}", "info")
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        run_benchmark(sys.argv[2:])
+    else:
+        main() 
\ No newline at end of file
@@ -0,0 +1,127 @@
+import re
+import subprocess
+import threading
+
+
+def escape_filter_path(path):
+    """Escape đường dẫn file để dùng làm tham số filter của ffmpeg (-vf)
+
+    Cần hai lớp escape: một cho giá trị tùy chọn của filter (\\ : ') và một cho
+    cú pháp filtergraph (\\ ' [ ] , ;). Dấu \\ của Windows được đổi thành /.
+    """
+    path = path.replace("\\", "/")
+    path = re.sub(r"([\\:'])", r"\\\1", path)
+    return re.sub(r"([\\'\[\],;])", r"\\\1", path)
+
+
+def ass_filter(subtitle_path):
+    """Filter libass chèn file .ass vào video"""
+    return f"ass={escape_filter_path(subtitle_path)}"
+
+
+class FFmpegStreamWriter:
+    """Đẩy khung hình RGB thô vào một tiến trình ffmpeg duy nhất qua stdin
+
+    Video được mã hóa đúng một lần; nếu có audio_path thì audio được đưa vào
+    như input thứ hai và ghép luôn trong cùng lần mã hóa.
+    """
+
+    def __init__(self, output_path, width, height, fps, audio_path=None,
+                 bitrate=None, preset="ultrafast", audio_codec="aac", duration=None,
+                 video_filter=None):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_path = audio_path
+        self.bitrate = bitrate
+        self.preset = preset
+        self.audio_codec = audio_codec
+        self.duration = duration
+        self.video_filter = video_filter
+        self.frame_count = 0
+        self.process = None
+        self._stderr = []
+        self._stderr_thread = None
+
+    def build_command(self):
+        """Tạo lệnh ffmpeg"""
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',
+            '-s', f'{self.width}x{self.height}',
+            '-r', str(self.fps),
+            '-i', '-',
+        ]
+        if self.audio_path:
+            cmd += ['-i', self.audio_path, '-map', '0:v:0', '-map', '1:a:0']
+        if self.video_filter:
+            cmd += ['-vf', self.video_filter]
+        cmd += ['-c:v', 'libx264', '-preset', self.preset, '-pix_fmt', 'yuv420p']
+        if self.bitrate:
+            cmd += ['-b:v', self.bitrate]
+        if self.audio_path:
+            cmd += ['-c:a', self.audio_codec]
+        if self.duration:
+            cmd += ['-t', f'{self.duration:.3f}']
+        cmd.append(self.output_path)
+        return cmd
+
+    def open(self):
+        """Khởi động tiến trình ffmpeg"""
+        self.process = subprocess.Popen(
+            self.build_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        # Đọc stderr ở thread riêng để ffmpeg không bị chặn khi log nhiều
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+        return self
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self._stderr.append(line.decode("utf-8", errors="replace"))
+
+    def write_frame(self, frame):
+        """Ghi một khung hình uint8 (height, width, 3)"""
+        try:
+            self.process.stdin.write(memoryview(frame).cast("B"))
+        except (BrokenPipeError, OSError):
+            self.close()
+            raise
+        self.frame_count += 1
+
+    def close(self):
+        """Đóng stdin, đợi ffmpeg kết thúc và kiểm tra mã thoát"""
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        returncode = process.wait()
+        self._stderr_thread.join()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg lỗi (mã {returncode}): {''.join(self._stderr).strip()}")
+
+    def abort(self):
+        """Dừng ffmpeg ngay khi có lỗi ở phía tạo khung hình"""
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        process.kill()
+        process.wait()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
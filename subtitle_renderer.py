@@ -0,0 +1,202 @@
+import math
+import time
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from branding import blend_premultiplied
+from render_settings import parse_rgb
+
+
+@lru_cache(maxsize=16)
+def load_font(name, size):
+    """Nạp font TrueType một lần cho mỗi (tên, cỡ chữ), thử cả tên file thường gặp"""
+    for candidate in (name, name.lower(), f"{name}.ttf", f"{name.lower()}.ttf", "DejaVuSans.ttf"):
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+class SubtitleTrack:
+    """Danh sách subtitle sắp theo thời gian, tra dòng đang hiển thị tại thời điểm t"""
+
+    def __init__(self, subtitles):
+        self.subtitles = sorted(subtitles or [], key=lambda sub: sub["start"])
+        self.starts = [sub["start"] for sub in self.subtitles]
+
+    def text_at(self, t):
+        index = bisect_right(self.starts, t) - 1
+        if index >= 0 and t < self.subtitles[index]["end"]:
+            return self.subtitles[index]["text"]
+        return None
+
+
+class SubtitleRenderer:
+    """Vẽ subtitle bằng PIL ngay trong process, không gọi ImageMagick
+
+    Mỗi dòng được vẽ một lần thành sprite RGBA (chữ + khung nền bo góc), giữ
+    trong LRU dưới dạng premultiplied alpha và trộn vào khung hình bằng NumPy.
+    """
+
+    # Khoảng cách giữa các dòng khi subtitle bị xuống dòng (px)
+    LINE_SPACING = 4
+
+    def __init__(self, settings, width, height, cache_size=32):
+        self.width = width
+        self.height = height
+        self.font = load_font(settings.subtitle_font, settings.subtitle_font_size)
+        self.color = parse_rgb(settings.subtitle_color, (255, 255, 255))
+        self.stroke_color = parse_rgb(settings.subtitle_stroke_color)
+        self.stroke_width = settings.subtitle_stroke_width
+        self.background_color = parse_rgb(settings.subtitle_background_color)
+        self.background_opacity = settings.subtitle_background_opacity
+        self.padding = settings.subtitle_background_padding
+        self.radius = settings.subtitle_background_radius
+        self.position = settings.subtitle_position
+        self.margin_bottom = settings.subtitle_margin_bottom
+        self.x_position = settings.subtitle_x_position
+        self.y_position = settings.subtitle_y_position
+        # Giới hạn chiều rộng subtitle 70% khung hình
+        self.max_width = int(width * 0.7)
+        self.cache_size = cache_size
+        self._sprites = OrderedDict()
+        self._lock = threading.Lock()
+
+    def wrap(self, text):
+        """Ngắt dòng theo từ để mỗi dòng không vượt quá max_width"""
+        lines = []
+        for paragraph in text.splitlines() or [""]:
+            line = ""
+            for word in paragraph.split():
+                candidate = f"{line} {word}" if line else word
+                if line and self.font.getlength(candidate) + 2 * self.stroke_width > self.max_width:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = candidate
+            lines.append(line)
+        return "\n".join(lines)
+
+    def render_line(self, text):
+        """Vẽ một subtitle thành ảnh RGBA uint8 (chưa cache)"""
+        text = self.wrap(text)
+        stroke = self.stroke_width
+        probe = ImageDraw.Draw(Image.new("L", (1, 1)))
+        left, top, right, bottom = probe.multiline_textbbox(
+            (0, 0), text, font=self.font, spacing=self.LINE_SPACING, align="center", stroke_width=stroke
+        )
+        left, top = math.floor(left), math.floor(top)
+        right, bottom = math.ceil(right), math.ceil(bottom)
+        size = (right - left + 2 * self.padding, bottom - top + 2 * self.padding)
+
+        sprite = Image.new("RGBA", size, (0, 0, 0, 0))
+        if self.background_opacity > 0:
+            alpha = int(round(255 * min(1.0, self.background_opacity)))
+            ImageDraw.Draw(sprite).rounded_rectangle(
+                (0, 0, size[0] - 1, size[1] - 1), radius=self.radius,
+                fill=self.background_color + (alpha,),
+            )
+
+        # Vẽ chữ trên lớp riêng rồi alpha_composite để viền chữ trộn đúng với nền
+        layer = Image.new("RGBA", size, (0, 0, 0, 0))
+        ImageDraw.Draw(layer).multiline_text(
+            (self.padding - left, self.padding - top), text, font=self.font,
+            fill=self.color + (255,), spacing=self.LINE_SPACING, align="center",
+            stroke_width=stroke, stroke_fill=self.stroke_color + (255,),
+        )
+        return np.asarray(Image.alpha_composite(sprite, layer))
+
+    def sprite(self, text):
+        """Sprite đã premultiply (premultiplied, inverse_alpha) của một subtitle, lấy từ LRU"""
+        with self._lock:
+            cached = self._sprites.get(text)
+            if cached is not None:
+                self._sprites.move_to_end(text)
+                return cached
+
+        rgba = self.render_line(text).astype(np.float32)
+        alpha = rgba[:, :, 3:4] / 255.0
+        premultiplied = rgba[:, :, :3] * alpha
+        inverse_alpha = 1.0 - alpha
+        premultiplied.setflags(write=False)
+        inverse_alpha.setflags(write=False)
+        cached = (premultiplied, inverse_alpha)
+
+        with self._lock:
+            self._sprites[text] = cached
+            while len(self._sprites) > self.cache_size:
+                self._sprites.popitem(last=False)
+        return cached
+
+    def place(self, size):
+        """Tọa độ góc trên trái của sprite theo cấu hình position"""
+        width, height = size
+        x = (self.width - width) // 2
+        if self.position == "top":
+            return x, self.margin_bottom
+        if self.position == "center":
+            return x, (self.height - height) // 2
+        if self.position == "custom":
+            return self.x_position, self.y_position
+        return x, self.height - self.margin_bottom - height
+
+    def composite(self, frame, text):
+        """Trộn subtitle vào frame (uint8 HxWx3) tại chỗ"""
+        if not text:
+            return frame
+        premultiplied, inverse_alpha = self.sprite(text)
+        x, y = self.place((inverse_alpha.shape[1], inverse_alpha.shape[0]))
+        return blend_premultiplied(frame, premultiplied, inverse_alpha, x, y)
+
+
+def benchmark(lines=200, font="Arial", font_size=70):
+    """So sánh số dòng/giây giữa TextClip (ImageMagick) và SubtitleRenderer"""
+    import configparser
+    from render_settings import RenderSettings
+
+    config = configparser.ConfigParser()
+    config.read_dict({"video": {}, "subtitle": {
+        "font": font, "font_size": str(font_size), "stroke_color": "rgb(0,0,0)",
+        "background_color": "rgb(0,0,0)",
+    }})
+    settings = RenderSettings.from_config(config)
+    texts = [f"Dòng subtitle thử nghiệm số {i} với vài từ tiếng Việt có dấu" for i in range(lines)]
+
+    renderer = SubtitleRenderer(settings, 1920, 1080, cache_size=lines)
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    start = time.perf_counter()
+    for text in texts:
+        renderer.composite(frame, text)
+    pil_rate = lines / (time.perf_counter() - start)
+
+    # Dòng đã có trong cache: chi phí mỗi khung hình chỉ còn phép trộn
+    start = time.perf_counter()
+    for text in texts:
+        renderer.composite(frame, text)
+    cached_rate = lines / (time.perf_counter() - start)
+
+    magick_rate = None
+    try:
+        from moviepy.editor import TextClip
+        sample = texts[:max(1, lines // 10)]
+        start = time.perf_counter()
+        for text in sample:
+            TextClip(text, fontsize=font_size, font=font, color="white",
+                     stroke_color="black", stroke_width=2, method="label").close()
+        magick_rate = len(sample) / (time.perf_counter() - start)
+    except Exception as e:
+        print(f"Bỏ qua TextClip (ImageMagick): {str(e).splitlines()[0]}")
+
+    return magick_rate, pil_rate, cached_rate
+
+
+if __name__ == "__main__":
+    magick_rate, pil_rate, cached_rate = benchmark()
+    if magick_rate:
+        print(f"TextClip (ImageMagick): {magick_rate:8.1f} dòng/s")
+    print(f"SubtitleRenderer:       {pil_rate:8.1f} dòng/s")
+    print(f"SubtitleRenderer cache: {cached_rate:8.1f} dòng/s")
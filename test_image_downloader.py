@@ -0,0 +1,162 @@
+import io
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+from image_downloader import ImageDownloader
+
+
+def make_image_bytes(fmt="JPEG", color=(200, 40, 40)):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class ImageServer:
+    """Máy chủ HTTP cục bộ cho test: ảnh hợp lệ, lỗi 503 tạm thời, nội dung bị cắt và trang HTML giả ảnh
+
+    - /img<N>.jpg: ảnh JPEG (chờ delay giây để đo số kết nối đồng thời)
+    - /photo.jpg: thật ra là ảnh PNG
+    - /flaky.jpg: lần đầu trả 503, các lần sau trả ảnh
+    - /cut.jpg: lần đầu gửi một nửa nội dung rồi đóng kết nối, các lần sau trả đủ
+    - /page.jpg: trang HTML với Content-Type image/jpeg
+    """
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.jpeg = make_image_bytes("JPEG")
+        self.png = make_image_bytes("PNG", (40, 200, 40))
+        self.hits = {}
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    hits = server.hits[self.path] = server.hits.get(self.path, 0) + 1
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    server.handle(self, hits)
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+
+    def handle(self, request, hits):
+        path = request.path
+        if path.startswith("/img"):
+            time.sleep(self.delay)
+            self.send(request, 200, self.jpeg)
+        elif path == "/photo.jpg":
+            self.send(request, 200, self.png)
+        elif path == "/flaky.jpg":
+            if hits == 1:
+                self.send(request, 503, b"busy", "text/plain")
+            else:
+                self.send(request, 200, self.jpeg)
+        elif path == "/cut.jpg":
+            if hits == 1:
+                request.send_response(200)
+                request.send_header("Content-Type", "image/jpeg")
+                request.send_header("Content-Length", str(len(self.jpeg)))
+                request.end_headers()
+                request.wfile.write(self.jpeg[:len(self.jpeg) // 2])
+                request.wfile.flush()
+                request.close_connection = True
+            else:
+                self.send(request, 200, self.jpeg)
+        elif path == "/page.jpg":
+            self.send(request, 200, b"<html><body>Not found</body></html>" * 10)
+        else:
+            self.send(request, 404, b"missing", "text/plain")
+
+    @staticmethod
+    def send(request, status, body, content_type="image/jpeg"):
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ImageDownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ImageServer().__enter__()
+        self.output_dir = tempfile.mkdtemp()
+        self.downloader = ImageDownloader(workers=6, per_host=2, timeout=5, retries=2, backoff=0.01)
+
+    def tearDown(self):
+        self.downloader.close()
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def test_downloads_concurrently_within_per_host_limit(self):
+        urls = [self.server.url(f"/img{i}.jpg") for i in range(6)]
+        started = time.perf_counter()
+        results = self.downloader.download_all(urls, self.output_dir)
+        elapsed = time.perf_counter() - started
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(sorted(os.listdir(self.output_dir)), [f"image_{i}.jpg" for i in range(1, 7)])
+        self.assertEqual(self.server.max_active, 2)
+        # 6 ảnh, mỗi ảnh chờ 0.2s, 2 kết nối song song: ~0.6s thay vì 1.2s
+        self.assertLess(elapsed, 6 * self.server.delay)
+
+    def test_retries_server_error_and_broken_body(self):
+        urls = [self.server.url("/flaky.jpg"), self.server.url("/cut.jpg")]
+        results = self.downloader.download_all(urls, self.output_dir)
+
+        self.assertEqual([result.ok for result in results], [True, True])
+        self.assertEqual(self.server.hits["/flaky.jpg"], 2)
+        self.assertEqual(self.server.hits["/cut.jpg"], 2)
+        for result in results:
+            with open(result.path, "rb") as f:
+                self.assertEqual(f.read(), self.server.jpeg)
+
+    def test_rejects_non_image_and_uses_spare_url(self):
+        urls = [self.server.url("/page.jpg"), self.server.url("/img1.jpg"), self.server.url("/img2.jpg")]
+        results = self.downloader.download_all(urls, self.output_dir, limit=2)
+
+        self.assertFalse(results[0].ok)
+        self.assertIn("Không phải file ảnh", results[0].error)
+        self.assertEqual(self.server.hits["/page.jpg"], 1)
+        self.assertEqual(sum(result.ok for result in results), 2)
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["image_1.jpg", "image_2.jpg"])
+
+    def test_names_file_by_sniffed_content(self):
+        results = self.downloader.download_all([self.server.url("/photo.jpg")], self.output_dir)
+
+        self.assertEqual(results[0].extension, ".png")
+        self.assertEqual(os.path.basename(results[0].path), "image_1.png")
+        with Image.open(results[0].path) as img:
+            self.assertEqual(img.format, "PNG")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,307 @@
+import os
+import re
+import json
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import torch
+import whisper
+from render_cache import hash_file, make_key
+from audio_engine import probe_duration
+from scheduler import ordered_map
+
+# Model Whisper đã nạp, giữ lại trong process để dùng cho các job sau
+_models = {}
+_models_lock = threading.Lock()
+# Mỗi model chỉ transcribe một audio tại một thời điểm
+_transcribe_locks = {}
+
+
+def default_device():
+    """Dùng GPU nếu có, ngược lại chạy trên CPU"""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_whisper_model(name, device=None):
+    """Nạp model Whisper một lần cho mỗi process và giữ lại giữa các lần gọi"""
+    device = device or default_device()
+    key = (name, device)
+    with _models_lock:
+        if key not in _models:
+            _models[key] = whisper.load_model(name, device=device)
+            _transcribe_locks[key] = threading.Lock()
+        return _models[key], _transcribe_locks[key]
+
+
+def segments_to_subtitles(segments, offset=0.0):
+    """Chuyển segment của Whisper thành danh sách subtitle {text, start, end}"""
+    subtitles = []
+    for segment in segments:
+        text = segment["text"].strip()
+        if text:
+            subtitles.append({
+                "text": text,
+                "start": float(segment["start"]) + offset,
+                "end": float(segment["end"]) + offset,
+            })
+    return subtitles
+
+
+def find_split_points(audio, sample_rate, chunk_seconds, search_seconds=10.0, frame_seconds=0.02):
+    """Vị trí cắt (theo mẫu) tại chỗ im lặng nhất gần mỗi mốc chunk_seconds"""
+    frame = max(1, int(sample_rate * frame_seconds))
+    frames = len(audio) // frame
+    chunk_frames = int(chunk_seconds / frame_seconds)
+    if frames < chunk_frames * 1.5:
+        return []
+
+    # Năng lượng RMS từng khung 20ms, làm trơn ~0.3s để chọn khoảng lặng thay vì một khung lẻ
+    rms = np.sqrt(np.mean(np.square(audio[:frames * frame].reshape(frames, frame)), axis=1))
+    smooth = max(1, int(0.3 / frame_seconds))
+    energy = np.convolve(rms, np.ones(smooth, dtype=np.float32) / smooth, mode="same")
+
+    search = int(search_seconds / frame_seconds)
+    points = []
+    last = 0
+    target = chunk_frames
+    # Không để chunk cuối quá ngắn
+    while target < frames - chunk_frames // 2:
+        lo = max(last + 1, target - search)
+        hi = min(frames, target + search)
+        split = lo + int(np.argmin(energy[lo:hi]))
+        points.append(split * frame)
+        last = split
+        target = split + chunk_frames
+    return points
+
+
+def _normalize_text(text):
+    return re.sub(r"[^\w]+", " ", text.lower()).strip()
+
+
+def merge_chunk_subtitles(chunks):
+    """Ghép subtitle của các chunk (đã cộng offset), bỏ câu lặp và chồng lấn ở ranh giới"""
+    merged = []
+    for subtitles in chunks:
+        for i, sub in enumerate(subtitles):
+            if merged and i == 0:
+                previous = merged[-1]
+                # Whisper hay lặp lại câu cuối của chunk trước ở đầu chunk sau
+                if (_normalize_text(sub["text"]) == _normalize_text(previous["text"])
+                        and sub["start"] - previous["end"] < 1.0):
+                    previous["end"] = max(previous["end"], sub["end"])
+                    continue
+            if merged and sub["start"] < merged[-1]["end"]:
+                sub = dict(sub, start=merged[-1]["end"])
+                if sub["end"] <= sub["start"]:
+                    continue
+            merged.append(sub)
+    return merged
+
+
+# Tên model của process con, model được nạp một lần trong initializer
+_worker_model_name = None
+
+def _init_transcribe_worker(model_name, threads):
+    """Khởi tạo process con: nạp model Whisper một lần, chia đều số luồng CPU"""
+    global _worker_model_name
+    torch.set_num_threads(threads)
+    _worker_model_name = model_name
+    load_whisper_model(model_name, "cpu")
+
+
+def transcribe_chunk(chunk):
+    """Transcribe một đoạn audio (offset giây, mẫu float32 16kHz) trong process con"""
+    offset, samples, language = chunk
+    model, _ = load_whisper_model(_worker_model_name, "cpu")
+    result = model.transcribe(
+        samples, language=language, task="transcribe", fp16=False, verbose=None,
+    )
+    return segments_to_subtitles(result.get("segments", []), offset)
+
+
+# Pool process transcribe theo (model, số process), giữ lại giữa các lần gọi và các job
+# để mỗi process con chỉ nạp model Whisper một lần
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_transcribe_pool(model_name, workers):
+    """Pool process transcribe dùng chung cho model_name với workers process"""
+    key = (model_name, workers)
+    with _pools_lock:
+        if key not in _pools:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            _pools[key] = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_transcribe_worker,
+                initargs=(model_name, threads),
+            )
+        return _pools[key]
+
+
+def discard_transcribe_pool(model_name, workers):
+    """Bỏ pool bị hỏng (process con chết), lần gọi sau sẽ tạo pool mới"""
+    with _pools_lock:
+        pool = _pools.pop((model_name, workers), None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_transcribe_pools():
+    """Dừng mọi pool transcribe (tự gọi khi thoát chương trình)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(cancel_futures=True)
+
+
+atexit.register(shutdown_transcribe_pools)
+
+
+def _parse_srt_time(value):
+    hours, minutes, seconds = value.strip().replace(",", ".").split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def load_subtitle_file(path):
+    """Đọc subtitle có sẵn (.srt hoặc .json dạng [{text, start, end}])"""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        content = f.read()
+    if path.lower().endswith(".json"):
+        return [
+            {"text": sub["text"], "start": float(sub["start"]), "end": float(sub["end"])}
+            for sub in json.loads(content)
+        ]
+
+    subtitles = []
+    for block in re.split(r"\n\s*\n", content.strip()):
+        lines = [line for line in block.splitlines() if line.strip()]
+        for i, line in enumerate(lines):
+            if "-->" in line:
+                start, end = line.split("-->")
+                text = " ".join(lines[i + 1:]).strip()
+                if text:
+                    subtitles.append({
+                        "text": text,
+                        "start": _parse_srt_time(start),
+                        "end": _parse_srt_time(end.split()[0]),
+                    })
+                break
+    return subtitles
+
+
+class Transcriber:
+    """Tạo subtitle từ audio bằng Whisper, cache kết quả theo hash nội dung audio"""
+
+    def __init__(self, settings, cache=None, progress=None):
+        self.settings = settings
+        self.cache = cache
+        self.progress = progress
+
+    def _message(self, message):
+        if self.progress:
+            self.progress.print_message(message)
+
+    def cache_key(self, audio_path, chunked=None):
+        """Khóa transcript: nội dung audio + model + ngôn ngữ + cách chia chunk (nếu có chia)
+
+        Không chứa số worker: transcript chỉ khác khi audio thực sự được chia chunk,
+        nên cache dùng được giữa các máy có số nhân CPU khác nhau.
+        """
+        settings = self.settings
+        if chunked is None:
+            chunked = self.use_chunks(audio_path)
+        return make_key(
+            "transcript", hash_file(audio_path),
+            settings.whisper_model, settings.whisper_language,
+            settings.whisper_chunk_seconds if chunked else None,
+        )
+
+    def use_chunks(self, audio_path):
+        """Audio có được cắt chunk và transcribe song song không (thời lượng đọc từ header)"""
+        if self.workers() <= 1 or self.settings.whisper_long_audio <= 0:
+            return False
+        duration = probe_duration(audio_path)
+        return duration is not None and duration >= self.settings.whisper_long_audio
+
+    def workers(self):
+        """Số process transcribe song song (chỉ chạy trên CPU)"""
+        if default_device() == "cuda":
+            return 1
+        return max(1, self.settings.whisper_workers)
+
+    def transcribe(self, audio_path):
+        """Trả về danh sách subtitle {text, start, end} cho một file audio"""
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"Không tìm thấy file audio: {audio_path}")
+
+        chunked = self.use_chunks(audio_path)
+        key = self.cache_key(audio_path, chunked)
+        if self.cache is not None:
+            cached = self.cache.get_json(key)
+            if cached is not None:
+                self._message(f"Dùng lại transcript từ cache ({len(cached)} subtitle)")
+                return cached
+
+        if chunked:
+            # Giải mã một lần (16kHz mono) để tìm chỗ cắt
+            audio = whisper.load_audio(audio_path)
+            subtitles = self.transcribe_chunked(audio, self.workers())
+            del audio
+        else:
+            subtitles = self.transcribe_single(audio_path)
+
+        self._message(f"Đã tạo được {len(subtitles)} subtitle")
+        if self.cache is not None:
+            self.cache.put_json(key, subtitles)
+        return subtitles
+
+    def transcribe_single(self, audio_path):
+        """Transcribe cả file trong một lần bằng model nạp sẵn của process này"""
+        model, lock = load_whisper_model(self.settings.whisper_model)
+        self._message(
+            f"Đang transcribe bằng Whisper {self.settings.whisper_model} ({model.device}), "
+            f"ngôn ngữ: {self.settings.whisper_language}"
+        )
+        with lock:
+            result = model.transcribe(
+                audio_path,
+                language=self.settings.whisper_language,
+                task="transcribe",
+                # fp16 chỉ chạy được trên GPU
+                fp16=model.device.type == "cuda",
+                verbose=False,
+            )
+        return segments_to_subtitles(result.get("segments", []))
+
+    def transcribe_chunked(self, audio, workers):
+        """Cắt audio dài tại chỗ im lặng và transcribe các chunk song song trên nhiều process"""
+        sample_rate = whisper.audio.SAMPLE_RATE
+        bounds = [0] + find_split_points(audio, sample_rate, self.settings.whisper_chunk_seconds) + [len(audio)]
+        chunks = [
+            (start / sample_rate, audio[start:end], self.settings.whisper_language)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self._message(
+            f"Audio dài {len(audio) / sample_rate / 60:.1f} phút: chia {len(chunks)} đoạn, "
+            f"transcribe bằng {min(workers, len(chunks))} process ({threads} luồng/process)"
+        )
+
+        # Pool được giữ lại cho các lần sau (kể cả job khác) nên số process không
+        # phụ thuộc số chunk của audio này
+        model_name = self.settings.whisper_model
+        executor = get_transcribe_pool(model_name, workers)
+        results = []
+        try:
+            for i, (chunk, subtitles) in enumerate(ordered_map(executor, transcribe_chunk, chunks), 1):
+                self._message(f"Đã transcribe đoạn {i}/{len(chunks)} (từ {chunk[0]:.0f}s)")
+                results.append(subtitles)
+        except BrokenProcessPool:
+            discard_transcribe_pool(model_name, workers)
+            raise
+        return merge_chunk_subtitles(results)
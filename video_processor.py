@@ -1,15 +1,25 @@
 import os
 import numpy as np
-from moviepy.editor import (
-    VideoFileClip, AudioFileClip, CompositeVideoClip, 
-    ImageClip, ColorClip, TextClip
-)
-from PIL import Image, ImageFilter
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from moviepy.editor import VideoFileClip, ImageClip
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
 import subprocess
+import configparser
+import multiprocessing
+import threading
+import cv2
+from collections import OrderedDict
+from zoom_engine import ZoomRenderer
+from stream_encoder import FFmpegStreamWriter, ass_filter
+from scheduler import ordered_futures, ordered_map
+from branding import BrandingOverlay
+from compositor import BackgroundCompositor
+from image_ingest import ImageIngest, IMAGE_EXTENSIONS, open_image
+from render_cache import RenderCache, hash_file, make_key
+from render_settings import RenderSettings, ass_color
+from subtitle_renderer import SubtitleRenderer, SubtitleTrack
 
 class ProgressManager:
     def __init__(self):
@@ -27,125 +37,121 @@ class ProgressManager:
         """In thông báo cảnh báo"""
         self.console.print(Panel(Text(message, style="bold yellow"), border_style="yellow"))
 
+class QueueProgress:
+    """Thay ProgressManager trong process con: gửi thông báo về process cha qua queue"""
+    def __init__(self, queue, worker_name):
+        self.queue = queue
+        self.worker_name = worker_name
+
+    def print_message(self, message, style="bold green"):
+        """Gửi thông báo"""
+        self.queue.put((self.worker_name, "message", message))
+
+    def print_error(self, message):
+        """Gửi thông báo lỗi"""
+        self.queue.put((self.worker_name, "error", message))
+
+    def print_warning(self, message):
+        """Gửi thông báo cảnh báo"""
+        self.queue.put((self.worker_name, "warning", message))
+
+class ClipJob:
+    """Mô tả công việc render một clip ảnh, pickle được để gửi sang process con"""
+    def __init__(self, index, img_file, temp_dir, output_name):
+        self.index = index
+        self.img_file = img_file
+        self.temp_dir = temp_dir
+        self.output_name = output_name
+
+# VideoProcessor riêng của mỗi process con, tạo một lần trong initializer
+_worker_processor = None
+
+def _init_render_worker(config_data, settings, queue):
+    """Khởi tạo process con: dựng lại config và VideoProcessor cục bộ"""
+    global _worker_processor
+    # Mỗi process đã là một luồng render, tránh OpenCV tự tạo thêm thread
+    cv2.setNumThreads(1)
+    config = configparser.ConfigParser()
+    config.read_dict(config_data)
+    # Cache trên đĩa chỉ do process cha ghi để index không bị ghi đè lẫn nhau
+    _worker_processor = VideoProcessor(config, cache=RenderCache(enabled=False), settings=settings)
+    _worker_processor.progress = QueueProgress(queue, f"worker-{os.getpid()}")
+
+def render_clip_job(job):
+    """Render một ClipJob trong process con"""
+    return _worker_processor.process_image(
+        job.img_file, job.index, job.temp_dir, output_name=job.output_name
+    )
+
 class VideoProcessor:
-    def __init__(self, config):
+    # Số bộ dựng zoom giữ lại trong bộ nhớ ở chế độ stream (~30 MB mỗi bộ ở 1080p)
+    STREAM_RENDERER_CACHE = 12
+    # Tỷ lệ phủ trắng ảnh nền và tỷ lệ ảnh chính so với khung hình
+    CLIP_BLEND = 0.5
+    CLIP_FIT_RATIO = 0.9
+    BASE_BLEND = 0.4
+    BASE_FIT_RATIO = 0.7
+
+    def __init__(self, config, cache=None, settings=None):
         self.config = config
-        self.image_dir = config["video"].get("image_dir", "images")
-        self.output_file = config["video"].get("output_file", "output_video.mp4")
-        self.width = config["video"].getint("width", 1920)
-        self.height = config["video"].getint("height", 1080)
-        self.image_duration = config["video"].getfloat("image_duration", 6)
-        self.fps = config["video"].getint("fps", 30)
-        self.bitrate = config["video"].get("bitrate", "8000k")
-        self.max_threads = config["video"].getint("max_threads", 10)
+        # Thông số đã chuyển kiểu sẵn, không đọc lại configparser trong vòng lặp
+        self.settings = settings if settings is not None else RenderSettings.from_config(config)
+        settings = self.settings
+        self.image_dir = settings.image_dir
+        self.output_file = settings.output_file
+        self.width = settings.width
+        self.height = settings.height
+        self.image_duration = settings.image_duration
+        self.fps = settings.fps
+        self.bitrate = settings.bitrate
+        self.max_threads = settings.max_threads
+        self.render_backend = settings.render_backend
+        self.render_workers = settings.render_workers
+        self.output_mode = settings.output_mode
+        self.finalize_mode = settings.finalize_mode
         
         # Image settings
-        self.blur_radius = config["image"].getint("blur_radius", 10)
-        self.overlay_opacity = config["image"].getint("overlay_opacity", 166)
-        self.image_scale = config["image"].getfloat("scale", 0.9)
-        
-        # Logo settings
-        self.logo_path = config["image"].get("logo_path", "")
-        self.logo_width = config["image"].getint("logo_width", 250)
-        self.logo_height = config["image"].getint("logo_height", 250)
-        self.logo_margin_left = config["image"].getint("logo_margin_left", 50)
-        self.logo_margin_top = config["image"].getint("logo_margin_top", 50)
+        self.blur_radius = settings.blur_radius
+        self.overlay_opacity = settings.overlay_opacity
+        self.image_scale = settings.image_scale
         
         self.progress = ProgressManager()
         self.temp_files = []  # Danh sách các file tạm cần xóa
+        self.cache = cache if cache is not None else RenderCache.from_config(config)
+        # Ảnh nền mờ dùng chung cho create_base_images và process_image
+        self.compositor = BackgroundCompositor(self.width, self.height, self.blur_radius, cache=self.cache)
+        # Ảnh được kiểm tra và thu nhỏ về mức render cần (khung hình x zoom lớn nhất) trước khi render
+        self.ingest = ImageIngest(
+            self.width, self.height, max(settings.zoom_start, settings.zoom_end),
+            cache=self.cache, workers=self.max_threads, progress=self.progress,
+        )
+        # Kết quả ingest_images gần nhất: (danh sách file + kích thước + mtime, ảnh dùng để render)
+        self._ingested = None
+        self._ingest_lock = threading.Lock()
+        # Logo và watermark được nạp, resize và premultiply một lần duy nhất
+        self.branding = BrandingOverlay.from_config(config, self.progress)
+        self.subtitle_renderer = SubtitleRenderer(self.settings, self.width, self.height)
 
     def create_base_images(self, image_path):
         """Tạo ảnh nền và ảnh chính"""
         try:
             # Đọc ảnh gốc
             self.progress.print_message(f"Đang đọc ảnh: {os.path.basename(image_path)}")
-            img = Image.open(image_path)
-            if img is None:
-                raise Exception("Không thể đọc ảnh")
-                
-            # Chuyển sang RGB nếu cần
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-                
-            # Tạo background - fit vào kích thước video
-            background = img.copy()
-            # Tính tỷ lệ để fit vào kích thước video
-            ratio = max(self.width / background.size[0], self.height / background.size[1])
-            new_size = (int(background.size[0] * ratio), int(background.size[1] * ratio))
-            background = background.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # Crop background để fit vào kích thước video
-            start_x = (background.size[0] - self.width) // 2
-            start_y = (background.size[1] - self.height) // 2
-            background = background.crop(
-                (start_x, start_y, start_x + self.width, start_y + self.height)
-            )
-            
-            # Làm mờ background
-            background = background.filter(ImageFilter.GaussianBlur(radius=self.blur_radius))
-            
-            # Tạo overlay
-            overlay = Image.new('RGB', (self.width, self.height), 'white')
-            overlay.putalpha(self.overlay_opacity)
-            
-            # Blend background với overlay
-            background = background.convert('RGBA')
-            overlay = overlay.convert('RGBA')
-            background = Image.blend(background, overlay, 0.4)
-            background = background.convert('RGB')
-            
-            # Xử lý ảnh chính - giữ tỷ lệ khung hình gốc
-            main_img = img.copy()
-            
-            # Tính kích thước tối đa cho phép (70% của kích thước video)
-            max_width = int(self.width * 0.7)
-            max_height = int(self.height * 0.7)
-            
-            # Tính tỷ lệ scale để ảnh vừa với kích thước cho phép
-            width_scale = max_width / main_img.size[0]
-            height_scale = max_height / main_img.size[1]
-            
-            # Sử dụng tỷ lệ nhỏ hơn để đảm bảo ảnh không bị tràn
-            scale = min(width_scale, height_scale)
-            
-            # Tính kích thước mới
-            new_width = int(main_img.size[0] * scale)
-            new_height = int(main_img.size[1] * scale)
-            
-            print(f"Original size: {main_img.size}")
-            print(f"New size: {new_width}x{new_height}")
-            
-            # Resize ảnh với kích thước mới
-            main_img = main_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Tạo ảnh cuối cùng
-            final_img = background.copy()
+            with self.open_source_image(image_path) as img:
+                # Ảnh nền mờ (phủ trắng 40%) và ảnh chính vừa 70% khung hình
+                background, main_img = self.compositor.compose(
+                    img, hash_file(image_path), blend=self.BASE_BLEND, fit_ratio=self.BASE_FIT_RATIO
+                )
+            
+            # Đặt ảnh chính vào giữa ảnh nền
+            final_array = background.copy()
+            new_width, new_height = main_img.size
             x_offset = (self.width - new_width) // 2
             y_offset = (self.height - new_height) // 2
+            final_array[y_offset:y_offset + new_height, x_offset:x_offset + new_width] = np.asarray(main_img)
             
-            # Tạo mask cho main_img nếu cần
-            if main_img.mode == 'RGBA':
-                mask = main_img.split()[3]
-            else:
-                mask = None
-                
-            final_img.paste(main_img, (x_offset, y_offset), mask)
-            
-            # Thêm logo nếu có
-            if self.logo_path and os.path.exists(self.logo_path):
-                try:
-                    logo = Image.open(self.logo_path)
-                    if logo.mode != 'RGBA':
-                        logo = logo.convert('RGBA')
-                    logo = logo.resize((self.logo_width, self.logo_height), Image.Resampling.LANCZOS)
-                    final_img.paste(logo, (self.logo_margin_left, self.logo_margin_top), logo)
-                except Exception as e:
-                    self.progress.print_warning(f"Lỗi khi thêm logo: {str(e)}")
-            
-            # Chuyển sang numpy array
-            final_array = np.array(final_img)
-            if final_array is None or final_array.size == 0:
-                raise Exception("Không thể chuyển ảnh sang numpy array")
+            # Thêm logo/watermark nếu có
+            self.branding.composite(final_array)
                 
             return final_array
             
@@ -154,152 +160,75 @@ class VideoProcessor:
             # Trả về ảnh đen nếu có lỗi
             return np.zeros((self.height, self.width, 3), dtype=np.uint8)
 
-    def create_subtitle_clip(self, text, duration, start_time=0):
-        """Tạo clip subtitle"""
-        try:
-            # Lấy cấu hình từ file config
-            sub_config = self.config["subtitle"]
-            # Lấy thông số subtitle từ config
-            font = sub_config.get("font", "Arial")
-            font_size = sub_config.getint("font_size", 70)
-            color = sub_config.get("color", "#FFFFFF")
-            stroke_color = sub_config.get("stroke_color", "#000000")
-            stroke_width = sub_config.getint("stroke_width", 2)
-            background_opacity = sub_config.getfloat("background_opacity", 0.7)
-            padding = self.config['subtitle'].getint('background_padding', 15)
-            
-            # Tính toán kích thước tối đa cho subtitle (70% chiều rộng video)
-            max_width = int(self.width * 0.7)
-            
-            # Tạo text clip với wrap
-            txt_clip = TextClip(
-                text,
-                fontsize=font_size,
-                font=font,
-                color=color,
-                stroke_color=stroke_color,
-                stroke_width=stroke_width,
-                method='label',
-                align='center',
-                size=(max_width, None),  # Giới hạn chiều rộng, tự động tính chiều cao
-                interline=-1  # Giảm khoảng cách giữa các dòng
+    def burn_subtitle(self, frame, text):
+        """Trộn một dòng subtitle vào khung hình (copy nếu khung hình chỉ đọc)"""
+        if not text:
+            return frame
+        if not frame.flags.writeable:
+            frame = frame.copy()
+        return self.subtitle_renderer.composite(frame, text)
+
+    def render_signature(self):
+        """Chuỗi mô tả toàn bộ thông số ảnh hưởng đến nội dung clip"""
+        return repr((
+            self.settings.values(
+                "width", "height", "image_duration", "fps", "bitrate",
+                "blur_radius", "overlay_opacity", "image_scale", "zoom_start", "zoom_end",
+            ),
+            self.branding.signature(),
+        ))
+
+    def clip_cache_key(self, img_path, signature):
+        """Khóa của clip: hash nội dung ảnh + thông số render"""
+        return make_key("clip", hash_file(img_path), signature)
+
+    def open_source_image(self, img_path):
+        """Giải mã ảnh RGB ở độ phân giải vừa đủ cho khung hình x zoom lớn nhất
+
+        JPEG lớn được giải mã thẳng ở 1/2, 1/4 hoặc 1/8 kích thước (draft), nên JPEG
+        24 MP không bao giờ nằm trong bộ nhớ ở độ phân giải đầy đủ; định dạng khác
+        vẫn được giải mã đầy đủ trước khi thu nhỏ (xem open_image).
+        """
+        return open_image(img_path, self.ingest.box)
+
+    def create_zoom_renderer(self, img_path):
+        """Đọc ảnh, tạo ảnh nền mờ + ảnh chính và bộ dựng khung hình zoom"""
+        # Ảnh nguồn chỉ sống trong khối with: nền và ảnh chính được tạo thẳng từ nó, không copy
+        with self.open_source_image(img_path) as img:
+            # Ảnh nền mờ (phủ trắng 50%) và ảnh chính vừa 90% khung hình
+            background, main_img = self.compositor.compose(
+                img, hash_file(img_path), blend=self.CLIP_BLEND, fit_ratio=self.CLIP_FIT_RATIO
             )
-            
-            # Thêm background nếu cần
-            if background_opacity > 0:
-                # Tạo background clip
-                bg_color = self.config['subtitle'].get('background_color', 'rgb(255,236,67)')
-                # Chuyển đổi chuỗi rgb thành tuple
-                if bg_color.startswith('rgb('):
-                    bg_color = bg_color.replace('rgb(', '').replace(')', '')
-                    r, g, b = map(int, bg_color.split(','))
-                    bg_color = (r, g, b)
-                
-                # Tính kích thước background với padding
-                bg_width = txt_clip.size[0] + (padding * 2)
-                bg_height = txt_clip.size[1] + (padding * 2)
-                
-                # Tạo background đơn giản
-                bg_clip = ColorClip(size=(bg_width, bg_height), color=bg_color)
-                bg_clip = bg_clip.set_opacity(background_opacity)
-                
-                # Đặt text vào giữa background
-                txt_clip = txt_clip.set_position(('center', 'center'))
-                
-                # Kết hợp background và text
-                txt_clip = CompositeVideoClip([bg_clip, txt_clip])
-            
-            # Đặt vị trí
-            position = sub_config.get("position", "bottom")
-            if position == "bottom":
-                margin_bottom = sub_config.getint("margin_bottom", 50)
-                txt_clip = txt_clip.set_position(('center', f'bottom-{margin_bottom}'))
-            elif position == "top":
-                txt_clip = txt_clip.set_position(('center', 'top'))
-            elif position == "center":
-                txt_clip = txt_clip.set_position('center')
-            else:  # custom
-                x_pos = sub_config.getint("x_position", 0)
-                y_pos = sub_config.getint("y_position", 0)
-                txt_clip = txt_clip.set_position((x_pos, y_pos))
-            
-            # Đặt thời gian
-            txt_clip = txt_clip.set_duration(duration).set_start(start_time)
-            
-            return txt_clip
-            
-        except Exception as e:
-            self.progress.print_warning(f"Lỗi khi tạo subtitle clip: {str(e)}")
-            return None
+        
+        # Bộ dựng zoom: tạo sẵn kim tự tháp ảnh chính và buffer khung hình
+        return ZoomRenderer(
+            background,
+            main_img,
+            self.width,
+            self.height,
+            self.settings.zoom_start,
+            self.settings.zoom_end,
+            self.image_duration,
+        )
+
+    def apply_branding(self, frame):
+        """Chèn logo/watermark đã nạp sẵn vào khung hình (tại chỗ)"""
+        return self.branding.composite(frame)
 
-    def process_image(self, img_file, index, temp_dir, subtitles=None):
+    def process_image(self, img_file, index, temp_dir, subtitles=None, output_name=None):
         """Xử lý một ảnh và tạo video clip"""
         try:
-            # Tạo đường dẫn đầy đủ cho ảnh
+            # Tạo đường dẫn đầy đủ cho ảnh (img_file có thể đã là đường dẫn ảnh chuẩn hóa)
             img_path = os.path.join(self.image_dir, img_file)
             if not os.path.exists(img_path):
                 raise FileNotFoundError(f"Không tìm thấy file ảnh: {img_path}")
                 
-            # Đọc ảnh gốc
-            self.progress.print_message(f"Đang xử lý ảnh: {img_file}")
-            img = Image.open(img_path)
-            if img is None:
-                raise Exception("Không thể đọc ảnh")
-                
-            # Chuyển sang RGB nếu cần
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-                
-            # Tạo background - fit vào kích thước video 16:9
-            background = img.copy()
-            # Tính tỷ lệ để fit vào kích thước video
-            ratio = max(self.width / background.size[0], self.height / background.size[1])
-            new_size = (int(background.size[0] * ratio), int(background.size[1] * ratio))
-            background = background.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # Crop background để fit vào kích thước video
-            start_x = (background.size[0] - self.width) // 2
-            start_y = (background.size[1] - self.height) // 2
-            background = background.crop(
-                (start_x, start_y, start_x + self.width, start_y + self.height)
-            )
-            
-            # Làm mờ background
-            background = background.filter(ImageFilter.GaussianBlur(radius=self.blur_radius))
-            
-            # Tạo overlay
-            overlay = Image.new('RGB', (self.width, self.height), 'white')
-            overlay.putalpha(self.overlay_opacity)
-            
-            # Blend background với overlay
-            background = background.convert('RGBA')
-            overlay = overlay.convert('RGBA')
-            background = Image.blend(background, overlay, 0.5)
-            background = background.convert('RGB')
-            
-            # Xử lý ảnh chính - giữ tỷ lệ khung hình gốc
-            main_img = img.copy()
-            
-            # Tính kích thước tối đa cho phép (90% của kích thước video)
-            max_width = int(self.width * 0.9)
-            max_height = int(self.height * 0.9)
-            
-            # Tính tỷ lệ scale để ảnh vừa với kích thước cho phép
-            width_scale = max_width / main_img.size[0]
-            height_scale = max_height / main_img.size[1]
-            
-            # Sử dụng tỷ lệ nhỏ hơn để đảm bảo ảnh không bị tràn và giữ nguyên tỷ lệ
-            scale = min(width_scale, height_scale)
-            
-            # Tính kích thước mới
-            new_width = int(main_img.size[0] * scale)
-            new_height = int(main_img.size[1] * scale)
-            
-            # Resize ảnh với kích thước mới
-            main_img = main_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            # Đọc ảnh gốc, tạo ảnh nền và bộ dựng zoom
+            self.progress.print_message(f"Đang xử lý ảnh: {os.path.basename(img_file)}")
+            renderer = self.create_zoom_renderer(img_path)
             
             # Tạo video clip từ background
-            clip = ImageClip(np.array(background))
+            clip = ImageClip(renderer.background)
             if clip is None:
                 raise Exception(f"Không thể tạo clip từ background")
             
@@ -309,55 +238,16 @@ class VideoProcessor:
             # Thêm hiệu ứng zoom cho ảnh chính
             def make_frame(t):
                 try:
-                    # Tạo ảnh mới với background
-                    new_img = background.copy()
-                    
-                    # Tính tỷ lệ zoom (từ 75% đến 90%)
-                    zoom_start = self.config["video"].getfloat("zoom_start", 0.9)
-                    zoom_end = self.config["video"].getfloat("zoom_end", 1.4)
-                    zoom_value = zoom_end - zoom_start
-                    zoom_factor = zoom_start + (zoom_value * t / self.image_duration)
-                    
-                    # Tính kích thước mới cho ảnh chính với zoom
-                    current_width = int(new_width * zoom_factor)
-                    current_height = int(new_height * zoom_factor)
-                    
-                    # Resize ảnh chính với zoom
-                    current_main_img = main_img.resize((current_width, current_height), Image.Resampling.LANCZOS)
-                    
-                    # Đặt ảnh chính vào giữa
-                    x_offset = (self.width - current_width) // 2
-                    y_offset = (self.height - current_height) // 2
-                    
-                    # Tạo mask cho main_img nếu cần
-                    if current_main_img.mode == 'RGBA':
-                        mask = current_main_img.split()[3]
-                    else:
-                        mask = None
-                        
-                    new_img.paste(current_main_img, (x_offset, y_offset), mask)
-                    
-                    # Thêm logo nếu có
-                    if self.logo_path and os.path.exists(self.logo_path):
-                        try:
-                            logo = Image.open(self.logo_path)
-                            if logo.mode != 'RGBA':
-                                logo = logo.convert('RGBA')
-                            logo = logo.resize((self.logo_width, self.logo_height), Image.Resampling.LANCZOS)
-                            new_img.paste(logo, (self.logo_margin_left, self.logo_margin_top), logo)
-                        except Exception as e:
-                            self.progress.print_warning(f"Lỗi khi thêm logo: {str(e)}")
-                    
-                    return np.array(new_img)
+                    return self.apply_branding(renderer.render(t))
                 except Exception as e:
                     self.progress.print_warning(f"Lỗi trong make_frame: {str(e)}")
-                    return np.array(background)
+                    return renderer.background
             
             # Áp dụng hiệu ứng zoom
             clip = clip.fl(lambda gf, t: make_frame(t))
             
     
-            output_path = os.path.join(temp_dir, f"temp_video_{index}.mp4")
+            output_path = os.path.join(temp_dir, output_name or f"temp_video_{index}.mp4")
             self.progress.print_message(f"Đang ghi clip tạm: {output_path}")
             
             # Đảm bảo thư mục tồn tại
@@ -393,6 +283,66 @@ class VideoProcessor:
             self.progress.print_error(f"Lỗi khi xử lý ảnh {img_file}: {str(e)}")
             return None
 
+    def render_clips(self, jobs):
+        """Render các ClipJob song song, trả về (job, đường dẫn clip) theo đúng thứ tự jobs"""
+        if not jobs:
+            return
+        if self.render_backend == "process":
+            yield from self._render_clips_in_processes(jobs)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+            yield from ordered_map(
+                executor,
+                lambda job: self.process_image(
+                    job.img_file, job.index, job.temp_dir, output_name=job.output_name
+                ),
+                jobs,
+            )
+
+    def _render_clips_in_processes(self, jobs):
+        """Render bằng ProcessPoolExecutor, tiến độ của từng worker gửi về qua queue"""
+        workers = min(self.render_workers, len(jobs))
+        self.progress.print_message(f"Render {len(jobs)} clip bằng {workers} process")
+        config_data = {
+            section: dict(self.config.items(section, raw=True))
+            for section in self.config.sections()
+        }
+        
+        with multiprocessing.Manager() as manager:
+            queue = manager.Queue()
+            reporter = threading.Thread(target=self._report_worker_progress, args=(queue,), daemon=True)
+            reporter.start()
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_render_worker,
+                    initargs=(config_data, self.settings, queue),
+                ) as executor:
+                    for job, future in ordered_futures(executor, render_clip_job, jobs):
+                        try:
+                            output_path = future.result()
+                        except Exception as e:
+                            self.progress.print_error(f"Lỗi khi render {job.img_file}: {str(e)}")
+                            output_path = None
+                        yield job, output_path
+            finally:
+                queue.put(None)
+                reporter.join()
+
+    def _report_worker_progress(self, queue):
+        """In thông báo từ các process con cho tới khi nhận được None"""
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            worker_name, level, message = item
+            if level == "error":
+                self.progress.print_error(f"[{worker_name}] {message}")
+            elif level == "warning":
+                self.progress.print_warning(f"[{worker_name}] {message}")
+            else:
+                self.progress.print_message(f"[{worker_name}] {message}")
+
     def cleanup_temp_files(self):
         """Xóa các file tạm sau khi video đã được ghi thành công"""
         try:
@@ -419,33 +369,60 @@ class VideoProcessor:
             self.progress.print_message(f"Đang tạo file subtitle tạm: {subtitle_path}")
             
             # Lấy cấu hình subtitle
-            font = self.config['subtitle'].get('font', 'Arial')
-            font_size = self.config['subtitle'].getint('font_size', 44)
-            color = self.config['subtitle'].get('color', '#FFFFFF')
-            stroke_color = self.config['subtitle'].get('stroke_color', '#000000')
-            stroke_width = self.config['subtitle'].getint('stroke_width', 0)
-            position = self.config['subtitle'].get('position', 'bottom')
-            margin_bottom = self.config['subtitle'].getint('margin_bottom', 50)
+            settings = self.settings
+            font = settings.subtitle_font
+            font_size = settings.subtitle_font_size
+            primary = ass_color(settings.subtitle_color, default=(255, 255, 255))
+            margin_v = settings.subtitle_margin_bottom
+            # Giới hạn chiều rộng dòng chữ 70% khung hình như bản moviepy
+            margin_h = int(self.width * 0.15)
+            
+            if settings.subtitle_background_opacity > 0:
+                # BorderStyle 3: khung nền đặc, màu lấy từ OutlineColour, Outline là padding
+                border_style = 3
+                box = ass_color(settings.subtitle_background_color, settings.subtitle_background_opacity)
+                outline_color, back_color = box, box
+                outline = settings.subtitle_background_padding
+            else:
+                border_style = 1
+                outline_color = ass_color(settings.subtitle_stroke_color)
+                back_color = ass_color("rgb(0,0,0)", 0.0)
+                outline = settings.subtitle_stroke_width
+            
+            # Căn lề kiểu numpad của ASS: 2 = giữa dưới, 8 = giữa trên, 5 = chính giữa
+            position = settings.subtitle_position
+            override = ""
+            if position == "top":
+                alignment = 8
+            elif position == "center":
+                alignment = 5
+            elif position == "custom":
+                alignment = 7
+                override = f"{{\\pos({settings.subtitle_x_position},{settings.subtitle_y_position})}}"
+            else:
+                alignment = 2
             
             # Ghi header ASS
             with open(subtitle_path, "w", encoding="utf-8") as f:
                 f.write("[Script Info]\n")
                 f.write("ScriptType: v4.00+\n")
-                f.write("PlayResX: 1920\n")
-                f.write("PlayResY: 1080\n")
+                f.write(f"PlayResX: {self.width}\n")
+                f.write(f"PlayResY: {self.height}\n")
+                f.write("WrapStyle: 0\n")
+                f.write("ScaledBorderAndShadow: yes\n")
                 f.write("\n")
                 f.write("[V4+ Styles]\n")
                 f.write("Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n")
-                f.write(f"Style: Default,{font},{font_size},&H{color},&H{color},&H{stroke_color},&H000000,0,0,0,0,100,100,0,0,1,{stroke_width},0,2,10,10,{margin_bottom},1\n")
+                f.write(f"Style: Default,{font},{font_size},{primary},{primary},{outline_color},{back_color},0,0,0,0,100,100,0,0,{border_style},{outline},0,{alignment},{margin_h},{margin_h},{margin_v},1\n")
                 f.write("\n")
                 f.write("[Events]\n")
                 f.write("Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
                 
                 # Ghi các dòng subtitle
-                for i, sub in enumerate(subtitles, 1):
+                for sub in subtitles:
                     start_time = self.format_time(sub["start"])
                     end_time = self.format_time(sub["end"])
-                    f.write(f"Dialogue: 0,{start_time},{end_time},Default,,0,0,0,,{sub['text']}\n")
+                    f.write(f"Dialogue: 0,{start_time},{end_time},Default,,0,0,0,,{override}{self.ass_text(sub['text'])}\n")
             
             return subtitle_path
             
@@ -453,6 +430,11 @@ class VideoProcessor:
             self.progress.print_error(f"Lỗi khi tạo file subtitle tạm: {str(e)}")
             return None
 
+    def ass_text(self, text):
+        """Escape nội dung một dòng subtitle cho ASS (xuống dòng, khối override {})"""
+        text = text.replace("\r", "").replace("{", "(").replace("}", ")")
+        return text.replace("\n", "\\N")
+
     def format_time(self, seconds):
         """Chuyển đổi thời gian từ giây sang định dạng ASS"""
         hours = int(seconds // 3600)
@@ -460,262 +442,382 @@ class VideoProcessor:
         seconds = seconds % 60
         return f"{hours}:{minutes:02d}:{seconds:05.2f}"
 
-    def create_subtitle_video(self, video_clip, subtitles, output_dir):
-        """Tạo video chỉ chứa subtitle"""
+    def create_video(self, output_dir, audio, subtitles=None):
+        """Tạo video từ ảnh và AudioResult của bước audio, chèn subtitle nếu có"""
         try:
+            # Tạo thư mục output nếu chưa tồn tại
+            output_dir = os.path.abspath(output_dir)
+            os.makedirs(output_dir, exist_ok=True)
             
-            # Tạo thư mục temp nếu chưa tồn tại
-            temp_dir = os.path.abspath(os.path.join(output_dir, "temp"))
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            # Tính tổng thời gian video
-            total_duration = 0
-            if subtitles:
-                total_duration = max(sub["end"] for sub in subtitles)
-            
-            # Tạo video clip màu đen với cùng kích thước
-            black_clip = ColorClip(size=(self.width, self.height), color=(0, 0, 0))
-            black_clip = black_clip.set_duration(total_duration)
-            
-            # Tạo các subtitle clip
-            subtitle_clips = []
-            for sub in subtitles:
-                try:
-                    # Lấy cấu hình từ file config
-                    sub_config = self.config["subtitle"]
-                    
-                    # Lấy thông số subtitle từ config
-                    font = sub_config.get("font", "Arial")
-                    font_size = sub_config.getint("font_size", 70)
-                    color = sub_config.get("color", "#FFFFFF")
-                    stroke_color = sub_config.get("stroke_color", "#000000")
-                    stroke_width = sub_config.getint("stroke_width", 2)
-                    position = sub_config.get("position", "bottom")
-                    margin_bottom = sub_config.getint("margin_bottom", 50)
-                    background_opacity = sub_config.getfloat("background_opacity", 0.7)
-                    
-                    # Tạo text clip
-                    txt_clip = TextClip(
-                        sub['text'],
-                        fontsize=font_size,
-                        font=font,
-                        color=color,
-                        stroke_color=stroke_color,
-                        stroke_width=stroke_width,
-                        method='label',
-                        align='center'
-                    )
-                    
-                    # Tạo background nếu cần
-                    if background_opacity > 0:
-                        # Tạo background clip
-                        bg_color = self.config['subtitle'].get('background_color', 'rgb(255,236,67)')
-                        # Chuyển đổi chuỗi rgb thành tuple
-                        if bg_color.startswith('rgb('):
-                            bg_color = bg_color.replace('rgb(', '').replace(')', '')
-                            r, g, b = map(int, bg_color.split(','))
-                            bg_color = (r, g, b)
-                        padding = self.config['subtitle'].getint('background_padding', 15)
-                        
-                        # Tính kích thước background
-                        bg_width = txt_clip.size[0] + padding * 2
-                        bg_height = txt_clip.size[1] + padding * 2
-                        
-                        # Tạo background đơn giản
-                        bg_clip = ColorClip(size=(bg_width, bg_height), color=bg_color)
-                        bg_clip = bg_clip.set_opacity(background_opacity)
-                        
-                        # Đặt text vào giữa background
-                        txt_clip = txt_clip.set_position(('center', 'center'))
-                        
-                        # Kết hợp background và text
-                        txt_clip = CompositeVideoClip([bg_clip, txt_clip])
-                    
-                    # Đặt vị trí
-                    if position == 'bottom':
-                        y_pos = self.height - margin_bottom - txt_clip.size[1]
-                        txt_clip = txt_clip.set_position(('center', y_pos))
-                    elif position == 'top':
-                        txt_clip = txt_clip.set_position(('center', margin_bottom))
-                    elif position == 'center':
-                        txt_clip = txt_clip.set_position('center')
-                    else:  # custom
-                        x_pos = self.config['subtitle'].getint('x_position', 0)
-                        y_pos = self.config['subtitle'].getint('y_position', 0)
-                        txt_clip = txt_clip.set_position((x_pos, y_pos))
-                    
-                    # Đặt thời gian
-                    txt_clip = txt_clip.set_start(sub['start']).set_duration(sub['end'] - sub['start'])
-                    
-                    subtitle_clips.append(txt_clip)
-                    
-                except Exception as e:
-                    self.progress.print_warning(f"Lỗi khi tạo subtitle clip: {str(e)}")
-                    continue
-            
-            # Ghép các subtitle clip
-            if subtitle_clips:
-                final_subtitle = CompositeVideoClip(subtitle_clips)
-                # Kết hợp với video màu đen
-                final_video = CompositeVideoClip([black_clip, final_subtitle])
-            else:
-                final_video = black_clip
-            
-            # Lưu video subtitle tạm
-            subtitle_path = os.path.join(temp_dir, "temp_subtitle.mp4")
-            self.progress.print_message(f"Đang ghi video subtitle: {subtitle_path}")
+            output_file = self.resolve_output_file(output_dir)
+            self.progress.print_message(f"Đang tạo video tại: {output_file}")
             
-            # Ghi video subtitle
-            final_video.write_videofile(
-                subtitle_path,
-                fps=self.fps,
-                codec="libx264",
-                audio_codec="aac",
-                preset="ultrafast",
-                bitrate=self.bitrate,
-                threads=1,
-                verbose=False,
-                logger=None
+            temp_final_audio_path = self.check_audio(audio)
+            audio_duration = audio.duration
+            
+            subtitle_filter, subtitle_track = self.prepare_subtitles(subtitles, output_dir)
+            
+            # Chế độ stream: dựng khung hình và mã hóa trong một lần chạy ffmpeg
+            if self.output_mode == "stream":
+                self.create_video_streaming(
+                    output_file, temp_final_audio_path, audio_duration,
+                    video_filter=subtitle_filter, subtitle_track=subtitle_track,
+                )
+                self.cleanup_temp_files()
+                self.progress.print_message(f"Đã tạo video thành công: {output_file}")
+                return
+            
+            # Chế độ mux: chỉ ghép audio vào video đã ghép, không mã hóa lại hình
+            # (có subtitle thì hình được mã hóa lại đúng một lần để chèn chữ)
+            if self.finalize_mode == "mux" and subtitle_track is None:
+                self.progress.print_message("Đang tạo video từ ảnh...")
+                temp_video_path = self.render_image_track(output_dir, audio_duration)
+                self.mux_audio(
+                    temp_video_path, temp_final_audio_path, output_file, audio_duration,
+                    video_filter=subtitle_filter,
+                )
+                self.cleanup_temp_files()
+                self.progress.print_message(f"Đã tạo video thành công: {output_file}")
+                return
+            
+            # Chế độ reencode: mã hóa lại hình bằng moviepy (kèm subtitle), audio được chép nguyên luồng
+            self.progress.print_message("Đang tạo video từ ảnh...")
+            temp_video_path = self.render_image_track(output_dir, audio_duration)
+            self.reencode_track(
+                temp_video_path, temp_final_audio_path, output_file, audio_duration,
+                subtitle_filter=subtitle_filter, subtitle_track=subtitle_track,
             )
             
-            # Đóng các clip
-            black_clip.close()
-            if subtitle_clips:
-                for clip in subtitle_clips:
-                    clip.close()
-                final_subtitle.close()
-            final_video.close()
+            # Xóa các file tạm
+            self.cleanup_temp_files()
             
-            return subtitle_path
+            self.progress.print_message(f"Đã tạo video thành công: {output_file}")
             
         except Exception as e:
-            self.progress.print_error(f"Lỗi khi tạo video subtitle: {str(e)}")
-            return None
+            self.progress.print_error(f"Lỗi khi tạo video: {str(e)}")
+            raise
+
+    def resolve_output_file(self, output_dir):
+        """Đường dẫn tuyệt đối của video đầu ra, nằm trong output_dir"""
+        output_file = os.path.abspath(self.settings.output_file)
+        if not output_file.startswith(output_dir):
+            output_file = os.path.join(output_dir, os.path.basename(output_file))
+        return output_file
+
+    def check_audio(self, audio):
+        """Kiểm tra file audio cuối cùng, trả về đường dẫn tuyệt đối"""
+        temp_final_audio_path = os.path.abspath(audio.path)
+        if not os.path.exists(temp_final_audio_path):
+            raise FileNotFoundError(f"Không tìm thấy file audio: {temp_final_audio_path}")
+            
+        if os.path.getsize(temp_final_audio_path) == 0:
+            raise Exception("File audio rỗng")
+            
+        # Thời lượng audio đã có sẵn từ bước audio, không cần mở lại file
+        self.progress.print_message(f"Đã xác nhận file audio: {temp_final_audio_path} ({audio.duration:.2f}s)")
+        return temp_final_audio_path
+
+    def prepare_subtitles(self, subtitles, output_dir):
+        """Chuẩn bị chèn subtitle, trả về (filter ffmpeg, SubtitleTrack); phần không dùng là None
+
+        Subtitle được chèn ngay trong lần mã hóa cuối (không tạo video subtitle riêng):
+        bằng libass (burn_mode = ass) hoặc vẽ bằng PIL vào từng khung hình (burn_mode = pil)
+        """
+        if not subtitles:
+            return None, None
+        if self.settings.subtitle_burn_mode in ("pil", "moviepy"):
+            self.progress.print_message(f"Chèn {len(subtitles)} subtitle bằng PIL")
+            return None, SubtitleTrack(subtitles)
+        subtitle_path = self.create_temp_subtitle_file(subtitles, output_dir)
+        if not subtitle_path:
+            return None, None
+        self.temp_files.append(subtitle_path)
+        self.progress.print_message(f"Chèn {len(subtitles)} subtitle bằng libass")
+        return ass_filter(subtitle_path), None
+
+    def can_render_early(self):
+        """Hình có thể render trước khi có audio cuối cùng và subtitle hay không
 
-    def create_video(self, output_dir, temp_audio_path, temp_final_audio_path):
-        """Tạo video từ ảnh và audio"""
+        Đúng với chế độ clips: hình chỉ phụ thuộc thời lượng audio, subtitle được
+        chèn lúc ghép (mux) hoặc lúc mã hóa lại (reencode). Chế độ stream dựng
+        hình cùng audio nên phải chạy tuần tự.
+        """
+        return self.output_mode != "stream"
+
+    def track_duration(self, audio_duration):
+        """Thời lượng hình mà render_image_track tạo ra cho audio_duration (số ảnh nguyên)"""
+        return int(np.ceil(audio_duration / self.image_duration)) * self.image_duration
+
+    def finalize_track(self, output_dir, audio, subtitles, temp_video_path, rendered_duration):
+        """Ghép audio và subtitle vào hình đã render sẵn (theo thời lượng ước tính) trong render_image_track
+
+        Nếu audio thực tế dài hơn phần hình đã render, hình được render lại cho
+        đủ (các clip đã có được lấy lại từ cache). Với finalize_mode = reencode
+        hoặc subtitle vẽ bằng PIL, hình đã render được mã hóa lại bằng reencode_track.
+        """
         try:
-            # Tạo thư mục output nếu chưa tồn tại
             output_dir = os.path.abspath(output_dir)
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Lấy đường dẫn tuyệt đối cho file output
-            output_file = os.path.abspath(self.config["video"].get("output_file", "output_video.mp4"))
-            if not output_file.startswith(output_dir):
-                output_file = os.path.join(output_dir, os.path.basename(output_file))
-            
-            self.progress.print_message(f"Đang tạo video tại: {output_file}")
-            
-            # Kiểm tra và chuyển đổi đường dẫn audio thành đường dẫn tuyệt đối
-            temp_audio_path = os.path.abspath(temp_audio_path)
-            temp_final_audio_path = os.path.abspath(temp_final_audio_path)
-            
-            # Kiểm tra file audio tồn tại
-            if not os.path.exists(temp_final_audio_path):
-                raise FileNotFoundError(f"Không tìm thấy file audio: {temp_final_audio_path}")
-                
-            if os.path.getsize(temp_final_audio_path) == 0:
-                raise Exception("File audio rỗng")
-                
-            self.progress.print_message(f"Đã xác nhận file audio: {temp_final_audio_path}")
-            
-            # Lấy thời lượng audio để tính số lượng ảnh cần thiết
-            audio_clip = AudioFileClip(temp_final_audio_path)
-            audio_duration = audio_clip.duration
-            audio_clip.close()
-            
-            # Tạo video clip từ ảnh với thời lượng phù hợp với audio
-            self.progress.print_message("Đang tạo video từ ảnh...")
-            video_clip = self.create_video_from_images(output_dir, audio_duration)
-            
-            if video_clip is None:
-                raise Exception("Không thể tạo video clip từ ảnh")
-            # Tải audio
-            audio_clip = AudioFileClip(temp_final_audio_path)
-            
-            # Thêm audio vào video
-            video_clip = video_clip.set_audio(audio_clip)
+            output_file = self.resolve_output_file(output_dir)
+            temp_final_audio_path = self.check_audio(audio)
+            
+            if self.track_duration(audio.duration) > rendered_duration + 1e-6:
+                self.progress.print_warning(
+                    f"Audio ({audio.duration:.2f}s) dài hơn phần hình đã render ({rendered_duration:.2f}s), render bổ sung"
+                )
+                temp_video_path = self.render_image_track(output_dir, audio.duration)
+            
+            subtitle_filter, subtitle_track = self.prepare_subtitles(subtitles, output_dir)
+            if self.finalize_mode == "mux" and subtitle_track is None:
+                self.mux_audio(
+                    temp_video_path, temp_final_audio_path, output_file, audio.duration,
+                    video_filter=subtitle_filter,
+                )
+            else:
+                self.reencode_track(
+                    temp_video_path, temp_final_audio_path, output_file, audio.duration,
+                    subtitle_filter=subtitle_filter, subtitle_track=subtitle_track,
+                )
+            self.cleanup_temp_files()
+            self.progress.print_message(f"Đã tạo video thành công: {output_file}")
             
-            # Ghi video cuối cùng
-            self.progress.print_message(f"Đang ghi video vào: {output_file}")
+        except Exception as e:
+            self.progress.print_error(f"Lỗi khi tạo video: {str(e)}")
+            raise
+
+    def mux_audio(self, video_path, audio_path, output_file, duration, video_filter=None):
+        """Ghép audio vào video bằng stream copy (-c:v copy) và cắt theo thời lượng audio
+
+        Khi có video_filter (ví dụ chèn subtitle), hình được mã hóa lại một lần với filter đó.
+        """
+        self.progress.print_message(f"Đang ghép audio vào video: {output_file}")
+        if video_filter:
+            video_args = [
+                '-vf', video_filter,
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                '-b:v', self.bitrate,
+            ]
+        else:
+            video_args = ['-c:v', 'copy']
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', video_path,
+            '-i', audio_path,
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+            *video_args,
+            '-c:a', self.audio_codec_for(audio_path),
+            '-t', f'{duration:.3f}',
+            '-movflags', '+faststart',
+            output_file
+        ]
+        subprocess.run(cmd, check=True)
+        
+        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            raise Exception(f"Không thể tạo video: {output_file}")
+
+    def reencode_track(self, video_path, audio_path, output_file, duration, subtitle_filter=None, subtitle_track=None):
+        """Mã hóa lại hình bằng moviepy (chèn subtitle nếu có) rồi ghép audio bằng mux_audio
+
+        Hình được ghi ra file tạm không có audio; audio cuối cùng được ghép sau đó
+        bằng stream copy nên không phải giải mã vào bộ nhớ và mã hóa lại.
+        """
+        video_clip = VideoFileClip(video_path, audio=False)
+        try:
+            # Chèn subtitle: trộn dòng đang hiển thị vào từng khung hình bằng NumPy (như chế độ stream)
+            if subtitle_track is not None:
+                video_clip = video_clip.fl(
+                    lambda get_frame, t: self.burn_subtitle(get_frame(t), subtitle_track.text_at(t))
+                )
+            
+            temp_video_path = os.path.join(os.path.dirname(video_path), "temp_video_reencoded.mp4")
+            self.temp_files.append(temp_video_path)
+            self.progress.print_message(f"Đang mã hóa lại video: {temp_video_path}")
             video_clip.write_videofile(
-                output_file,
+                temp_video_path,
                 fps=self.fps,
                 codec='libx264',
-                audio_codec='aac',
+                audio=False,
                 bitrate=self.bitrate,
                 threads=1,
                 preset='ultrafast',
-                ffmpeg_params=['-loglevel', 'error'],
+                ffmpeg_params=['-loglevel', 'error'] + (['-vf', subtitle_filter] if subtitle_filter else []),
                 logger=None
             )
-            
-            # Đóng các clip
+        finally:
             video_clip.close()
-            audio_clip.close()
-            
-            # Xóa các file tạm
-            self.cleanup_temp_files()
-            
-            self.progress.print_message(f"Đã tạo video thành công: {output_file}")
+        
+        self.mux_audio(temp_video_path, audio_path, output_file, duration)
+
+    def audio_codec_for(self, audio_path):
+        """Audio cuối cùng đã là AAC (.m4a) thì chép nguyên luồng, không mã hóa lại"""
+        return 'copy' if audio_path.lower().endswith('.m4a') else 'aac'
+
+    def ingest_images(self, output_dir):
+        """Kiểm tra và chuẩn hóa các ảnh trong image_dir, trả về đường dẫn ảnh dùng để render (theo tên file)
+
+        Ảnh hỏng hoặc không phải ảnh bị bỏ qua ở đây thay vì lỗi giữa lúc render.
+        Bản chuẩn hóa nằm trong cache, hoặc output/temp/images khi tắt cache.
+        """
+        image_dir = os.path.abspath(self.image_dir)
+        if not os.path.exists(image_dir):
+            raise FileNotFoundError(f"Thư mục ảnh không tồn tại: {image_dir}")
+            
+        image_paths = [
+            os.path.join(image_dir, f) for f in sorted(os.listdir(image_dir))
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        if not image_paths:
+            raise FileNotFoundError("Không tìm thấy file ảnh nào.")
+        
+        # Bước ingest đã chạy trước (song song với audio) thì bước render dùng lại kết quả
+        signature = tuple((path, os.path.getsize(path), os.path.getmtime(path)) for path in image_paths)
+        with self._ingest_lock:
+            if self._ingested is not None and self._ingested[0] == signature:
+                return list(self._ingested[1])
+            
+            temp_dir = os.path.join(os.path.abspath(output_dir), "temp", "images")
+            sources = self.ingest.ingest_all(image_paths, temp_dir)
+            if not sources:
+                raise FileNotFoundError(f"Không có ảnh hợp lệ nào trong: {image_dir}")
+            if len(sources) < len(image_paths):
+                self.progress.print_warning(f"Bỏ qua {len(image_paths) - len(sources)}/{len(image_paths)} ảnh lỗi")
+            self._ingested = (signature, [sources[path] for path in image_paths if path in sources])
+            return list(self._ingested[1])
+
+    def build_playlist(self, audio_duration, output_dir):
+        """Danh sách đường dẫn ảnh theo thứ tự hiển thị, lặp lại cho đủ thời lượng audio"""
+        image_files = self.ingest_images(output_dir)
             
-        except Exception as e:
-            self.progress.print_error(f"Lỗi khi tạo video: {str(e)}")
-            raise
+        # Tính thời lượng video một lần chạy
+        single_run_duration = len(image_files) * self.image_duration
+        
+        # Tính số lần cần lặp lại video
+        n_repeats = int(np.ceil(audio_duration / single_run_duration))
+        
+        self.progress.print_message(f"Thời lượng video một lần chạy: {single_run_duration:.2f}s")
+        self.progress.print_message(f"Thời lượng audio: {audio_duration:.2f}s")
+        self.progress.print_message(f"Cần lặp lại video {n_repeats} lần")
+        
+        # Lặp lại danh sách ảnh theo số lần cần thiết
+        image_files = image_files * n_repeats
+        
+        # Tính số lượng ảnh cần thiết dựa trên thời lượng audio
+        required_images = int(np.ceil(audio_duration / self.image_duration))
+        
+        # Cắt bớt ảnh nếu nhiều hơn cần thiết
+        if len(image_files) > required_images:
+            self.progress.print_message(f"Có {len(image_files)} ảnh, chỉ cần {required_images} ảnh để khớp với audio {audio_duration:.2f}s")
+            image_files = image_files[:required_images]
+        
+        self.progress.print_message(f"Sử dụng {len(image_files)} ảnh để tạo video")
+        return image_files
+
+    def create_video_streaming(self, output_file, audio_path, audio_duration,
+                               video_filter=None, subtitle_track=None):
+        """Dựng khung hình theo thứ tự thời gian và đẩy thẳng vào một tiến trình ffmpeg"""
+        image_files = self.build_playlist(audio_duration, os.path.dirname(output_file))
+        frames_per_image = max(1, int(round(self.image_duration * self.fps)))
+        total_frames = int(np.ceil(audio_duration * self.fps))
+        
+        # Giữ lại các bộ dựng gần nhất để ảnh lặp lại không phải đọc và làm mờ lại
+        renderers = OrderedDict()
+        renderers_lock = threading.Lock()
+        
+        def prepare(img_file):
+            with renderers_lock:
+                renderer = renderers.get(img_file)
+                if renderer is not None:
+                    renderers.move_to_end(img_file)
+                    return renderer
+            self.progress.print_message(f"Đang xử lý ảnh: {os.path.basename(img_file)}")
+            renderer = self.create_zoom_renderer(img_file)
+            with renderers_lock:
+                renderers[img_file] = renderer
+                if len(renderers) > self.STREAM_RENDERER_CACHE:
+                    renderers.popitem(last=False)
+            return renderer
+        
+        self.progress.print_message(f"Đang stream {total_frames} khung hình vào: {output_file}")
+        writer = FFmpegStreamWriter(
+            output_file,
+            self.width,
+            self.height,
+            self.fps,
+            audio_path=audio_path,
+            bitrate=self.bitrate,
+            audio_codec=self.audio_codec_for(audio_path),
+            duration=audio_duration,
+            video_filter=video_filter,
+        )
+        # Chuẩn bị ảnh song song (đọc, làm mờ, tạo kim tự tháp) nhưng dựng khung hình
+        # đúng thứ tự; window giới hạn số bộ dựng chờ sẵn trong bộ nhớ
+        with ThreadPoolExecutor(max_workers=self.max_threads) as executor, writer:
+            for img_file, renderer in ordered_map(executor, prepare, image_files, window=self.max_threads):
+                if writer.frame_count >= total_frames:
+                    break
+                for i in range(min(frames_per_image, total_frames - writer.frame_count)):
+                    frame = self.apply_branding(renderer.render(i / self.fps))
+                    if subtitle_track is not None:
+                        text = subtitle_track.text_at(writer.frame_count / self.fps)
+                        self.subtitle_renderer.composite(frame, text)
+                    writer.write_frame(frame)
+        
+        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            raise Exception(f"Không thể tạo video: {output_file}")
 
-    def create_video_from_images(self, output_dir, audio_duration):
-        """Tạo video clip từ danh sách ảnh"""
+    def render_image_track(self, output_dir, audio_duration):
+        """Render các clip ảnh và ghép lại thành temp_video.mp4 (chưa có audio)"""
         try:
             temp_video_clips = []
             temp_dir = os.path.abspath(os.path.join(output_dir, "temp"))
             os.makedirs(temp_dir, exist_ok=True)
             
-            # Lấy danh sách ảnh
-            image_dir = os.path.abspath(self.image_dir)
-            if not os.path.exists(image_dir):
-                raise FileNotFoundError(f"Thư mục ảnh không tồn tại: {image_dir}")
-                
-            image_files = sorted(
-                [f for f in os.listdir(image_dir)
-                 if f.lower().endswith((".png", ".jpg", ".jpeg"))]
+            image_files = self.build_playlist(audio_duration, output_dir)
+            
+            # Mỗi ảnh chỉ render một lần, các lần lặp dùng lại cùng một clip
+            signature = self.render_signature()
+            clip_keys = {}
+            unique_images = {}
+            for img_file in dict.fromkeys(image_files):
+                key = self.clip_cache_key(img_file, signature)
+                clip_keys[img_file] = key
+                unique_images.setdefault(key, img_file)
+            self.progress.print_message(
+                f"Cần render {len(unique_images)} clip duy nhất cho {len(image_files)} lượt hiển thị"
             )
             
-            if not image_files:
-                raise FileNotFoundError("Không tìm thấy file ảnh nào.")
-                
-            # Tính thời lượng video một lần chạy
-            single_run_duration = len(image_files) * self.image_duration
-            
-            # Tính số lần cần lặp lại video
-            n_repeats = int(np.ceil(audio_duration / single_run_duration))
-            
-            self.progress.print_message(f"Thời lượng video một lần chạy: {single_run_duration:.2f}s")
-            self.progress.print_message(f"Thời lượng audio: {audio_duration:.2f}s")
-            self.progress.print_message(f"Cần lặp lại video {n_repeats} lần")
-            
-            # Lặp lại danh sách ảnh theo số lần cần thiết
-            image_files = image_files * n_repeats
-            
-            # Tính số lượng ảnh cần thiết dựa trên thời lượng audio
-            required_images = int(np.ceil(audio_duration / self.image_duration))
-            
-            # Cắt bớt ảnh nếu nhiều hơn cần thiết
-            if len(image_files) > required_images:
-                self.progress.print_message(f"Có {len(image_files)} ảnh, chỉ cần {required_images} ảnh để khớp với audio {audio_duration:.2f}s")
-                image_files = image_files[:required_images]
-            
-            self.progress.print_message(f"Sử dụng {len(image_files)} ảnh để tạo video")
-            
-            # Xử lý đa luồng
-            with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-                futures = []
-                for i, img_file in enumerate(image_files):
-                    futures.append(executor.submit(self.process_image, img_file, i, temp_dir))
-                    
-                for future in as_completed(futures):
-                    output_path = future.result()
-                    if output_path and os.path.exists(output_path):
-                        temp_video_clips.append(output_path)
+            # Clip đã có trong cache từ lần chạy trước thì bỏ qua bước render
+            clip_paths = {}
+            pending = {}
+            for key, img_file in unique_images.items():
+                cached_path = self.cache.get(key, ".mp4")
+                if cached_path:
+                    clip_paths[key] = cached_path
+                else:
+                    pending[key] = img_file
+            if clip_paths:
+                self.progress.print_message(f"Dùng lại {len(clip_paths)} clip từ cache")
+            
+            # Render song song bằng thread hoặc process
+            jobs = [
+                ClipJob(i, img_file, temp_dir, f"temp_video_{key}.mp4")
+                for i, (key, img_file) in enumerate(pending.items())
+            ]
+            job_keys = list(pending)
+            rendered_paths = []
+            for job, output_path in self.render_clips(jobs):
+                if output_path and os.path.exists(output_path):
+                    key = job_keys[job.index]
+                    output_path = self.cache.put(key, output_path, ".mp4")
+                    clip_paths[key] = output_path
+                    if not output_path.startswith(self.cache.cache_dir + os.sep):
+                        rendered_paths.append(output_path)
+            
+            # Ghép theo đúng thứ tự ảnh, clip trùng được tham chiếu nhiều lần
+            for img_file in image_files:
+                output_path = clip_paths.get(clip_keys[img_file])
+                if output_path:
+                    temp_video_clips.append(output_path)
             
             if not temp_video_clips:
                 raise Exception("Không thể tạo bất kỳ video clip nào từ ảnh.")
@@ -747,15 +849,10 @@ class VideoProcessor:
             # Chạy lệnh ffmpeg
             subprocess.run(cmd, check=True)
             
-            # Tải video đã ghép
-            final_video = VideoFileClip(temp_video_path)
-            if final_video is None:
-                raise Exception("Không thể tải video đã ghép")
-            
             # Lưu danh sách các file tạm để xóa sau
-            self.temp_files = temp_video_clips + [concat_file, temp_video_path]
+            self.temp_files.extend(rendered_paths + [concat_file, temp_video_path])
             
-            return final_video
+            return temp_video_path
             
         except Exception as e:
             self.progress.print_error(f"Lỗi khi tạo video từ ảnh: {str(e)}")
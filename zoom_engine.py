@@ -0,0 +1,154 @@
+import time
+import numpy as np
+import cv2
+from PIL import Image
+
+
+class ZoomRenderer:
+    """Dựng khung hình hiệu ứng zoom (Ken Burns) bằng NumPy/OpenCV
+
+    Ảnh chính được resize LANCZOS một lần thành một "kim tự tháp" các mức
+    kích thước, mỗi mức nhỏ hơn mức trước √2 lần. Mỗi khung hình chỉ cần chọn
+    mức gần nhất lớn hơn kích thước cần vẽ rồi warpAffine (bilinear) thẳng vào
+    một buffer uint8 được cấp phát sẵn, nên tỷ lệ thu nhỏ mỗi khung luôn nằm
+    trong [0.707, 1] và không bị răng cưa.
+    """
+
+    def __init__(self, background, main_img, width, height, zoom_start, zoom_end, duration):
+        self.width = width
+        self.height = height
+        self.zoom_start = zoom_start
+        self.zoom_end = zoom_end
+        self.duration = duration
+
+        # Ảnh nền cố định và buffer khung hình dùng lại cho mọi frame
+        self.background = np.ascontiguousarray(np.asarray(background, dtype=np.uint8)[:, :, :3])
+        if self.background.shape[:2] != (height, width):
+            raise ValueError(
+                f"Ảnh nền có kích thước {self.background.shape[1]}x{self.background.shape[0]}, "
+                f"cần {width}x{height}"
+            )
+        self.frame = np.empty_like(self.background)
+
+        if not isinstance(main_img, Image.Image):
+            main_img = Image.fromarray(np.asarray(main_img, dtype=np.uint8))
+        if main_img.mode != "RGB":
+            main_img = main_img.convert("RGB")
+        self.base_width, self.base_height = main_img.size
+        self.levels = self._build_pyramid(main_img)
+
+    def _build_pyramid(self, main_img):
+        """Tạo các mức ảnh chính từ zoom lớn nhất xuống zoom nhỏ nhất"""
+        max_zoom = max(self.zoom_start, self.zoom_end)
+        min_zoom = max(min(self.zoom_start, self.zoom_end), 1e-3)
+
+        levels = []
+        zoom = max_zoom
+        while True:
+            size = (
+                max(1, int(round(self.base_width * zoom))),
+                max(1, int(round(self.base_height * zoom))),
+            )
+            if size == main_img.size:
+                level = main_img
+            else:
+                level = main_img.resize(size, Image.Resampling.LANCZOS)
+            levels.append(np.ascontiguousarray(np.asarray(level, dtype=np.uint8)))
+            if zoom <= min_zoom or min(size) <= 1:
+                break
+            zoom /= np.sqrt(2.0)
+        return levels
+
+    def zoom_at(self, t):
+        """Hệ số zoom tại thời điểm t (tuyến tính từ zoom_start đến zoom_end)"""
+        return self.zoom_start + (self.zoom_end - self.zoom_start) * t / self.duration
+
+    def render(self, t):
+        """Trả về khung hình tại thời điểm t
+
+        Buffer trả về được dùng lại cho lần gọi tiếp theo, cần copy nếu muốn giữ.
+        """
+        zoom_factor = self.zoom_at(t)
+
+        # Kích thước và vị trí giống hệt cách tính cũ với PIL
+        current_width = int(self.base_width * zoom_factor)
+        current_height = int(self.base_height * zoom_factor)
+        np.copyto(self.frame, self.background)
+        if current_width <= 0 or current_height <= 0:
+            return self.frame
+        x_offset = (self.width - current_width) // 2
+        y_offset = (self.height - current_height) // 2
+
+        # Chọn mức nhỏ nhất vẫn lớn hơn hoặc bằng kích thước cần vẽ
+        level = self.levels[0]
+        for candidate in self.levels[1:]:
+            if candidate.shape[1] < current_width or candidate.shape[0] < current_height:
+                break
+            level = candidate
+
+        # Ma trận affine ánh xạ tâm pixel nguồn sang tâm pixel đích
+        scale_x = current_width / level.shape[1]
+        scale_y = current_height / level.shape[0]
+        matrix = np.array([
+            [scale_x, 0.0, x_offset + 0.5 * scale_x - 0.5],
+            [0.0, scale_y, y_offset + 0.5 * scale_y - 0.5],
+        ])
+        cv2.warpAffine(
+            level,
+            matrix,
+            (self.width, self.height),
+            dst=self.frame,
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_TRANSPARENT,
+        )
+        return self.frame
+
+
+def legacy_zoom_frame(background, main_img, width, height, zoom_factor):
+    """Cách dựng khung hình cũ bằng PIL (dùng để so sánh tốc độ)"""
+    new_img = background.copy()
+    current_width = int(main_img.size[0] * zoom_factor)
+    current_height = int(main_img.size[1] * zoom_factor)
+    current_main_img = main_img.resize((current_width, current_height), Image.Resampling.LANCZOS)
+    x_offset = (width - current_width) // 2
+    y_offset = (height - current_height) // 2
+    new_img.paste(current_main_img, (x_offset, y_offset))
+    return np.array(new_img)
+
+
+def benchmark(image_path=None, width=1920, height=1080, frames=90, zoom_start=0.9, zoom_end=1.4):
+    """So sánh số khung hình/giây giữa cách cũ (PIL) và ZoomRenderer"""
+    if image_path:
+        img = Image.open(image_path).convert("RGB")
+    else:
+        rng = np.random.default_rng(0)
+        img = Image.fromarray(rng.integers(0, 256, (1200, 1600, 3), dtype=np.uint8))
+
+    background = img.resize((width, height), Image.Resampling.LANCZOS)
+    scale = min(width * 0.9 / img.size[0], height * 0.9 / img.size[1])
+    main_img = img.resize(
+        (int(img.size[0] * scale), int(img.size[1] * scale)), Image.Resampling.LANCZOS
+    )
+    duration = float(frames)
+
+    start = time.perf_counter()
+    for i in range(frames):
+        zoom_factor = zoom_start + (zoom_end - zoom_start) * i / duration
+        legacy_zoom_frame(background, main_img, width, height, zoom_factor)
+    legacy_fps = frames / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    renderer = ZoomRenderer(background, main_img, width, height, zoom_start, zoom_end, duration)
+    for i in range(frames):
+        renderer.render(i)
+    engine_fps = frames / (time.perf_counter() - start)
+
+    return legacy_fps, engine_fps
+
+
+if __name__ == "__main__":
+    import sys
+
+    legacy_fps, engine_fps = benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"PIL (cũ):     {legacy_fps:8.1f} fps")
+    print(f"ZoomRenderer: {engine_fps:8.1f} fps ({engine_fps / legacy_fps:.1f}x)")